@@ -0,0 +1,231 @@
+import numpy as np
+import pandas as pd
+import trackpy as tp
+
+# Motility analytics (when "analytics" is true in the settings), worked out straight from each movie's linked tracks
+# while it's being tracked, and saved next to the condition's CSV once the condition is finished:
+#
+#   {condition}-Motility.csv       -> per movie (and all movies): # of tracks, % motile, mean speed of all tracks and
+#                                     of only the motile ones (average speed of at least "motile_speed" µm/s)
+#   {condition}-MSD.csv            -> mean squared displacement (µm²) vs lag time (s), per movie and for the condition
+#   {condition}-Speed Histogram.csv -> # of tracks per average speed bin ("speed_bin_width" µm/s wide)
+#   {condition}-Track Lengths.csv  -> # of tracks per track length (frames)
+#
+# Everything is worked out with whole column numpy/pandas operations (no loops over the particles). The MSD is the
+# same as trackpy's emsd (with trackpy's weights), for each movie and for the condition (all of its movies' tracks
+# pooled), so only the positions of each movie's tracks are kept until the condition is finished.
+
+
+def track_speeds(linked_obj, pixel_size, fps, min_track_length):
+    """
+    Vectorized version of the speed calculations from tracking_data_analysis, for one linked movie
+    Returns a dataframe with one row per track (particle): the average of its frame to frame speeds, and
+    its length in frames tracked. Tracks shorter than min_track_length frames are left out.
+    """
+    linked_obj = linked_obj.sort_values(by=["particle", "frame"])
+    particles = linked_obj["particle"].to_numpy()
+
+    # Frame to frame changes, which only count when both rows are the same particle
+    same_track = particles[1:] == particles[:-1]
+    dx = np.diff(linked_obj["x"].to_numpy())[same_track]
+    dy = np.diff(linked_obj["y"].to_numpy())[same_track]
+    frame_diff = np.diff(linked_obj["frame"].to_numpy())[same_track]
+
+    speeds = pd.Series(
+        np.sqrt(dx**2 + dy**2) * pixel_size * fps / frame_diff,
+        index=particles[1:][same_track],
+    )
+
+    tracks = pd.DataFrame(
+        {
+            "Avg Speed": speeds.groupby(level=0).mean(),
+            "Track Length": linked_obj.groupby("particle").size(),
+        }
+    )
+
+    # Single frame tracks don't have a speed, so they're always left out (like in the regular output)
+    tracks = tracks[tracks["Track Length"] >= max(min_track_length, 2)]
+    return tracks
+
+
+def emsd_by_lag(tracks, settings):
+    # trackpy's emsd (which works out each track's MSD one particle at a time), indexed by the lag time in frames
+    msd = tp.emsd(
+        tracks,
+        settings["pixel_size"],
+        settings["fps"],
+        max_lagtime=settings["msd_max_lagtime"],
+    )
+
+    # emsd's lag times (s) are averaged over the tracks, so they're put back to whole frames to line the movies up
+    msd.index = pd.Index(
+        np.rint(msd.index.to_numpy() * settings["fps"]).astype(np.int64), name="lag"
+    )
+    return msd
+
+
+def movie_msd(tracks, settings):
+    """
+    Returns the MSD (µm²) of a group of tracks for every lag time up to "msd_max_lagtime" frames, as a series
+    indexed by the lag time (frames). This is the same as trackpy's emsd: each track's MSD is the mean of its
+    squared displacements at each lag time (over the pairs of frames it was found in), and the tracks are averaged
+    with trackpy's weights (its estimate of each track's # of independent measurements).
+
+    Instead of working out every track on its own like emsd does, the displacements of every track are found at
+    once for each lag time, with the rows sorted by particle and frame: "the same particle, lag frames later" is
+    found for every row with one binary search. Only the lag times are looped over, never the particles
+    """
+    if len(tracks) == 0:
+        return pd.Series([], dtype=np.float64, index=pd.Index([], name="lag"))
+
+    # The weights are trackpy's own (if a trackpy version doesn't have them, emsd itself is used)
+    msd_weights = getattr(tp.motion, "_msd_N", None)
+    if msd_weights is None:
+        return emsd_by_lag(tracks, settings)
+
+    tracks = tracks.sort_values(by=["particle", "frame"])
+    particles, particle_index = np.unique(
+        tracks["particle"].to_numpy(), return_inverse=True
+    )
+    frames = tracks["frame"].to_numpy(dtype=np.int64)
+    x = tracks["x"].to_numpy(dtype=np.float64) * settings["pixel_size"]
+    y = tracks["y"].to_numpy(dtype=np.float64) * settings["pixel_size"]
+
+    # Frames from the start to the end of each track (including frames it wasn't found in), and the # of
+    # frames it was found in
+    track_starts = np.searchsorted(particle_index, np.arange(len(particles)))
+    track_rows = np.diff(np.append(track_starts, len(frames)))
+    track_spans = frames[track_starts + track_rows - 1] - frames[track_starts] + 1
+
+    # Like emsd, each track is only measured up to its own span (or msd_max_lagtime)
+    track_max_lags = np.minimum(settings["msd_max_lagtime"], track_spans - 1)
+    lags = np.arange(1, track_max_lags.max() + 1)
+
+    keys = particle_index * (frames.max() + lags[-1] + 1) + frames
+    squared_sums = np.zeros((len(lags), len(particles)))
+    pair_counts = np.zeros((len(lags), len(particles)))
+    for lag_num, lag in enumerate(lags):
+        later = np.minimum(np.searchsorted(keys, keys + lag), len(keys) - 1)
+        found = keys[later] == keys + lag
+        squared = (x[later[found]] - x[found]) ** 2 + (y[later[found]] - y[found]) ** 2
+
+        squared_sums[lag_num] = np.bincount(
+            particle_index[found], squared, len(particles)
+        )
+        pair_counts[lag_num] = np.bincount(particle_index[found], None, len(particles))
+
+    # trackpy's weights for each track, scaled down for the frames it wasn't found in. Lag times with no pairs
+    # (because of those frames) get no weight, and the track's other lag times make up for it, like in emsd
+    measured = lags[:, np.newaxis] <= track_max_lags[np.newaxis, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = (
+            msd_weights(track_spans, lags[:, np.newaxis]) * track_rows / track_spans
+        )
+        weights = np.where(measured, weights, 0)
+        total_weights = weights.sum(axis=0)
+
+        weights = np.where(pair_counts > 0, weights, 0)
+        measured_weights = weights.sum(axis=0)
+        weights *= np.where(measured_weights > 0, total_weights / measured_weights, 0)
+
+        track_msd = np.where(pair_counts > 0, squared_sums / pair_counts, 0)
+        msd = (track_msd * weights).sum(axis=1) / weights.sum(axis=1)
+
+    return pd.Series(msd, index=pd.Index(lags, name="lag"))
+
+
+def pooled_tracks(movie_tracks):
+    # Every movie's tracks together, with the particles numbered again so particles from different movies that
+    # happen to have the same # are kept as separate tracks
+    pooled = pd.concat(movie_tracks.values(), keys=movie_tracks.keys(), names=["File"])
+    pooled = pooled.reset_index(level=0).reset_index(drop=True)
+    pooled["particle"] = pooled.groupby(["File", "particle"], sort=False).ngroup()
+    return pooled
+
+
+def start_condition_analytics():
+    # The analytics for a condition are each movie's per track speeds, and the positions needed for the MSD
+    return {"tracks": [], "msd": {}}
+
+
+def add_movie_analytics(analytics, file_num, tracks, settings):
+    # Adds one movie's (filtered) tracks to its condition's analytics
+    movie_tracks = track_speeds(
+        tracks, settings["pixel_size"], settings["fps"], settings["min_track_length"]
+    )
+    movie_tracks.insert(0, "File", file_num)
+    analytics["tracks"].append(movie_tracks)
+
+    analytics["msd"][file_num] = tracks[["particle", "frame", "x", "y"]].copy()
+
+
+def motility_row(file_label, tracks, motile_speed):
+    # One row of the Motility.csv, for a group of tracks (one movie, or every movie)
+    motile = tracks["Avg Speed"] >= motile_speed
+
+    return {
+        "File": file_label,
+        "Tracks": len(tracks),
+        "Motile Tracks": int(motile.sum()),
+        "Percent Motile": 100 * motile.mean() if len(tracks) > 0 else np.nan,
+        "Mean Speed": tracks["Avg Speed"].mean(),
+        "Motile Mean Speed": tracks.loc[motile, "Avg Speed"].mean(),
+        "Mean Track Length": tracks["Track Length"].mean(),
+    }
+
+
+def write_condition_analytics(output_name, analytics, settings):
+    """
+    Saves the analytics files for a finished condition, named after output_name (see the top of the file)
+    """
+    if len(analytics["tracks"]) > 0:
+        tracks = pd.concat(analytics["tracks"])
+    else:
+        tracks = pd.DataFrame({"File": [], "Avg Speed": [], "Track Length": []})
+
+    # % motile and mean speeds, for each movie and then all of them together
+    motility_rows = [
+        motility_row(file_num, file_tracks, settings["motile_speed"])
+        for file_num, file_tracks in tracks.groupby("File")
+    ]
+    motility_rows.append(motility_row("All", tracks, settings["motile_speed"]))
+    pd.DataFrame(motility_rows).to_csv(f"{output_name}-Motility.csv", index=0)
+
+    # MSD for each movie, and for the condition from every movie's tracks pooled together
+    msd = pd.DataFrame(
+        {
+            f"File {file_num}": movie_msd(movie_tracks, settings)
+            for file_num, movie_tracks in analytics["msd"].items()
+        }
+    )
+    if len(analytics["msd"]) > 0:
+        msd["All"] = movie_msd(pooled_tracks(analytics["msd"]), settings)
+    msd = msd.sort_index()
+    msd.insert(0, "Lag Time (s)", msd.index / settings["fps"])
+    msd.to_csv(f"{output_name}-MSD.csv", index=0)
+
+    # Speed histogram, with the same bins for every movie so the columns line up
+    bin_width = settings["speed_bin_width"]
+    max_speed = tracks["Avg Speed"].max() if len(tracks) > 0 else 0
+    bin_edges = np.arange(0, np.nan_to_num(max_speed) + bin_width, bin_width)
+    if len(bin_edges) < 2:
+        bin_edges = np.array([0, bin_width])
+
+    histogram = pd.DataFrame(
+        {"Speed Bin Start": bin_edges[:-1], "Speed Bin End": bin_edges[1:]}
+    )
+    for file_num, file_tracks in tracks.groupby("File"):
+        histogram[f"File {file_num}"] = np.histogram(
+            file_tracks["Avg Speed"].dropna(), bin_edges
+        )[0]
+    histogram["All"] = np.histogram(tracks["Avg Speed"].dropna(), bin_edges)[0]
+    histogram.to_csv(f"{output_name}-Speed Histogram.csv", index=0)
+
+    # Track length distribution
+    track_lengths = (
+        tracks.groupby(["Track Length", "File"]).size().unstack(fill_value=0)
+    )
+    track_lengths.columns = [f"File {file_num}" for file_num in track_lengths.columns]
+    track_lengths["All"] = track_lengths.sum(axis=1)
+    track_lengths.index.name = "Track Length (frames)"
+    track_lengths.to_csv(f"{output_name}-Track Lengths.csv")
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+# Drift correction (when "drift_correction" is set in the settings), for removing slow stage drift from the tracks
+# before the speeds are worked out. Without it, the drift is added to the speed of every filament.
+#
+# The drift comes from the linked tracks alone (no second pass over the frames): every step a track takes from
+# one frame to the next is found, and the drift for that frame is the average step of all the tracks:
+#   "mean"   -> the mean step, the same as trackpy's compute_drift
+#   "median" -> the median step, which isn't pulled along by the filaments that are actually moving
+# The steps are added up into the drift trajectory (how far the stage has moved since the first frame), which is
+# subtracted from every position, and saved in {condition}-Drift.csv to check the correction.
+
+DRIFT_METHODS = ("mean", "median")
+
+
+def compute_drift(linked_obj, method, num_frames):
+    """
+    Returns the drift trajectory of a linked movie: a dataframe indexed by frame (every frame from 0 to
+    num_frames - 1), with the x and y drift in pixels since the first frame
+    Frames without any tracks found in the frame before them don't add any drift
+    """
+    if method not in DRIFT_METHODS:
+        raise ValueError(
+            f"{method} isn't a drift_correction Phil can use, the options are: {', '.join(DRIFT_METHODS)}"
+        )
+
+    linked_obj = linked_obj.sort_values(by=["particle", "frame"])
+    particles = linked_obj["particle"].to_numpy()
+    frames = linked_obj["frame"].to_numpy()
+
+    # Steps between consecutive frames of the same track (like compute_drift, steps over skipped frames aren't used)
+    steps = (particles[1:] == particles[:-1]) & (np.diff(frames) == 1)
+    frame_steps = pd.DataFrame(
+        {
+            "x": np.diff(linked_obj["x"].to_numpy(dtype=np.float64))[steps],
+            "y": np.diff(linked_obj["y"].to_numpy(dtype=np.float64))[steps],
+        },
+        index=pd.Index(frames[1:][steps], name="frame"),
+    )
+
+    frame_drift = frame_steps.groupby(level=0).agg(method)
+    frame_drift = frame_drift.reindex(range(num_frames), fill_value=0.0)
+
+    return frame_drift.cumsum()
+
+
+def subtract_drift(linked_obj, drift):
+    # Removes the drift from every position of the linked movie (in place, keeping the column types)
+    frames = linked_obj["frame"].to_numpy()
+
+    for column in ("x", "y"):
+        linked_obj[column] = (
+            linked_obj[column].to_numpy() - drift[column].to_numpy()[frames]
+        ).astype(linked_obj[column].dtype)
+
+
+def correct_drift(linked_obj, method, num_frames):
+    # Computes and removes the drift of a linked movie, returning the drift trajectory
+    drift = compute_drift(linked_obj, method, num_frames)
+    subtract_drift(linked_obj, drift)
+    return drift
+
+
+def write_condition_drift(output_name, movie_drifts):
+    """
+    Saves the drift trajectories (pixels) of a finished condition's movies, as {output_name}-Drift.csv
+    movie_drifts is a dictionary of file # -> drift trajectory (from correct_drift)
+    """
+    drift_tables = [
+        pd.DataFrame(
+            {
+                "File": file_num,
+                "Frame": drift.index,
+                "X Drift": drift["x"].to_numpy(),
+                "Y Drift": drift["y"].to_numpy(),
+            }
+        )
+        for file_num, drift in movie_drifts.items()
+    ]
+
+    if len(drift_tables) > 0:
+        drift_table = pd.concat(drift_tables)
+    else:
+        drift_table = pd.DataFrame(
+            {"File": [], "Frame": [], "X Drift": [], "Y Drift": []}
+        )
+
+    drift_table.to_csv(f"{output_name}-Drift.csv", index=0)
@@ -0,0 +1,130 @@
+import os.path
+import re
+
+# The grouping index replaces splitting the file list into runs of "# of files per condition".
+# Every filename is matched against a pattern with a condition and a file number in it, and the files are
+# grouped by condition (any number of files per condition), sorted by file number.
+#
+# There are three ways to write the naming convention:
+#   1. The original convention, surrounding the file number with asterisks:   ActinMyosin-*01*
+#      (the file number has the same # of digits, and the same position from the end of the name)
+#   2. Named fields, where * matches anything:   {condition}_{file_num}   or   *_{condition}-{file_num}
+#   3. A regular expression with named groups:   (?P<condition>.+)_run(?P<file_num>\d+)
+#
+# The naming convention always describes the original filename (no "Thresh-" or .tif/.avi), the same as before.
+
+
+def naming_pattern(naming_convention):
+    """
+    naming_pattern:
+    Input: naming_convention is a string, in one of the three formats above
+    Output: a compiled regular expression with "condition" and "file_num" groups
+
+    Raises a ValueError with a message for the user if the naming convention can't be used
+    """
+    # Regular expression
+    if "(?P<" in naming_convention:
+        try:
+            pattern = re.compile(naming_convention)
+        except re.error as e:
+            raise ValueError(f"The naming convention isn't a valid pattern:\n{e}")
+
+        if not {"condition", "file_num"} <= set(pattern.groupindex):
+            raise ValueError(
+                "The naming convention pattern needs both a (?P<condition>...) and a (?P<file_num>...) group."
+            )
+        return pattern
+
+    # Named fields
+    if "{condition}" in naming_convention or "{file_num}" in naming_convention:
+        if naming_convention.count("{condition}") != 1 or (
+            naming_convention.count("{file_num}") != 1
+        ):
+            raise ValueError(
+                "Please include {condition} and {file_num} exactly once in the naming convention.\ne.g. {condition}-{file_num}"
+            )
+
+        pattern = ""
+        for piece in re.split(r"(\{condition\}|\{file_num\}|\*)", naming_convention):
+            if piece == "{condition}":
+                pattern += "(?P<condition>.+?)"
+            elif piece == "{file_num}":
+                pattern += r"(?P<file_num>\d+)"
+            elif piece == "*":
+                pattern += ".*?"
+            else:
+                pattern += re.escape(piece)
+
+        return re.compile(pattern)
+
+    # The original asterisk convention
+    if naming_convention.count("*") != 2:
+        raise ValueError(
+            "Please check naming convention, and only surround the file number with one asterisk (*) on each side.\ne.g. Filename-*01*"
+        )
+
+    before, number, after = naming_convention.split("*")
+    if len(number) == 0:
+        raise ValueError(
+            "You forgot to surround the Naming Convention file number with asterisks (*)!"
+        )
+
+    # Everything before the number is the condition, and the text after the number can be anything
+    # as long as it is the same length (this is how the reverse indices worked)
+    return re.compile(
+        rf"(?P<condition>.+)(?P<file_num>\d{{{len(number)}}}).{{{len(after)}}}"
+    )
+
+
+def parse_filename(filename, pattern):
+    # Returns (condition, file number) for a thresholded file, or None if it doesn't follow the naming convention
+    name, extension = os.path.splitext(os.path.basename(filename))
+
+    if extension.lower() not in (".tif", ".tiff", ".avi", ".npz"):
+        return None
+
+    if name.startswith("Thresh-"):
+        name = name[7:]
+
+    match = pattern.fullmatch(name)
+    if match is None:
+        return None
+
+    return match.group("condition"), int(match.group("file_num"))
+
+
+def build_grouping_index(filepaths, naming_convention):
+    """
+    build_grouping_index:
+    Input: list of filepaths (e.g. the thresholded files), and the naming convention string
+    Output: grouping_index, unmatched
+
+    grouping_index is a dictionary of condition -> list of (file number, filepath), which looks like:
+        {
+            "ActinMyosin-": [(1, "Thresh-ActinMyosin-01.tif"), (2, "Thresh-ActinMyosin-02.tif")],
+            "ActinTpm-":    [(1, "Thresh-ActinTpm-01.tif"), (2, ...), (3, ...)],
+        }
+    The conditions are sorted by name and the files by number, so the order doesn't depend on os.listdir().
+    unmatched is the list of filepaths that didn't follow the naming convention (these are left out)
+    """
+    pattern = naming_pattern(naming_convention)
+
+    grouping_index = {}
+    unmatched = []
+
+    for filepath in filepaths:
+        parsed = parse_filename(filepath, pattern)
+
+        if parsed is None:
+            unmatched.append(filepath)
+            continue
+
+        condition, file_num = parsed
+        grouping_index.setdefault(condition, []).append((file_num, filepath))
+
+    grouping_index = {
+        condition: sorted(grouping_index[condition])
+        for condition in sorted(grouping_index)
+    }
+
+    return grouping_index, unmatched
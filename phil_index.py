@@ -0,0 +1,327 @@
+import glob
+import json
+import os
+import os.path
+import re
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+# The results index, a small database of every run Phil has done (when "results_index" is turned on in the settings,
+# it's off by default)
+#
+#   python3 phil_main.py --index-add FOLDER [FOLDER ...]   (adds runs from before the index, or copied from elsewhere)
+#   python3 phil_main.py --index-runs                      (lists every run in the index)
+#   python3 phil_main.py --index-conditions "ActinMyosin*" (compares a condition across every run)
+#   python3 phil_main.py --index-sql "SELECT ..."          (any other question)
+#
+# It's a single SQLite file (~/.philament/results.sqlite), so nothing extra needs to be installed, and it can be
+# opened with any SQLite tool. Comparing conditions across months of runs becomes a query of these tables,
+# instead of going back through every run's folder of CSVs:
+#
+#   runs       -> one row per run: the output folder, when it ran, the threshold value, the settings (as JSON, so
+#                 they can be filtered with json_extract(settings, '$.search_range')), the timings and any errors
+#   conditions -> one row per condition per run, the same as the run's Summary.csv
+#   files      -> one row per movie: # of tracks, and the mean track speed, path length and object size
+#   tracks     -> one row per track, the first columns of the condition CSVs (everything but the frame speeds)
+
+INDEX_PATH = os.path.join(os.path.expanduser("~"), ".philament", "results.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    output_dir TEXT UNIQUE,
+    run_time TEXT,
+    threshold_value REAL,
+    settings TEXT,
+    timings TEXT,
+    errors TEXT
+);
+CREATE TABLE IF NOT EXISTS conditions (
+    run_id INTEGER REFERENCES runs (run_id),
+    condition TEXT,
+    num_files INTEGER,
+    average_speed REAL,
+    speed_sem REAL,
+    total_objects INTEGER,
+    PRIMARY KEY (run_id, condition)
+);
+CREATE TABLE IF NOT EXISTS files (
+    run_id INTEGER REFERENCES runs (run_id),
+    condition TEXT,
+    file_num INTEGER,
+    num_tracks INTEGER,
+    mean_speed REAL,
+    mean_path_length REAL,
+    mean_obj_size REAL,
+    PRIMARY KEY (run_id, condition, file_num)
+);
+CREATE TABLE IF NOT EXISTS tracks (
+    run_id INTEGER REFERENCES runs (run_id),
+    condition TEXT,
+    file_num INTEGER,
+    particle INTEGER,
+    avg_obj_size REAL,
+    std_obj_size REAL,
+    first_x REAL,
+    first_y REAL,
+    first_frame INTEGER,
+    avg_speed REAL,
+    speed_std REAL,
+    path_length REAL,
+    displacement REAL
+);
+CREATE INDEX IF NOT EXISTS conditions_by_name ON conditions (condition);
+CREATE INDEX IF NOT EXISTS files_by_condition ON files (condition, run_id);
+CREATE INDEX IF NOT EXISTS tracks_by_condition ON tracks (condition, run_id, file_num);
+"""
+
+# Columns of the condition CSVs saved in the tracks table (the frame by frame speeds are left in the CSVs)
+TRACK_COLUMNS = {
+    "File": "file_num",
+    "Particle": "particle",
+    "Avg_Obj_Size": "avg_obj_size",
+    "Std_Obj_Size": "std_obj_size",
+    "FirstX": "first_x",
+    "FirstY": "first_y",
+    "First_Frame": "first_frame",
+    "Avg Speed": "avg_speed",
+    "Speed Std": "speed_std",
+    "Path Length": "path_length",
+    "Displacement": "displacement",
+}
+
+
+def open_index(index_path=INDEX_PATH):
+    # Opens the index (making it the first time), the connection is closed by the caller
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+
+    connection = sqlite3.connect(index_path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def register_run(
+    output_dir,
+    settings,
+    threshold_value,
+    timings=None,
+    errors="",
+    run_time=None,
+    index_path=INDEX_PATH,
+):
+    """
+    register_run takes in:
+        output_dir -> folder of the finished run (with its Summary.csv and condition CSVs)
+        settings -> dict of the Phil settings the run used
+        threshold_value -> the run's thresholding value (None if it's unknown)
+        timings -> dict of how long parts of the run took, in seconds
+        errors -> caught exceptions from the run
+        run_time -> when the run happened (defaults to now)
+
+    Adds the run to the index (replacing it if the folder was already added), and returns its run_id
+    """
+    output_dir = os.path.abspath(output_dir)
+    # Condition names are read as they were written (otherwise a condition like "01" comes back as 1, and "NA" as
+    # a missing value), so they still match the names of the condition CSVs
+    summary = pd.read_csv(
+        os.path.join(output_dir, "Summary.csv"),
+        dtype={"Condition": str},
+        keep_default_na=False,
+        na_values=[""],
+    )
+
+    # Only the per track columns are read, so the wide frame speed columns aren't even parsed
+    # (the file numbers are always whole numbers, like in the grouping index)
+    condition_tracks = {}
+    for condition in summary["Condition"]:
+        csv_path = os.path.join(output_dir, f"{condition}.csv")
+        if os.path.exists(csv_path):
+            condition_tracks[condition] = pd.read_csv(
+                csv_path,
+                usecols=lambda column: column in TRACK_COLUMNS,
+                dtype={"File": "int64"},
+            ).rename(columns=TRACK_COLUMNS)
+
+    connection = open_index(index_path)
+    try:
+        # Everything goes in (or nothing does, if something goes wrong), in one transaction
+        with connection:
+            old_run = connection.execute(
+                "SELECT run_id FROM runs WHERE output_dir = ?", (output_dir,)
+            ).fetchone()
+            if old_run is not None:
+                for table in ("tracks", "files", "conditions", "runs"):
+                    connection.execute(
+                        f"DELETE FROM {table} WHERE run_id = ?", (old_run[0],)
+                    )
+
+            run_id = connection.execute(
+                "INSERT INTO runs (output_dir, run_time, threshold_value, settings, timings, errors) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    output_dir,
+                    run_time or datetime.now().isoformat(timespec="seconds"),
+                    threshold_value,
+                    json.dumps(settings),
+                    json.dumps(timings or {}),
+                    errors,
+                ),
+            ).lastrowid
+
+            connection.executemany(
+                "INSERT INTO conditions VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        run_id,
+                        row["Condition"],
+                        int(row["# of Files"]),
+                        float(row["Average Speed"]),
+                        float(row["Speed SEM"]),
+                        int(row["Total # of Objects"]),
+                    )
+                    for _, row in summary.iterrows()
+                ],
+            )
+
+            for condition, tracks in condition_tracks.items():
+                tracks.insert(0, "condition", condition)
+                tracks.insert(0, "run_id", run_id)
+                tracks.to_sql("tracks", connection, if_exists="append", index=False)
+
+                files = tracks.groupby("file_num").agg(
+                    num_tracks=("avg_speed", "size"),
+                    mean_speed=("avg_speed", "mean"),
+                    mean_path_length=("path_length", "mean"),
+                    mean_obj_size=("avg_obj_size", "mean"),
+                )
+                files.insert(0, "condition", condition)
+                files.insert(0, "run_id", run_id)
+                files.reset_index().to_sql(
+                    "files", connection, if_exists="append", index=False
+                )
+
+    finally:
+        connection.close()
+
+    return run_id
+
+
+def read_phil_output(output_dir):
+    """
+    Reads the settings, threshold value, run time and errors back out of a run's newest PhilOutput file, for adding
+    runs to the index that were done before it existed. Returns a dictionary of what was found
+    """
+    phil_outputs = sorted(glob.glob(os.path.join(output_dir, "PhilOutput-*.txt")))
+    if len(phil_outputs) == 0:
+        raise FileNotFoundError(f"No PhilOutput file was found in {output_dir}")
+
+    with open(phil_outputs[-1]) as f:
+        text = f.read()
+
+    run_info = {
+        "settings": {},
+        "threshold_value": None,
+        "timings": {},
+        "errors": "",
+        "run_time": None,
+    }
+
+    settings_text = re.search(r"Parameters used were:\n(.*?\n})\n", text, re.DOTALL)
+    if settings_text is not None:
+        run_info["settings"] = json.loads(settings_text.group(1))
+
+    threshold_text = re.search(r"Thresholding Value:\n([-\d.]+)\n", text)
+    if threshold_text is not None:
+        run_info["threshold_value"] = float(threshold_text.group(1))
+
+    total_time = re.search(r"Total time to run was ([\d.]+) sec", text)
+    if total_time is not None:
+        run_info["timings"]["total_sec"] = float(total_time.group(1))
+
+    errors_text = re.search(r"Errors:\n(.*)", text, re.DOTALL)
+    if errors_text is not None and errors_text.group(1).strip() != "None":
+        run_info["errors"] = errors_text.group(1).strip()
+
+    # The run time is in the file's name (PhilOutput-2024-05-01_14.03.22.txt)
+    name_time = re.search(r"(\d{4}-\d{2}-\d{2}_\d{2}\.\d{2}\.\d{2})", phil_outputs[-1])
+    if name_time is not None:
+        run_info["run_time"] = datetime.strptime(
+            name_time.group(1), "%Y-%m-%d_%H.%M.%S"
+        ).isoformat()
+
+    return run_info
+
+
+def add_finished_run(output_dir, index_path=INDEX_PATH):
+    # Adds a run to the index from its output folder alone (see read_phil_output)
+    run_info = read_phil_output(output_dir)
+
+    return register_run(
+        output_dir,
+        run_info["settings"],
+        run_info["threshold_value"],
+        run_info["timings"],
+        run_info["errors"],
+        run_info["run_time"],
+        index_path,
+    )
+
+
+def query(sql, params=(), index_path=INDEX_PATH):
+    # Runs any query on the index, and returns the result as a DataFrame
+    connection = open_index(index_path)
+    try:
+        return pd.read_sql_query(sql, connection, params=params)
+    finally:
+        connection.close()
+
+
+def list_runs(index_path=INDEX_PATH):
+    return query(
+        """
+        SELECT runs.run_id, run_time, output_dir, threshold_value,
+            COUNT(conditions.condition) AS conditions, SUM(conditions.num_files) AS files
+        FROM runs LEFT JOIN conditions ON conditions.run_id = runs.run_id
+        GROUP BY runs.run_id
+        ORDER BY run_time
+        """,
+        index_path=index_path,
+    )
+
+
+def compare_conditions(pattern="*", index_path=INDEX_PATH):
+    """
+    Returns every run's summary row for the conditions matching pattern (* matches anything, like the naming
+    convention), oldest run first, with the settings that most often change between runs next to them
+    """
+    return query(
+        """
+        SELECT run_time, condition, num_files, average_speed, speed_sem, total_objects, threshold_value,
+            json_extract(settings, '$.pixel_size') AS pixel_size,
+            json_extract(settings, '$.fps') AS fps,
+            json_extract(settings, '$.search_range') AS search_range,
+            json_extract(settings, '$.trk_memory') AS trk_memory,
+            json_extract(settings, '$.object_area') AS object_area,
+            output_dir
+        FROM conditions JOIN runs ON runs.run_id = conditions.run_id
+        WHERE condition LIKE ?
+        ORDER BY condition, run_time
+        """,
+        (pattern.replace("*", "%"),),
+        index_path,
+    )
+
+
+def index_run(output_dir, settings, threshold_value, timings=None, errors=""):
+    # Adds a just finished run to the index (if "results_index" is on). The results are already saved by this
+    # point, so a problem with the index doesn't end the run; it's returned instead, to be added to the run's errors
+    # (and so its PhilOutput file) like any other error
+    if not settings["results_index"]:
+        return ""
+    try:
+        register_run(output_dir, settings, threshold_value, timings, errors)
+    except (sqlite3.Error, OSError, ValueError, KeyError) as e:
+        return f"The run couldn't be added to the results index ({INDEX_PATH}): {e}\n"
+    return ""
@@ -0,0 +1,463 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from fractions import Fraction
+from itertools import chain
+import mmap
+
+import cv2
+import numpy as np
+import tifffile as tif
+
+from phil_sparse import decode_masks, read_sparse_movie
+
+# Reading and writing movies happens in background threads, so the disk (or network share) is busy reading the
+# next movies and saving the finished ones while the current movie is being processed.
+#
+#   prefetch      -> a reader thread that decodes up to "depth" movies ahead of the one being processed
+#   start_writer  -> a writer thread that saves finished outputs in order, with at most "depth" waiting
+#
+# Both are capped by the depth, so no more than a few movies are ever held in memory at once.
+# A depth of 0 turns the threads off (everything is read/written right when it's needed, like before).
+#
+# Uncompressed 8 bit grayscale .tif files (like the Thresh- files, and most of the files from our cameras) are
+# memory mapped instead of read (see open_tif_stack). The frames are then read straight from the file when
+# they're used, without copying the whole movie into memory first, and every process working on the same file
+# shares the operating system's cached copy of it.
+#
+# A memory mapped movie isn't actually read until its frames are used, so on its own the reader thread would only
+# open the file, and the reading would happen on the processing thread anyway. To keep the read ahead, prefetch
+# reads memory mapped movies into the operating system's cache in the reader thread too (see read_into_cache).
+#
+# .avi files are decoded with PyAV directly (rather than through pims), with FFmpeg's own decoding threads turned on.
+# Thresholded .avi files are saved with the codec set by "avi_codec" in the settings:
+#   XVID  -> the original lossy codec (color frames, written with opencv), the default so files open anywhere
+#   FFV1  -> lossless and compressed, single channel
+#   GRAY  -> uncompressed single channel frames (largest files, but the fastest to read and write)
+# The lossless codecs keep the mask edges exactly as they were thresholded, and are saved as grayscale, so
+# they don't need to be converted from color again when they're tracked.
+
+# High resolution cameras can be binned with "binning" in the settings, which averages every N x N block of
+# pixels into one pixel as the original movies are read for thresholding (see bin_frames). Everything after
+# that (the blur, thresholding, saved Thresh- files and tracking) works on the smaller frames.
+
+# Codec for each "avi_codec" setting that's written with PyAV (XVID is written with opencv, like before)
+AVI_CODECS = {"XVID": None, "FFV1": "ffv1", "GRAY": "rawvideo"}
+
+
+def can_memory_map(tiff):
+    """
+    Returns if the first series of an open TiffFile can be memory mapped and still give the same frames the regular
+    readers would: uncompressed and contiguous 8 bit grayscale (black is 0) images, without a color palette.
+    Palette (indexed) and "white is 0" files would give the raw pixel values instead of their brightness
+    """
+    series = tiff.series[0]
+    first_page = tiff.pages[0]
+
+    return (
+        series.dtype == np.uint8
+        and "S" not in series.axes
+        and len(series.shape) in (2, 3)
+        and series.dataoffset is not None
+        and first_page.photometric == tif.PHOTOMETRIC.MINISBLACK
+        and first_page.colormap is None
+    )
+
+
+def open_tif_stack(filepath):
+    """
+    Returns the frames of a .tif as a read-only memory map (frames x height x width), or None if the file can't be
+    memory mapped the same way the regular readers would read it (compressed or tiled files, color, palette or
+    "white is 0" images, 16 bit images, see can_memory_map)
+    """
+    try:
+        with tif.TiffFile(filepath) as tiff:
+            if not can_memory_map(tiff):
+                return None
+
+        frames = tif.memmap(filepath, mode="r")
+
+    # Anything tifffile can't memory map is left for the regular readers
+    except Exception:
+        return None
+
+    # Single images are made into a "movie" of 1 frame, like imreadmulti does
+    if frames.ndim == 2:
+        frames = frames[np.newaxis]
+
+    return frames
+
+
+def frame_chunk(frames, first_frame, last_frame):
+    # Frames to send to another process (e.g. the locate pool). For memory mapped movies, this is just where the
+    # frames are in the file, so the other process maps them itself rather than being sent a copy of the pixels
+    last_frame = min(last_frame, len(frames))
+
+    if isinstance(frames, np.memmap) and frames.flags.c_contiguous:
+        return {
+            "filename": frames.filename,
+            "offset": frames.offset + first_frame * frames[0].nbytes,
+            "shape": (last_frame - first_frame,) + frames.shape[1:],
+            "dtype": frames.dtype.str,
+        }
+
+    return frames[first_frame:last_frame]
+
+
+def load_frame_chunk(chunk):
+    # Opposite of frame_chunk, used in the process the frames were sent to
+    if isinstance(chunk, dict):
+        return np.memmap(
+            chunk["filename"],
+            dtype=chunk["dtype"],
+            mode="r",
+            offset=chunk["offset"],
+            shape=chunk["shape"],
+        )
+
+    return chunk
+
+
+def iter_avi_frames(filepath, grayscale=False):
+    """
+    Decodes the frames of an .avi with PyAV one at a time (the same RGB frames pims gave us before)
+    With grayscale, the frames are converted to grayscale the same way the Thresh- .avi files always were,
+    except for single channel (FFV1/GRAY) files, which are read as grayscale with no conversion at all
+    """
+    # PyAV takes a while to import, so it's only imported for .avi files
+    import av
+
+    with av.open(filepath) as container:
+        stream = container.streams.video[0]
+        # Lets FFmpeg decode several frames at once in its own threads
+        stream.thread_type = "AUTO"
+
+        if grayscale and stream.codec_context.pix_fmt == "gray":
+            for frame in container.decode(stream):
+                yield frame.to_ndarray(format="gray")
+
+        # Converted as they're decoded, so the color frames aren't all held in memory at once
+        elif grayscale:
+            for frame in container.decode(stream):
+                yield cv2.cvtColor(frame.to_ndarray(format="rgb24"), cv2.COLOR_BGR2GRAY)
+
+        else:
+            for frame in container.decode(stream):
+                yield frame.to_ndarray(format="rgb24")
+
+
+def read_avi_frames(filepath, grayscale=False):
+    # Every frame of an .avi as a list (see iter_avi_frames)
+    return list(iter_avi_frames(filepath, grayscale))
+
+
+def iter_chunks(frames, chunk_frames):
+    # Groups the frames from any iterator into lists of up to chunk_frames frames
+    chunk = []
+    for frame in frames:
+        chunk.append(frame)
+        if len(chunk) == chunk_frames:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+
+
+def bin_frames(frames, binning):
+    """
+    Averages every binning x binning block of pixels into one pixel (rounded to the nearest value), for every
+    frame of the movie at once. Rows and columns left over at the bottom/right edges are cut off.
+    Returns the binned frames as a uint8 array (frames x height x width, plus the color channels for .avi files)
+    """
+    if int(binning) != binning or binning < 1:
+        raise ValueError(
+            f"binning has to be a whole number of 1 or more, not {binning}"
+        )
+
+    binning = int(binning)
+    if binning == 1 or len(frames) == 0:
+        return frames
+
+    frames = np.asarray(frames)
+    num_frames, height, width = frames.shape[:3]
+    height -= height % binning
+    width -= width % binning
+
+    blocks = frames[:, :height, :width].reshape(
+        (num_frames, height // binning, binning, width // binning, binning)
+        + frames.shape[3:]
+    )
+
+    # Summing as integers (rather than taking the mean as floats) keeps this fast, and the result exact
+    block_sums = blocks.sum(axis=(2, 4), dtype=np.uint32)
+    return ((block_sums + binning**2 // 2) // binning**2).astype(np.uint8)
+
+
+def read_raw_movie(filepath, is_avi, binning=1):
+    # Reads an original movie for thresholding, as a list of frames
+    # (grayscale for .tif, and the color frames from PyAV for .avi, the same as before)
+    # .tif files are memory mapped when they can be, otherwise they're read with opencv
+    # With binning, the frames are binned as they're read (see bin_frames)
+    if is_avi:
+        return bin_frames(read_avi_frames(filepath), binning)
+
+    frames = open_tif_stack(filepath)
+    if frames is None:
+        loaded, frames = cv2.imreadmulti(
+            mats=[],
+            filename=f"{filepath}",
+            flags=cv2.IMREAD_GRAYSCALE,
+        )
+
+    return bin_frames(frames, binning)
+
+
+def read_first_frame(filepath, is_avi, binning=1):
+    # Reads just the first frame of an original movie (for the thresholding preview), binned the same way
+    # read_raw_movie bins the frames that are actually thresholded
+    if is_avi:
+        avi_frames = iter_avi_frames(filepath)
+        frame = next(avi_frames)
+        avi_frames.close()
+
+    else:
+        frames = open_tif_stack(filepath)
+        if frames is None:
+            frame = cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
+        else:
+            frame = np.asarray(frames[0])
+
+    return bin_frames([frame], binning)[0]
+
+
+def read_thresholded_movie(filepath, is_avi):
+    # Reads a thresholded (Thresh-) movie for tracking, as grayscale frames
+    # (sparse .npz movies are decoded back into full frames, see phil_sparse.py)
+    if filepath.endswith(".npz"):
+        return decode_masks(read_sparse_movie(filepath))
+
+    if is_avi:
+        return read_avi_frames(filepath, grayscale=True)
+
+    frames = open_tif_stack(filepath)
+    if frames is not None:
+        return frames
+
+    return tif.imread(filepath)
+
+
+def read_raw_chunks(filepath, is_avi, chunk_frames, binning=1):
+    # Reads an original movie chunk_frames frames at a time (the same frames as read_raw_movie), for movies
+    # too big to hold in memory all at once (see phil_memory.py)
+    if is_avi:
+        for chunk in iter_chunks(iter_avi_frames(filepath), chunk_frames):
+            yield bin_frames(chunk, binning)
+        return
+
+    frames = open_tif_stack(filepath)
+    if frames is not None:
+        for first_frame in range(0, len(frames), chunk_frames):
+            yield bin_frames(frames[first_frame : first_frame + chunk_frames], binning)
+        return
+
+    num_frames = cv2.imcount(filepath)
+    for first_frame in range(0, num_frames, chunk_frames):
+        loaded, chunk = cv2.imreadmulti(
+            filepath,
+            start=first_frame,
+            count=min(chunk_frames, num_frames - first_frame),
+            flags=cv2.IMREAD_GRAYSCALE,
+        )
+        yield bin_frames(chunk, binning)
+
+
+def read_thresholded_chunks(filepath, is_avi, chunk_frames):
+    # Reads a thresholded movie chunk_frames frames at a time (the same frames as read_thresholded_movie)
+    if filepath.endswith(".npz"):
+        sparse = read_sparse_movie(filepath)
+        for first_frame in range(0, int(sparse["shape"][0]), chunk_frames):
+            yield decode_masks(sparse, first_frame, first_frame + chunk_frames)
+        return
+
+    if is_avi:
+        yield from iter_chunks(iter_avi_frames(filepath, grayscale=True), chunk_frames)
+        return
+
+    # Each chunk is mapped on its own, since a slice of a memory map keeps the offset of the whole movie
+    # (which frame_chunk would then send to the locate pool)
+    frames = open_tif_stack(filepath)
+    if frames is not None:
+        for first_frame in range(0, len(frames), chunk_frames):
+            yield load_frame_chunk(
+                frame_chunk(frames, first_frame, first_frame + chunk_frames)
+            )
+        return
+
+    with tif.TiffFile(filepath) as tiff:
+        num_frames = len(tiff.pages)
+        for first_frame in range(0, num_frames, chunk_frames):
+            chunk = tiff.asarray(
+                key=range(first_frame, min(first_frame + chunk_frames, num_frames))
+            )
+
+            # A chunk of one frame comes back as just the frame
+            if chunk.ndim == 2:
+                chunk = chunk[np.newaxis]
+            yield chunk
+
+
+def write_thresholded_avi(filename, threshold_images, fps, codec="XVID"):
+    # threshold_images can be any iterable of frames (e.g. a generator, for streamed movies)
+    if codec not in AVI_CODECS:
+        raise ValueError(
+            f"{codec} isn't an avi_codec Phil can use, the options are: {', '.join(AVI_CODECS)}"
+        )
+
+    threshold_images = iter(threshold_images)
+    first_image = next(threshold_images, None)
+    if first_image is None:
+        return
+
+    if AVI_CODECS[codec] is not None:
+        write_lossless_avi(
+            filename, first_image, threshold_images, fps, AVI_CODECS[codec]
+        )
+        return
+
+    # Fourcc code for AVI
+    fourcc = cv2.VideoWriter_fourcc(*"XVID")
+    avi_size = first_image.shape
+
+    avi_image = cv2.VideoWriter(filename, fourcc, fps, (avi_size[1], avi_size[0]))
+    avi_image.write(first_image)
+    for image in threshold_images:
+        avi_image.write(image)
+    avi_image.release()
+
+
+def read_into_cache(frames):
+    """
+    Reads a memory mapped movie into the operating system's cache (one byte from every page, in order), so its
+    frames are already in memory when they're used. The frames stay memory mapped, so they're still shared between
+    processes, and the cached pages can be dropped again by the OS if memory runs low.
+    Anything that isn't memory mapped is returned as it is
+    """
+    if not isinstance(frames, np.memmap) or len(frames) == 0:
+        return frames
+
+    # Asking for the whole file up front lets the OS read it in large sequential blocks
+    if getattr(frames, "_mmap", None) is not None and hasattr(mmap, "MADV_WILLNEED"):
+        frames._mmap.madvise(mmap.MADV_WILLNEED)
+
+    # Touching one pixel per page makes the OS actually read each page (here, rather than when it's processed)
+    if frames.flags.c_contiguous:
+        page_pixels = max(1, mmap.PAGESIZE // frames.itemsize)
+        np.bitwise_or.reduce(frames.reshape(-1)[::page_pixels])
+
+    return frames
+
+
+def prefetch(items, load, depth):
+    """
+    prefetch takes in:
+        items -> list of things to load (e.g. filepaths)
+        load -> function that loads one item (e.g. read_raw_movie)
+        depth -> how many items to load ahead of the one being used
+
+    Yields (item, future) in the same order as items, where future.result() returns the loaded item
+    (or raises whatever error happened while loading it, so errors show up for the right file)
+    With the reader thread on, memory mapped movies are read into the OS cache there too (see read_into_cache)
+    """
+    if depth < 1:
+        for item in items:
+            future = Future()
+            try:
+                future.set_result(load(item))
+            except Exception as e:
+                future.set_exception(e)
+            yield item, future
+        return
+
+    def load_ahead(item):
+        return read_into_cache(load(item))
+
+    items = iter(items)
+    no_more_items = object()
+    pending = deque()
+
+    # One reader thread, so the movies are read in order (and the disk isn't jumping between files)
+    with ThreadPoolExecutor(max_workers=1) as reader:
+        for item in items:
+            pending.append((item, reader.submit(load_ahead, item)))
+            if len(pending) == depth:
+                break
+
+        while len(pending) > 0:
+            item, future = pending.popleft()
+
+            # Starting on the next movie before handing this one over
+            next_item = next(items, no_more_items)
+            if next_item is not no_more_items:
+                pending.append((next_item, reader.submit(load_ahead, next_item)))
+
+            yield item, future
+
+
+def start_writer(depth):
+    # The writer is a dictionary holding the writer thread and the writes that haven't finished yet
+    if depth < 1:
+        return {"pool": None, "pending": deque(), "depth": 0}
+
+    return {
+        "pool": ThreadPoolExecutor(max_workers=1),
+        "pending": deque(),
+        "depth": depth,
+    }
+
+
+def submit_write(writer, write, *args):
+    # Saves something in the writer thread (e.g. submit_write(writer, tif.imwrite, filename, array))
+    if writer["pool"] is None:
+        write(*args)
+        return
+
+    writer["pending"].append(writer["pool"].submit(write, *args))
+
+    # If the disk can't keep up, this waits for the oldest write, so the outputs waiting can't pile up in memory
+    while len(writer["pending"]) > writer["depth"]:
+        writer["pending"].popleft().result()
+
+
+def finish_writer(writer):
+    # Waits for every write to finish (and raises any error that happened while writing)
+    while len(writer["pending"]) > 0:
+        writer["pending"].popleft().result()
+
+    if writer["pool"] is not None:
+        writer["pool"].shutdown()
+
+
+def write_lossless_avi(filename, first_image, threshold_images, fps, codec_name):
+    # Saves the frames (first_image, then the rest of threshold_images) as single channel (grayscale) video with
+    # PyAV, encoded in FFmpeg's threads
+    import av
+
+    with av.open(filename, "w") as container:
+        stream = container.add_stream(
+            codec_name, rate=Fraction(fps).limit_denominator(1001)
+        )
+        stream.height, stream.width = first_image.shape[:2]
+        stream.pix_fmt = "gray"
+        stream.thread_type = "AUTO"
+
+        for image in chain([first_image], threshold_images):
+            # Frames thresholded from color .avi files are made grayscale here (the same conversion used when tracking)
+            if image.ndim == 3:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+            container.mux(
+                stream.encode(av.VideoFrame.from_ndarray(image, format="gray"))
+            )
+
+        # Flushing the frames still in the encoder
+        container.mux(stream.encode())
@@ -6,7 +6,6 @@
 # Feel free to shoot me an email if you have any questions!
 
 
-import trackpy as tp
 from tkinter import ttk
 from tkinter.messagebox import showinfo
 from tkinter import messagebox
@@ -16,16 +15,19 @@ from datetime import datetime
 
 # import multiprocessing
 from tkinter import filedialog as fd
-import cv2
 import sys
-from time import time
+from time import time, perf_counter
 import platform
+import argparse
 
 
 import tkinter as tk
 
-from phil_threshold import *
-from phil_track import *
+# phil_threshold and phil_track (which bring in trackpy, opencv, pims, tifffile and pandas) are imported
+# when they are first needed, further down. That way the settings window opens right away, and
+# "python phil_main.py --help" doesn't have to wait for trackpy/numba to load
+from phil_groups import build_grouping_index, naming_pattern
+from phil_progress import run_with_progress
 
 import json
 
@@ -33,6 +35,186 @@ if __name__ == "__main__":
     # This line below is neccesary for proper running after being compiled with pyinstaller
     # multiprocessing.freeze_support()
 
+    parser = argparse.ArgumentParser(
+        description="Philament: automated tracking of filaments in in-vitro motility videos. "
+        "Run without any arguments to open the GUI."
+    )
+    parser.add_argument(
+        "--sweep",
+        metavar="FOLDER",
+        help="folder of thresholded (Thresh-) movies to run a linking parameter sweep on, without the GUI",
+    )
+    parser.add_argument(
+        "--search-range",
+        type=int,
+        nargs="+",
+        help="search radius values to sweep (default: the saved setting)",
+    )
+    parser.add_argument(
+        "--memory",
+        type=int,
+        nargs="+",
+        help="tracking memory values to sweep (default: the saved setting)",
+    )
+    parser.add_argument(
+        "--min-track-length",
+        type=int,
+        nargs="+",
+        default=[2],
+        help="minimum track lengths (frames) to sweep (default: 2)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of sweep combinations linked at once (default: every CPU)",
+    )
+    parser.add_argument(
+        "--shard",
+        nargs=2,
+        metavar=("FOLDER", "K/N"),
+        help="track shard K of N of the (thresholded) movies in FOLDER, without the GUI (e.g. --shard FOLDER 2/4)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=int,
+        help="for --shard and --regress, threshold the original movies in FOLDER with this value first (needed for --watch)",
+    )
+    parser.add_argument(
+        "--merge",
+        metavar="FOLDER",
+        help="combine the finished shards in FOLDER into the usual output files",
+    )
+    parser.add_argument(
+        "--watch",
+        metavar="FOLDER",
+        help="threshold and track new movies as they're saved into FOLDER, without the GUI",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=5,
+        help="for --watch, seconds between checks for new movies (default: 5)",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=None,
+        help="for --watch, stop after this many seconds without a new movie (default: keep watching)",
+    )
+    parser.add_argument(
+        "--index-add",
+        nargs="+",
+        metavar="FOLDER",
+        help="add finished runs (their output folders) to the results index",
+    )
+    parser.add_argument(
+        "--index-runs",
+        action="store_true",
+        help="list every run in the results index",
+    )
+    parser.add_argument(
+        "--index-conditions",
+        metavar="PATTERN",
+        help='compare the conditions matching PATTERN (e.g. "ActinMyosin*") across every run in the results index',
+    )
+    parser.add_argument(
+        "--index-sql",
+        metavar="QUERY",
+        help="run an SQL query on the results index (tables: runs, conditions, files, tracks)",
+    )
+    parser.add_argument(
+        "--regress",
+        metavar="FOLDER",
+        help="check that other settings (--mode) give the same results as the saved settings on the movies in FOLDER, "
+        "and how much faster they are, without the GUI",
+    )
+    parser.add_argument(
+        "--mode",
+        action="append",
+        default=[],
+        metavar="JSON",
+        help='for --regress, settings to change for a mode being checked, e.g. \'{"detect_engine": "connected_components"}\' (can be given more than once)',
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=0,
+        metavar="N",
+        help="for --regress, also check on N synthetic movies per condition (default: 0)",
+    )
+    parser.add_argument(
+        "--reference",
+        choices=("original", "saved"),
+        default="original",
+        help="for --regress, what the modes are checked against: the original implementation, or the current code "
+        "with the saved settings (which only checks what each mode changes) (default: original)",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="for --regress, times each mode and its reference are run, for steadier timings (default: 3)",
+    )
+    parser.add_argument(
+        "--rtol",
+        type=float,
+        default=1e-6,
+        help="for --regress, relative difference allowed between two numbers (default: 1e-6)",
+    )
+    parser.add_argument(
+        "--atol",
+        type=float,
+        default=1e-9,
+        help="for --regress, absolute difference allowed between two numbers (default: 1e-9)",
+    )
+    args = parser.parse_args()
+
+    if args.watch is not None and args.threshold is None:
+        parser.error("--watch needs a --threshold for the session")
+
+    if args.shard is not None:
+        try:
+            shard_number, shard_count = (int(part) for part in args.shard[1].split("/"))
+        except ValueError:
+            parser.error("--shard needs the shard as K/N, e.g. --shard FOLDER 2/4")
+
+    # Results index commands (see phil_index.py), these only need pandas, so they're quick
+    if (
+        args.index_add is not None
+        or args.index_runs
+        or args.index_conditions is not None
+        or args.index_sql is not None
+    ):
+        import sqlite3
+        import pandas as pd
+        from phil_index import add_finished_run, list_runs, compare_conditions, query
+
+        pd.set_option("display.width", None)
+        pd.set_option("display.max_rows", None)
+
+        try:
+            for folder in args.index_add or []:
+                add_finished_run(folder)
+                print(f"Added {folder} to the results index")
+
+            if args.index_runs:
+                print(list_runs().to_string(index=False))
+
+            if args.index_conditions is not None:
+                print(compare_conditions(args.index_conditions).to_string(index=False))
+
+            if args.index_sql is not None:
+                print(query(args.index_sql).to_string(index=False))
+
+        except (FileNotFoundError, sqlite3.Error, pd.errors.DatabaseError) as e:
+            print(e)
+
+        sys.exit()
+
+    # How long the heavy imports take, which is saved in the PhilOutput file
+    import_times = {}
+
     def on_closing():
         if messagebox.askokcancel("Quit", "Do you want to quit?"):
             root.destroy()
@@ -63,64 +245,6 @@ if __name__ == "__main__":
 
         root.destroy()
 
-    def Naming_Indices(naming_input):
-        """
-        Naming_Indices:
-        Input: naming_input is a string, containing exactly 2 "*" characters
-        Output: slash_positions is a tuple, containing the 2 reverse indices of the "*" contained text
-
-        This function takes in a string (naming_input), and returns the reverse indices of whatever is contained between
-        the two lines. I chose to do reverse indices, because our file naming system will increase the length of the file-
-        name in the front of the string, but the file number is in the back of the string.
-        e.g
-        1Lmod-01, 10Lmod-01, 100Lmod-01 | Reverse index is unaffected
-
-        Later in the script, the selected file names will have Thresh- prefixes and .tif/.avi suffixes added, which is accounted for
-        by adding them before finding the indices.
-
-        e.g.
-        naming_input is "100-Tropomodulin*01*"
-        This means the normal filename would be "100-Tropomodulin01"
-        The future actual filename would be "Thresh-100-Tropomodulin01.tif"
-        slash_positions = (-6, -4)
-
-        So eventually, when filename = Thresh-100-Tropomodulin01.tif,
-        filename[slash_positions[0]:slash_positions[1]] returns "01"
-        """
-        slash_positions = []
-        naming_input = (
-            "Thresh-" + naming_input + ".tif"
-        )  # The suffix could also be .avi
-
-        name_as_list = list(naming_input)
-
-        # Here I am using this variable instead of the index() function to get the position of the *'s, because index only returns the first instance
-        char_index = 0
-        for char in name_as_list:
-            if char == "*":
-                slash_positions.append(char_index)
-
-            char_index += 1
-
-        if len(slash_positions) > 2:
-            showinfo(
-                title="Naming Convention",
-                message="Please check naming convention, and only suround the file number with one asterisk (*) on each side.\ne.g. Filename-*01*",
-            )
-            sys.exit()
-        try:
-            slash_positions = (
-                slash_positions[0] - len(naming_input) + 2,
-                slash_positions[1] - len(naming_input) + 1,
-            )
-        except IndexError:
-            showinfo(
-                "Uh Oh!",
-                "You forgot to surround the Naming Convention file number with asterisks (*)! \nPlease restart Phil and try again...",
-            )
-            sys.exit()
-        return slash_positions
-
     if platform.system() == "Windows":
         # This provides awareness for high resolution Monitors, so the GUIs are *crisp*
         # I have not found a solution for mac/linux...
@@ -132,23 +256,153 @@ if __name__ == "__main__":
 
     # This will check if the default values have already been made
     # If not, it sets them to our preset values and then creates a settings file
+    default_settings = {
+        "pixel_size": 0.139,
+        "object_area": 25,
+        "trk_memory": 5,
+        "search_range": 35,
+        "fps": 5,
+        "was_avi": False,
+        "full_obj_data": False,
+        "naming_convention": "ActinMyosin-*01*",
+        "paths": False,
+        "detect_engine": "trackpy",
+        "group_workers": 1,
+        "numba_cache": True,
+        "prefetch_depth": 2,
+        "min_mass": None,
+        "max_mass": None,
+        "min_size": None,
+        "max_size": None,
+        "max_ecc": None,
+        "min_signal": None,
+        "min_track_length": 2,
+        "sparse_masks": False,
+        "avi_codec": "XVID",
+        "binning": 1,
+        "compact_tables": False,
+        "results_index": False,
+        "analytics": False,
+        "motile_speed": 0.2,
+        "speed_bin_width": 0.5,
+        "msd_max_lagtime": 100,
+        "memory_budget_gb": None,
+        "drift_correction": None,
+    }
+
     if os.path.exists("Phil-Settings.json") == True:
         f = open("Phil-Settings.json")
         settings = json.load(f)
 
+        # Settings files saved by older versions of Phil won't have the newer options, so they get the defaults
+        for key, value in default_settings.items():
+            settings.setdefault(key, value)
+
     else:
-        settings = {
-            "pixel_size": 0.139,
-            "object_area": 25,
-            "sheet_size": 10,
-            "trk_memory": 5,
-            "search_range": 35,
-            "fps": 5,
-            "was_avi": False,
-            "full_obj_data": False,
-            "naming_convention": "ActinMyosin-*01*",
-            "paths": False,
-        }
+        settings = default_settings
+
+    # Shard and merge modes skip the GUI too (see phil_shard.py)
+    if args.shard is not None:
+        from phil_shard import run_shard
+
+        try:
+            caught_errors = run_shard(
+                args.shard[0], settings, shard_number, shard_count, args.threshold
+            )
+
+        except ValueError as e:
+            print(e)
+            sys.exit()
+
+        if caught_errors != "":
+            print(caught_errors)
+
+        print(f"Shard {shard_number} of {shard_count} finished")
+        sys.exit()
+
+    if args.merge is not None:
+        from phil_shard import merge_shards
+
+        try:
+            caught_errors = merge_shards(args.merge)
+
+        except (FileNotFoundError, ValueError) as e:
+            print(e)
+            sys.exit()
+
+        if caught_errors != "None":
+            print(caught_errors)
+
+        print(f"Shards merged into {args.merge}")
+        sys.exit()
+
+    # Watch mode (see phil_watch.py)
+    if args.watch is not None:
+        from phil_watch import watch_folder
+
+        output_dir = watch_folder(
+            args.watch,
+            settings,
+            args.threshold,
+            args.poll_interval,
+            args.idle_timeout,
+        )
+
+        print(f"Results saved to {output_dir}")
+        sys.exit()
+
+    # Regression checks (see phil_regress.py), the saved settings are the reference
+    if args.regress is not None:
+        import pandas as pd
+        from phil_regress import run_regression
+
+        try:
+            modes = [json.loads(mode) for mode in args.mode]
+            output_dir, summary = run_regression(
+                args.regress,
+                settings,
+                modes,
+                args.threshold,
+                args.synthetic,
+                args.rtol,
+                args.atol,
+                args.reference,
+                args.repeats,
+            )
+
+        except (json.JSONDecodeError, ValueError) as e:
+            print(e)
+            sys.exit()
+
+        pd.set_option("display.width", None)
+        if args.reference == "original":
+            print("Checked against the original implementation of Phil")
+        else:
+            print(
+                "Checked against the current code with the saved settings (only what each mode changes is checked)"
+            )
+        print(summary.to_string(index=False))
+        print(f"Regression results saved to {output_dir}")
+        sys.exit()
+
+    # Sweep mode skips the GUI, and uses the saved settings for everything that isn't being swept
+    if args.sweep is not None:
+        from phil_sweep import run_sweep
+
+        sweep_path, caught_errors = run_sweep(
+            args.sweep,
+            settings,
+            args.search_range or [settings["search_range"]],
+            args.memory or [settings["trk_memory"]],
+            args.min_track_length,
+            args.workers or "auto",
+        )
+
+        if caught_errors != "":
+            print(caught_errors)
+
+        print(f"Sweep saved to {sweep_path}")
+        sys.exit()
 
     global was_avi
     was_avi = settings["was_avi"]
@@ -185,12 +439,13 @@ if __name__ == "__main__":
     tk_path_files = tk.BooleanVar(value=settings["paths"])
     tk_pixel_size = tk.DoubleVar(value=settings["pixel_size"])
     tk_object_area = tk.IntVar(value=settings["object_area"])
-    tk_sheet_size = tk.IntVar(value=settings["sheet_size"])
     tk_trk_memory = tk.IntVar(value=settings["trk_memory"])
     tk_search_range = tk.IntVar(value=settings["search_range"])
     tk_fps = tk.IntVar(value=settings["fps"])
     tk_date = tk.StringVar(value=todays_date)
     tk_file_name = tk.StringVar(value=settings["naming_convention"])
+    tk_detect_engine = tk.StringVar(value=settings["detect_engine"])
+    tk_group_workers = tk.IntVar(value=settings["group_workers"])
 
     # Labels being made
     ttk.Label(values_frame, text="Pixel size:", anchor="w").grid(
@@ -201,7 +456,7 @@ if __name__ == "__main__":
         text="Object diameter (In pixels):\nMUST be an odd integer",
         anchor="w",
     ).grid(column=0, row=1, padx=5, pady=5, sticky="W")
-    ttk.Label(values_frame, text="# of files per condition:", anchor="w").grid(
+    ttk.Label(values_frame, text="# of conditions at once:", anchor="w").grid(
         column=0, row=2, padx=5, pady=5, sticky="W"
     )
     ttk.Label(
@@ -237,6 +492,13 @@ if __name__ == "__main__":
         onvalue=True,
         offvalue=False,
     ).grid(column=0, row=0, padx=10, pady=15, sticky="N")
+    ttk.Checkbutton(
+        options_frame,
+        text="Fast binary detection? \n(Connected components)",
+        variable=tk_detect_engine,
+        onvalue="connected_components",
+        offvalue="trackpy",
+    ).grid(column=0, row=4, padx=10, pady=15, sticky="N")
     ttk.Entry(options_frame, width=10, textvariable=tk_date).grid(
         column=0, row=3, padx=5, pady=5
     )
@@ -246,7 +508,7 @@ if __name__ == "__main__":
     ttk.Entry(values_frame, textvariable=tk_object_area).grid(
         column=1, row=1, padx=5, pady=5
     )
-    ttk.Entry(values_frame, textvariable=tk_sheet_size).grid(
+    ttk.Entry(values_frame, textvariable=tk_group_workers).grid(
         column=1, row=2, padx=5, pady=5
     )
     ttk.Entry(values_frame, textvariable=tk_trk_memory).grid(
@@ -282,13 +544,14 @@ if __name__ == "__main__":
         settings["pixel_size"] = tk_pixel_size.get()
         settings["object_area"] = tk_object_area.get()
         settings["full_obj_data"] = tk_full_obj_data.get()
-        settings["sheet_size"] = tk_sheet_size.get()
+        settings["group_workers"] = tk_group_workers.get()
         settings["trk_memory"] = tk_trk_memory.get()
         settings["search_range"] = tk_search_range.get()
         settings["fps"] = tk_fps.get()
         chosen_dir_name = tk_date.get()
         settings["naming_convention"] = tk_file_name.get()
         settings["paths"] = tk_path_files.get()
+        settings["detect_engine"] = tk_detect_engine.get()
 
     # If someone puts in "cat" or any string variable where a number is needed, or vice versa
     except:
@@ -298,10 +561,28 @@ if __name__ == "__main__":
         )
         sys.exit()
 
-    name_index = Naming_Indices(settings["naming_convention"])
+    # Checking the naming convention now, rather than after all the files are thresholded
+    try:
+        naming_pattern(settings["naming_convention"])
+
+    except ValueError as e:
+        showinfo(
+            title="Naming Convention",
+            message=f"{e}\nPlease restart Phil and try again...",
+        )
+        sys.exit()
+
+    import_start = perf_counter()
+    from phil_threshold import threshold_value_testing, thresholding_files
+    from phil_memory import memory_budget
+    import cv2
+
+    import_times["phil_threshold (opencv, pims, tifffile)"] = round(
+        perf_counter() - import_start, 3
+    )
 
     threshold_value, is_avi = threshold_value_testing(
-        filepath, (screen_width, screen_height)
+        filepath, (screen_width, screen_height), settings["binning"]
     )
 
     # This is just to remember if user analyzed .avi files in their last run
@@ -337,61 +618,43 @@ if __name__ == "__main__":
     # while picking the threshold value
     start_time = int((time()) * 1000)
 
-    # Progress bar design (nothing super cool/ interesting)
-    list_len = len(filepath)
-
-    root = tk.Tk()
-    root.title("Progress Bar")
-    # SCALING
-    root.geometry(f"{int(screen_width*.15)}x{int(screen_height*0.15)}")
-
-    frame = ttk.Frame(root)
-    frame.grid(column=0, row=1, padx=0, pady=2)
-
-    frame_2 = ttk.Frame(root)
-    frame_2.grid(column=0, row=0, padx=0, pady=2)
-
-    root.columnconfigure(0, weight=1)
-    root.rowconfigure(0, weight=1)
-
-    progress = tk.StringVar()
-    items = tk.StringVar(value=str(list_len))
-
-    prgbr_title = ttk.Label(
-        frame_2, text="Total Progress: \nThresholding & Saving Files! :)"
-    ).grid(column=0, row=0, padx=1, pady=1)
-
-    prgbr_progress = ttk.Label(frame, textvariable=progress).grid(
-        column=0, row=0, padx=1, pady=3
+    # The thresholding runs in a background thread, while the progress bar window shows how far along it is
+    # (see phil_progress.py). This function takes care of all of the thresholding and saving of files
+    # See phil_threshold.py to read through the documentation
+    image = run_with_progress(
+        "Thresholding & Saving Files! :)",
+        len(filepath),
+        lambda progress_queue: thresholding_files(
+            filepath,
+            threshold_value,
+            progress_queue,
+            is_avi,
+            settings["fps"],
+            settings["prefetch_depth"],
+            settings["sparse_masks"],
+            settings["avi_codec"],
+            settings["binning"],
+            memory_budget(settings),
+        ),
+        (screen_width, screen_height),
     )
 
-    of_label = ttk.Label(frame, text="out of ").grid(column=1, row=0, padx=1, pady=3)
+    cv2.waitKey()
 
-    prgbr_total = ttk.Label(frame, textvariable=items).grid(
-        column=2, row=0, padx=1, pady=3
-    )
+    import_start = perf_counter()
+    import trackpy as tp
+    from phil_track import tracking_data_analysis
 
-    # This function takes care of all of the thresholding and saving of files
-    # See phil_threshold.py to read through the documentation
-    image = thresholding_files(
-        filepath, threshold_value, progress, root, is_avi, settings["fps"]
+    import_times["phil_track (trackpy, pandas)"] = round(
+        perf_counter() - import_start, 3
     )
 
-    root.protocol("WM_DELETE_WINDOW", on_closing)
-    root.destroy()
-    frame.mainloop()
-    cv2.waitKey()
-
     # w/o this, trackpy prints lots of information that's useless for the user, so I silenced it
     tp.quiet()
 
-    thresholded_tifs = []
-    split_list = []
-
     # Because we create a new dir to save the thresholded files, every file in that folder is part of
     # the analysis sample. (unless some dummy puts a file in there while phil is still running)
-    for x in os.listdir():
-        thresholded_tifs.append(x)
+    thresholded_tifs = os.listdir()
 
     # I chose to separate the path images from the rest of the files, I feel it makes it more organized
     if settings["paths"] == True:
@@ -401,62 +664,49 @@ if __name__ == "__main__":
     else:
         paths_dir = None
 
-    # Breaking the list into nested lists, to separate sample condition data into different groups
-    # This allows for much easier loops when the tracking and data formating is done
-    split_list = [
-        thresholded_tifs[i : i + settings["sheet_size"]]
-        for i in range(0, len(thresholded_tifs), settings["sheet_size"])
-    ]
-
-    # Same progress bar code from above
-    list_len = len(thresholded_tifs)
-
-    root = tk.Tk()
-    root.title("Progress Bar")
-    # SCALING
-    root.geometry(f"{int(screen_width*.15)}x{int(screen_height*0.15)}")
-
-    frame = ttk.Frame(root)
-    frame.grid(column=0, row=1, padx=0, pady=2)
-
-    frame_2 = ttk.Frame(root)
-    frame_2.grid(column=0, row=0, padx=0, pady=2)
-
-    root.columnconfigure(0, weight=1)
-    root.rowconfigure(0, weight=1)
-
-    progress = tk.IntVar(frame_2)
-    items = tk.StringVar(value=str(list_len))
-
-    prgbr_title = ttk.Label(
-        frame_2, text="Total Progress: \nTracking & Saving Files! :)"
-    ).grid(column=0, row=0, padx=1, pady=1)
-
-    prgbr_progress = ttk.Label(frame, textvariable=progress).grid(
-        column=0, row=0, padx=1, pady=3
+    # Grouping the files by condition, using the condition and file number in each filename
+    # (see phil_groups.py). Conditions can have any number of files, and files that don't follow
+    # the naming convention are left out and listed in the output file
+    grouping_index, unmatched_files = build_grouping_index(
+        thresholded_tifs, settings["naming_convention"]
     )
 
-    of_label = ttk.Label(frame, text="out of ").grid(column=1, row=0, padx=1, pady=3)
-
-    prgbr_total = ttk.Label(frame, textvariable=items).grid(
-        column=2, row=0, padx=1, pady=3
-    )
+    # Same progress bar window from above
+    list_len = sum(len(condition_files) for condition_files in grouping_index.values())
 
     # This function takes care of all the tracking, linking, data analysis, and data formatting, as well as saving the files
     # I feel like I could segment this function into something more pythonic, but for now, it works
-    caught_errors = tracking_data_analysis(
-        split_list, progress, root, settings, name_index, is_avi, paths_dir
+    caught_errors, filter_counts = run_with_progress(
+        "Tracking & Saving Files! :)",
+        list_len,
+        lambda progress_queue: tracking_data_analysis(
+            grouping_index, progress_queue, settings, is_avi, paths_dir
+        ),
+        (screen_width, screen_height),
     )
 
-    # Incase user clicks the red x and wants to shutdown the program.
-
-    root.protocol("WM_DELETE_WINDOW", on_closing)
+    for unmatched in unmatched_files:
+        caught_errors += (
+            f"{unmatched} was skipped because it doesn't follow the naming convention\n"
+        )
 
     end_time = int((time()) * 1000)
     elapsed_time = end_time - start_time
     elapsed_time_sec = round(elapsed_time / 1000, 2)
     elapsed_time_min = round(elapsed_time_sec / 60, 2)
 
+    # Adding the run to the results index (if "results_index" is on), for comparing with other runs later (see
+    # phil_index.py). A problem with the index is added to the errors, the same as any other error in the run
+    from phil_index import index_run
+
+    caught_errors += index_run(
+        os.getcwd(),
+        settings,
+        threshold_value,
+        {"total_sec": elapsed_time_sec, "import_times": import_times},
+        caught_errors,
+    )
+
     if caught_errors == "":
         caught_errors = "None"
 
@@ -480,6 +730,10 @@ Parameters used were:
 {json.dumps(settings, indent = 4)}
 Thresholding Value:
 {threshold_value}
+Import Times (sec):
+{json.dumps(import_times, indent = 4)}
+Removed by Filters (objects, and short_tracks in tracks):
+{json.dumps(filter_counts, indent = 4)}
 Errors:
 {caught_errors}
 """
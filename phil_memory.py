@@ -0,0 +1,291 @@
+import os
+import os.path
+import platform
+
+import numpy as np
+import tifffile as tif
+
+from phil_io import can_memory_map
+
+# Memory budget scheduling, so a folder of huge movies (our movies go from 50 MB to 8 GB) can't run the
+# computer out of memory.
+#
+# Before thresholding or tracking starts, every movie's header is read (# of frames, frame size and pixel type,
+# without reading any frames), and the memory each movie needs at its peak is estimated. Then, to fit in the
+# memory budget ("memory_budget_gb" in the settings, or 75% of the memory available when the run starts):
+#   * the # of movies read ahead / saved behind (prefetch_depth) and of conditions tracked at once
+#     (group_workers) are lowered if needed
+#   * the chunks of frames sent to the locate pool are made small enough
+#   * any movie too big to hold in memory is "streamed", thresholded or located a chunk of frames at a time,
+#     so only one chunk of it is ever in memory
+#
+# Uncompressed 8 bit .tif files are memory mapped (see open_tif_stack), so reading them doesn't count against
+# the budget at all. The estimates are a little generous on purpose.
+
+# Fraction of the available memory used when no budget is set
+AVAILABLE_MEMORY_FRACTION = 0.75
+
+# Rough size of a worker process with trackpy, numba and pandas loaded
+WORKER_PROCESS_BYTES = 300 * 1024**2
+
+# Generous size of the located objects (and their links) for every frame, since the # of objects can't be
+# known ahead of time (a few hundred objects per frame, with every feature column)
+FEATURE_BYTES_PER_FRAME = 64 * 1024
+
+
+def available_memory():
+    # Memory (in bytes) that can be used without pushing anything else out, or None if it can't be found
+    try:
+        import psutil
+
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+
+    # Linux counts memory used for caching files as available, which is what we want here
+    if os.path.exists("/proc/meminfo"):
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+
+    if platform.system() == "Windows":
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [
+                ("dwLength", ctypes.c_ulong),
+                ("dwMemoryLoad", ctypes.c_ulong),
+                ("ullTotalPhys", ctypes.c_ulonglong),
+                ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong),
+                ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong),
+                ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+            ]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+        return status.ullAvailPhys
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def memory_budget(settings):
+    # The memory budget in bytes, or None for no limit (if the available memory can't be found)
+    if settings["memory_budget_gb"] is not None:
+        return int(settings["memory_budget_gb"] * 1024**3)
+
+    available = available_memory()
+    if available is None:
+        return None
+
+    return int(available * AVAILABLE_MEMORY_FRACTION)
+
+
+def avi_frame_count(container, stream):
+    """
+    Returns the # of frames of an open .avi (PyAV container and its video stream)
+    Some .avi files don't list their # of frames, so it's worked out from the length of the stream (or of the whole
+    file) and the frame rate. If even that isn't known, the frames are counted from the packets in the file, which
+    reads through the file but doesn't decode anything (a movie is never assumed to be empty)
+    """
+    if stream.frames > 0:
+        return stream.frames
+
+    if stream.average_rate is not None:
+        if stream.duration is not None:
+            return int(round(stream.duration * stream.time_base * stream.average_rate))
+
+        # The container's duration is in microseconds (av.time_base)
+        if container.duration is not None:
+            return int(round(container.duration / 1000000 * stream.average_rate))
+
+    return sum(1 for packet in container.demux(stream) if packet.size > 0)
+
+
+def read_movie_header(filepath, is_avi):
+    """
+    Reads the size of a movie without reading its frames
+    Returns a dictionary of:
+        frames, height, width -> size of the movie
+        channels -> 3 for .avi files (read as color), otherwise 1
+        memory_mapped -> if the frames are read from the disk as they're used (see open_tif_stack)
+    """
+    if filepath.endswith(".npz"):
+        with np.load(filepath) as sparse_file:
+            num_frames, height, width = (int(size) for size in sparse_file["shape"])
+
+        return {
+            "frames": num_frames,
+            "height": height,
+            "width": width,
+            "channels": 1,
+            "memory_mapped": False,
+        }
+
+    if is_avi:
+        import av
+
+        with av.open(filepath) as container:
+            stream = container.streams.video[0]
+            num_frames = avi_frame_count(container, stream)
+
+            return {
+                "frames": num_frames,
+                "height": stream.codec_context.height,
+                "width": stream.codec_context.width,
+                "channels": 3,
+                "memory_mapped": False,
+            }
+
+    with tif.TiffFile(filepath) as tiff:
+        series = tiff.series[0]
+        shape = series.shape
+        memory_mapped = can_memory_map(tiff)
+
+        if len(shape) == 2:
+            shape = (1,) + shape
+        elif "S" in series.axes or len(shape) > 3:
+            shape = (len(tiff.pages),) + tuple(tiff.pages[0].shape[:2])
+
+    return {
+        "frames": shape[0],
+        "height": shape[1],
+        "width": shape[2],
+        "channels": 1,
+        "memory_mapped": memory_mapped,
+    }
+
+
+def frame_bytes(header, binning=1):
+    # Bytes for one (8 bit) frame of the movie, after binning
+    return (
+        (header["height"] // binning)
+        * (header["width"] // binning)
+        * header["channels"]
+    )
+
+
+def stream_chunk_frames(budget, bytes_per_frame):
+    # # of frames in each chunk of a streamed movie, using about a tenth of the budget at a time
+    return max(1, budget // (10 * max(bytes_per_frame, 1)))
+
+
+def plan_thresholding(filepaths, is_avi, prefetch_depth, binning, budget):
+    """
+    Works out how to threshold the movies within the memory budget (in bytes, None for no limit)
+    Returns the prefetch depth to use, and a dictionary of filepath -> # of frames per chunk for the movies that
+    have to be streamed (any movie not in it is thresholded all at once, like before)
+    """
+    if budget is None:
+        return prefetch_depth, {}
+
+    movie_peaks = {}
+    streamed = {}
+
+    for filepath in filepaths:
+        try:
+            header = read_movie_header(filepath, is_avi)
+        except Exception:
+            # Anything that can't be read is left for thresholding_files to report
+            continue
+
+        # The original frames (unless they're memory mapped), the binned frames, and the thresholded frames
+        # (twice, since .tif files are turned into one array before saving)
+        raw_bytes = 0 if header["memory_mapped"] else frame_bytes(header)
+        if binning > 1:
+            raw_bytes += 5 * frame_bytes(header, binning)
+        peak_per_frame = raw_bytes + 2 * frame_bytes(header, binning)
+
+        peak = header["frames"] * peak_per_frame
+        if peak > budget:
+            streamed[filepath] = stream_chunk_frames(budget, peak_per_frame)
+        else:
+            movie_peaks[filepath] = peak
+
+    # Each movie read ahead (or waiting to be saved) takes about as much as the one being thresholded
+    if len(movie_peaks) > 0:
+        largest_peak = max(max(movie_peaks.values()), 1)
+        prefetch_depth = max(0, min(prefetch_depth, budget // largest_peak - 1))
+
+    return prefetch_depth, streamed
+
+
+def plan_tracking(grouping_index, is_avi, settings, budget, processes="auto"):
+    """
+    Returns a copy of the (already binned) settings, changed to track the movies within the memory budget (in
+    bytes, None for no limit): prefetch_depth and group_workers lowered if needed, plus
+        locate_chunk_frames -> most frames sent to a locate worker at once (None for no limit)
+        stream_frames -> dictionary of filepath -> # of frames per chunk, for movies located a chunk at a time
+    """
+    settings = dict(settings)
+    settings["locate_chunk_frames"] = None
+    settings["stream_frames"] = {}
+
+    if budget is None:
+        return settings
+
+    if processes == "auto":
+        processes = os.cpu_count()
+
+    condition_peaks = []
+    largest_movie = 1
+    largest_frame = 1
+
+    for condition_files in grouping_index.values():
+        condition_peak = 0
+
+        for file_num, filepath in condition_files:
+            try:
+                header = read_movie_header(filepath, is_avi)
+            except Exception:
+                continue
+
+            # Thresholded movies are tracked in grayscale
+            movie_frame_bytes = frame_bytes(dict(header, channels=1))
+            in_memory_bytes = 0 if header["memory_mapped"] else movie_frame_bytes
+            features = header["frames"] * FEATURE_BYTES_PER_FRAME
+
+            # Streaming only saves the memory of the frames (memory mapped movies are already read as they're used)
+            peak = header["frames"] * in_memory_bytes + features
+            if peak > budget and in_memory_bytes > 0:
+                settings["stream_frames"][filepath] = stream_chunk_frames(
+                    budget, in_memory_bytes + FEATURE_BYTES_PER_FRAME
+                )
+                peak = features
+            else:
+                largest_movie = max(largest_movie, peak)
+
+            largest_frame = max(largest_frame, in_memory_bytes)
+            condition_peak = max(condition_peak, peak)
+
+        condition_peaks.append(condition_peak)
+
+    # Movies read ahead take about as much as the one being tracked
+    settings["prefetch_depth"] = max(
+        0, min(settings["prefetch_depth"], budget // largest_movie - 1)
+    )
+
+    # Each condition worker is its own process, holding its own movies
+    if settings["group_workers"] > 1 and len(condition_peaks) > 0:
+        worker_peak = (
+            max(condition_peaks) * (settings["prefetch_depth"] + 1)
+            + WORKER_PROCESS_BYTES
+        )
+        settings["group_workers"] = max(
+            1, min(settings["group_workers"], budget // worker_peak)
+        )
+
+    # Frames in memory are copied to the locate workers, with up to about two chunks per worker at a time,
+    # so those copies get a quarter of the budget
+    settings["locate_chunk_frames"] = max(
+        1, budget // (4 * 2 * processes * largest_frame)
+    )
+
+    return settings
@@ -0,0 +1,147 @@
+import os
+import os.path
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Trackpy compiles its numba kernels (the locate refinement and the subnet linker) the first time they're
+# called in every process. That happens for every movie, since tp.batch starts a brand new pool of
+# processes each time it's called, and again in every worker when conditions are tracked in parallel.
+#
+# This module fixes that in three steps:
+#   1. The kernels are recompiled with cache=True, so the compiled code is saved to disk (NUMBA_CACHE_DIR)
+#      and just loaded in every later process/run (after the first run on a computer, there's no compiling)
+#   2. The kernels are "warmed up" on a tiny fake movie, so they're loaded before the first real movie
+#   3. One pool of locate workers is kept for the whole run (each warmed up once when it starts), instead of
+#      tp.batch starting a new pool for every movie
+
+NUMBA_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".philament", "numba_cache")
+
+# The shared pool of locate workers, started the first time it's needed (see get_locate_pool)
+locate_pool = None
+locate_pool_size = 0
+
+
+def enable_kernel_cache(cache_dir=NUMBA_CACHE_DIR):
+    # Swaps trackpy's numba kernels for the same kernels compiled with cache=True
+    # (trackpy keeps a list of every function it compiles, which makes this pretty easy)
+    # This uses trackpy's internals (tested with the trackpy versions in requirements.txt), so if a trackpy
+    # release changes them, the cache is just left off (the kernels are still compiled, only not saved)
+    import numba
+    from trackpy import try_numba
+
+    if not getattr(try_numba, "NUMBA_AVAILABLE", False):
+        return
+
+    registered_functions = getattr(try_numba, "_registered_functions", None)
+    if registered_functions is None or not all(
+        hasattr(registered, attribute)
+        for registered in registered_functions
+        for attribute in ("func", "jit_kwargs", "point_to_compiled_func")
+    ):
+        warnings.warn(
+            f"This version of trackpy ({tp_version()}) can't have its numba kernels cached, so they'll be "
+            "compiled in every process instead (see requirements.txt for the tested versions)"
+        )
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    numba.config.CACHE_DIR = cache_dir
+
+    for registered in registered_functions:
+        if getattr(registered, "philament_cached", False):
+            continue
+
+        try:
+            jit_kwargs = registered.jit_kwargs or {}
+            registered._compiled = numba.jit(cache=True, **jit_kwargs)(registered.func)
+            registered.point_to_compiled_func()
+        except Exception as e:
+            warnings.warn(
+                f"Couldn't cache trackpy's {getattr(registered, 'func', registered)} numba kernel, it'll be "
+                f"compiled in every process instead ({e})"
+            )
+            continue
+
+        registered.philament_cached = True
+
+
+def tp_version():
+    # The installed trackpy version, for the warnings above
+    import trackpy
+
+    return getattr(trackpy, "__version__", "unknown version")
+
+
+def warm_up_kernels(object_area):
+    """
+    Runs trackpy on a tiny fake thresholded movie (white background with dark objects, like the Thresh- files),
+    so the locate and link kernels are compiled (or loaded from the cache) before any real movies.
+    The fake movie uses the same dtype (uint8) and diameter as the real ones, so numba makes the same versions.
+    """
+    import trackpy as tp
+
+    frame_size = max(64, object_area * 4)
+    frames = np.full((2, frame_size, frame_size), 255, dtype=np.uint8)
+    for frame_num in range(0, 2):
+        center = frame_size // 2 + frame_num
+        frames[frame_num, center - 2 : center + 2, center - 2 : center + 2] = 0
+
+    tp.batch(frames, object_area, invert=True, engine="numba", processes=1)
+
+    # A 2 x 2 grid of objects close enough together that they all form one subnet. Trackpy links subnets of up to
+    # 3 objects (or with only 1 object in a frame) in plain Python, so it takes a bigger one like this to reach
+    # the numba linker
+    grid_x, grid_y = np.meshgrid(np.arange(2) * 2.0 + 10, np.arange(2) * 2.0 + 10)
+    grid_x, grid_y = grid_x.ravel(), grid_y.ravel()
+    fake_features = pd.DataFrame(
+        {
+            "x": np.concatenate([grid_x, grid_x + 0.5]),
+            "y": np.concatenate([grid_y, grid_y + 0.5]),
+            "frame": np.repeat([0, 1], len(grid_x)),
+        }
+    )
+    tp.link_df(fake_features, 3)
+
+
+def prepare_worker(object_area, cache_dir):
+    # Initializer for every Philament worker process (locate workers and condition workers)
+    import trackpy as tp
+
+    # w/o this, trackpy prints lots of information that's useless for the user
+    tp.quiet()
+
+    if cache_dir is not None:
+        enable_kernel_cache(cache_dir)
+
+    warm_up_kernels(object_area)
+
+
+def get_locate_pool(processes, settings):
+    # Returns the shared locate pool, starting it (or restarting it with a different size) if needed
+    global locate_pool, locate_pool_size
+
+    if locate_pool is not None and locate_pool_size != processes:
+        shutdown_locate_pool()
+
+    if locate_pool is None:
+        cache_dir = NUMBA_CACHE_DIR if settings["numba_cache"] else None
+        locate_pool = ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=prepare_worker,
+            initargs=(settings["object_area"], cache_dir),
+        )
+        locate_pool_size = processes
+
+    return locate_pool
+
+
+def shutdown_locate_pool():
+    global locate_pool, locate_pool_size
+
+    if locate_pool is not None:
+        locate_pool.shutdown()
+        locate_pool = None
+        locate_pool_size = 0
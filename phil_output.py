@@ -0,0 +1,273 @@
+import csv
+import os
+import os.path
+import shutil
+from math import sqrt
+
+import numpy as np
+import pandas as pd
+
+# These functions write the condition CSV files a movie at a time, instead of holding every movie's
+# data for a condition in memory until the condition is finished.
+#
+# The one tricky part is that every movie can have a different number of speed columns (it depends on the
+# longest track in the movie), so the header can't be written until the whole condition is done.
+# To get around this, the rows are appended to a "{condition}.csv.part" file as soon as each movie is done,
+# and when the condition is finished, the header (for the widest movie) is written and the rows are copied
+# over line by line, padding the shorter rows with empty cells. The output is the same as concatenating all the
+# DataFrames and saving them at once, without ever having more than one movie in memory.
+
+
+def start_condition_output(proper_name, full_obj_data):
+    # The writer is just a dictionary holding the file names and what has been written so far
+    condition_output = {
+        "csv_name": f"{proper_name}.csv",
+        "part_name": f"{proper_name}.csv.part",
+        "full_obj_name": f"{proper_name}-Full Object Data.csv",
+        "full_obj_data": full_obj_data,
+        "full_obj_started": False,
+        # The column names of the widest movie, and (# of rows, # of columns) for each block of rows written
+        "columns": [],
+        "segments": [],
+    }
+
+    # Starting with a fresh part file, incase one was left behind by a crashed run
+    open(condition_output["part_name"], "w").close()
+
+    return condition_output
+
+
+def append_condition_rows(condition_output, output_df):
+    # Saving this movie's rows straight to the part file (no header, it gets written at the end)
+    if len(output_df.columns) > len(condition_output["columns"]):
+        condition_output["columns"] = list(output_df.columns)
+
+    if len(output_df) > 0:
+        output_df.to_csv(condition_output["part_name"], mode="a", header=False, index=0)
+        condition_output["segments"].append((len(output_df), len(output_df.columns)))
+
+
+def append_full_obj_rows(condition_output, obj_df):
+    # The full object data has the same columns for every movie, so it can be appended directly
+    # (the header is only written with the first movie)
+    obj_df.to_csv(
+        condition_output["full_obj_name"],
+        mode="a" if condition_output["full_obj_started"] else "w",
+        header=not condition_output["full_obj_started"],
+    )
+    condition_output["full_obj_started"] = True
+
+
+def finish_condition_output(condition_output):
+    total_columns = len(condition_output["columns"])
+
+    # Writing the header for the widest movie (pandas does the formatting, so it matches to_csv exactly)
+    pd.DataFrame(columns=condition_output["columns"]).to_csv(
+        condition_output["csv_name"], index=0
+    )
+
+    # newline="" keeps the line endings exactly how pandas wrote them
+    with open(condition_output["part_name"], "r", newline="") as part_file, open(
+        condition_output["csv_name"], "a", newline=""
+    ) as csv_file:
+        for num_rows, num_columns in condition_output["segments"]:
+            padding = "," * (total_columns - num_columns)
+
+            for row in range(0, num_rows):
+                line = part_file.readline()
+                line_body = line.rstrip("\r\n")
+                csv_file.write(line_body + padding + line[len(line_body) :])
+
+    os.remove(condition_output["part_name"])
+
+
+def append_condition_csv(condition_output, csv_path):
+    # Adds the rows of an already finished condition file (e.g. one movie tracked by a shard, see phil_shard.py)
+    # The lines are copied as text, so the merged file is exactly what a single run would have written
+    with open(csv_path, "r", newline="") as csv_file:
+        columns = next(csv.reader([csv_file.readline()]))
+
+        # A file without any rows or columns has a header of just ""
+        if columns == [""]:
+            columns = []
+
+        if len(columns) > len(condition_output["columns"]):
+            condition_output["columns"] = columns
+
+        num_rows = 0
+        with open(condition_output["part_name"], "a", newline="") as part_file:
+            for line in csv_file:
+                part_file.write(line)
+                num_rows += 1
+
+    if num_rows > 0:
+        condition_output["segments"].append((num_rows, len(columns)))
+
+
+def append_full_obj_csv(condition_output, csv_path):
+    # Same as append_condition_csv, for the full object data (only the first file's header is kept)
+    with open(csv_path, "r", newline="") as csv_file, open(
+        condition_output["full_obj_name"],
+        "a" if condition_output["full_obj_started"] else "w",
+        newline="",
+    ) as full_obj_file:
+        header = csv_file.readline()
+        if not condition_output["full_obj_started"]:
+            full_obj_file.write(header)
+
+        shutil.copyfileobj(csv_file, full_obj_file)
+
+    condition_output["full_obj_started"] = True
+
+
+def start_live_condition_output(proper_name, full_obj_data):
+    # Like start_condition_output, for a condition CSV that's kept finished after every movie (the watch mode),
+    # so there's no part file, just the CSV itself
+    return {
+        "csv_name": f"{proper_name}.csv",
+        "full_obj_name": f"{proper_name}-Full Object Data.csv",
+        "full_obj_data": full_obj_data,
+        "full_obj_started": False,
+        "columns": None,
+    }
+
+
+def pad_csv_lines(lines, padding):
+    # Adds empty cells to the end of every line, keeping the line endings exactly how pandas wrote them
+    for line in lines:
+        line_body = line.rstrip("\r\n")
+        yield line_body + padding + line[len(line_body) :]
+
+
+def append_live_condition_csv(condition_output, csv_path):
+    """
+    Adds the rows of a finished movie's CSV to a condition CSV that stays complete (header and all) after every
+    movie. The rows are padded to the condition's current header and appended, so only the new movie is read.
+    The whole file is only rewritten when the new movie has more speed columns than every movie before it
+    (which needs a wider header), and then it's swapped in at once, so the CSV is never seen half written.
+    """
+    with open(csv_path, "r", newline="") as csv_file:
+        columns = next(csv.reader([csv_file.readline()]))
+
+        # A file without any rows or columns has a header of just ""
+        if columns == [""]:
+            columns = []
+
+        old_columns = condition_output["columns"]
+        csv_name = condition_output["csv_name"]
+
+        if old_columns is None or len(columns) > len(old_columns):
+            condition_output["columns"] = columns
+            new_name = csv_name + ".new"
+
+            # Writing the header (pandas does the formatting, so it matches to_csv exactly)
+            pd.DataFrame(columns=columns).to_csv(new_name, index=0)
+
+            with open(new_name, "a", newline="") as new_file:
+                if old_columns is not None:
+                    with open(csv_name, "r", newline="") as old_file:
+                        old_file.readline()
+                        new_file.writelines(
+                            pad_csv_lines(
+                                old_file, "," * (len(columns) - len(old_columns))
+                            )
+                        )
+
+                new_file.writelines(csv_file)
+
+            os.replace(new_name, csv_name)
+
+        else:
+            with open(csv_name, "a", newline="") as condition_file:
+                condition_file.writelines(
+                    pad_csv_lines(csv_file, "," * (len(old_columns) - len(columns)))
+                )
+
+
+def combine_movie_outputs(proper_name, movies, full_obj_data):
+    """
+    Writes a condition's CSV (and Full Object Data) from movies that were each tracked into their own files
+    (used to merge the shards, see phil_shard.py)
+    movies is a list of (file number, output path without ".csv", running totals from track_condition)
+    Returns the running totals for the whole condition
+    """
+    condition_output = start_condition_output(proper_name, full_obj_data)
+    speed_stats = new_speed_stats()
+
+    # Same order a single run would have tracked them in
+    for file_num, output_path, movie_speed_stats in sorted(
+        movies, key=lambda movie: movie[:2]
+    ):
+        append_condition_csv(condition_output, f"{output_path}.csv")
+
+        full_obj_path = f"{output_path}-Full Object Data.csv"
+        if os.path.exists(full_obj_path):
+            append_full_obj_csv(condition_output, full_obj_path)
+
+        pool_speed_stats(speed_stats, movie_speed_stats)
+
+    finish_condition_output(condition_output)
+    return speed_stats
+
+
+# Running totals for the Summary.csv statistics, so the speeds don't need to be gathered into one big array
+def new_speed_stats():
+    return {"count": 0, "sum": 0.0, "sum_sq": 0.0, "objects": 0}
+
+
+def update_speed_stats(speed_stats, output_df):
+    # Same columns the summary has always been calculated from (Speed Std onward)
+    file_speeds = output_df.iloc[:, 8:].to_numpy(dtype=np.float64)
+
+    speed_stats["count"] += int(np.count_nonzero(~np.isnan(file_speeds)))
+    speed_stats["sum"] += float(np.nansum(file_speeds))
+    speed_stats["sum_sq"] += float(np.nansum(file_speeds**2))
+    speed_stats["objects"] += len(output_df)
+
+
+def summarize_speed_stats(speed_stats):
+    # Returns the average speed and SEM (std / sqrt(# of objects)), same as np.nanmean / np.nanstd
+    if speed_stats["count"] == 0:
+        return np.nan, np.nan
+
+    average = speed_stats["sum"] / speed_stats["count"]
+    variance = max(speed_stats["sum_sq"] / speed_stats["count"] - average**2, 0.0)
+
+    return average, sqrt(variance) / sqrt(speed_stats["objects"])
+
+
+def pool_speed_stats(speed_stats, more_speed_stats):
+    # Adds one set of running totals into another (e.g. the same condition from different shards)
+    for key in speed_stats:
+        speed_stats[key] += more_speed_stats[key]
+
+
+def summary_row(proper_name, num_files, speed_stats):
+    # The condition's row for Summary.csv, from its running totals
+    average_speed, speed_sem = summarize_speed_stats(speed_stats)
+
+    return {
+        "Condition": proper_name,
+        "# of Files": num_files,
+        "Average Speed": average_speed,
+        "Speed SEM": speed_sem,
+        "Total # of Objects": speed_stats["objects"],
+    }
+
+
+def write_summary(summary_rows):
+    # To make the analysis easier, this file will give a quick glimpse, ie. condition A is faster than condition B
+    summary_file = {
+        "Condition": [],
+        "# of Files": [],
+        "Average Speed": [],
+        "Speed SEM": [],
+        "Total # of Objects": [],
+    }
+
+    for row in summary_rows:
+        for column in summary_file:
+            summary_file[column].append(row[column])
+
+    summary_df = pd.DataFrame.from_dict(summary_file)
+    summary_df.to_csv("Summary.csv", index=0)
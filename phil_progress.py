@@ -0,0 +1,146 @@
+import queue
+import sys
+import threading
+import tkinter as tk
+from time import perf_counter
+from tkinter import messagebox, ttk
+from tkinter.messagebox import showinfo
+
+# The thresholding and tracking run in a background thread, and send their progress to the progress bar
+# window through a queue. The window checks the queue every 100 ms (with after()), so it never freezes
+# during long movies, and the processing never has to stop to update the window.
+#
+# Messages are small dictionaries (any of these keys):
+#   {"stage": "Tracking Thresh-ActinMyosin01.tif"}  -> what is being done right now
+#   {"files": 1, "frames": 300}                       -> a movie (with 300 frames) was finished
+#   {"message": ("Title", "Some text")}               -> shows a popup (popups have to come from the main thread)
+
+
+def report(progress_queue, **message):
+    # Sends a progress message, if there is a progress window (headless runs pass None)
+    if progress_queue is not None:
+        progress_queue.put(message)
+
+
+def format_time(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    if minutes > 0:
+        return f"{minutes} min {seconds} s"
+    return f"{seconds} s"
+
+
+def run_with_progress(title, total_files, work, screen_dimensions):
+    """
+    run_with_progress takes in:
+        title -> text for the top of the progress bar window (e.g. "Thresholding & Saving Files! :)")
+        total_files -> number of movies, for the "out of" and the ETA
+        work -> function that does the processing, which is given the progress queue
+        screen_dimensions -> (width, height) of the screen, for sizing the window
+
+    Runs work(progress_queue) in a background thread while showing the progress bar window,
+    and returns whatever work returned (or raises whatever error it raised) once it's done
+    """
+    progress_queue = queue.Queue()
+    outcome = {}
+
+    def run_work():
+        try:
+            outcome["result"] = work(progress_queue)
+
+        # SystemExit is included, so sys.exit() inside the work still closes Phil (from the main thread)
+        except BaseException as e:
+            outcome["error"] = e
+
+    def on_closing():
+        if messagebox.askokcancel("Quit", "Do you want to quit?"):
+            root.destroy()
+            sys.exit()
+
+    root = tk.Tk()
+    root.title("Progress Bar")
+    # SCALING
+    root.geometry(f"{int(screen_dimensions[0]*.2)}x{int(screen_dimensions[1]*0.2)}")
+
+    frame = ttk.Frame(root)
+    frame.grid(column=0, row=1, padx=0, pady=2)
+
+    frame_2 = ttk.Frame(root)
+    frame_2.grid(column=0, row=0, padx=0, pady=2)
+
+    frame_3 = ttk.Frame(root)
+    frame_3.grid(column=0, row=2, padx=0, pady=2)
+
+    root.columnconfigure(0, weight=1)
+    root.rowconfigure(0, weight=1)
+
+    progress = tk.IntVar(frame_2, 0)
+    items = tk.StringVar(value=str(total_files))
+    stage = tk.StringVar(value="Starting...")
+    throughput = tk.StringVar(value="")
+    eta = tk.StringVar(value="ETA: calculating...")
+
+    ttk.Label(frame_2, text=f"Total Progress: \n{title}").grid(
+        column=0, row=0, padx=1, pady=1
+    )
+
+    ttk.Label(frame, textvariable=progress).grid(column=0, row=0, padx=1, pady=3)
+    ttk.Label(frame, text="out of ").grid(column=1, row=0, padx=1, pady=3)
+    ttk.Label(frame, textvariable=items).grid(column=2, row=0, padx=1, pady=3)
+
+    ttk.Label(frame_3, textvariable=stage).grid(column=0, row=0, padx=1, pady=1)
+    ttk.Label(frame_3, textvariable=throughput).grid(column=0, row=1, padx=1, pady=1)
+    ttk.Label(frame_3, textvariable=eta).grid(column=0, row=2, padx=1, pady=1)
+
+    start_time = perf_counter()
+    totals = {"files": 0, "frames": 0}
+
+    def poll():
+        # Checked before reading the queue, so the last messages from the work are never missed
+        finished = not worker.is_alive()
+
+        # Reading every message waiting in the queue
+        while True:
+            try:
+                message = progress_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if "stage" in message:
+                stage.set(message["stage"])
+
+            if "files" in message:
+                totals["files"] += message["files"]
+                totals["frames"] += message.get("frames", 0)
+
+            if "message" in message:
+                showinfo(title=message["message"][0], message=message["message"][1])
+
+        elapsed = perf_counter() - start_time
+        progress.set(totals["files"])
+
+        if totals["files"] > 0 and elapsed > 0:
+            files_per_sec = totals["files"] / elapsed
+            throughput.set(
+                f"{totals['frames'] / elapsed:.1f} frames/s  |  {files_per_sec:.2f} files/s"
+            )
+
+            files_left = max(total_files - totals["files"], 0)
+            eta.set(f"ETA: {format_time(files_left / files_per_sec)}")
+
+        if finished:
+            root.destroy()
+        else:
+            root.after(100, poll)
+
+    # daemon=True, so closing the window (and quitting) doesn't wait for the processing to finish
+    worker = threading.Thread(target=run_work, daemon=True)
+    worker.start()
+
+    root.protocol("WM_DELETE_WINDOW", on_closing)
+    root.after(100, poll)
+    root.mainloop()
+
+    if "error" in outcome:
+        raise outcome["error"]
+
+    return outcome.get("result")
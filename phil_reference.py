@@ -0,0 +1,288 @@
+from math import sqrt
+import os
+import os.path
+
+import cv2
+import numpy as np
+import pandas as pd
+import tifffile as tif
+import trackpy as tp
+
+# The original thresholding and tracking (Phil v0.1.0, before the engines, prefetching, memory mapping, shared locate
+# pool, vectorized track loops and streamed CSVs were added), kept as the reference for regression checks
+# (see phil_regress.py). This is deliberately left as it was: slow, simple, and reading every movie into memory.
+#
+# Only the settings the original version had are used (pixel_size, object_area, search_range, trk_memory, fps,
+# full_obj_data). The files are named by the grouping index rather than the old "# of files per condition" split,
+# but the condition names and file numbers come out the same.
+
+
+def original_column_naming(df_length, file_fps):
+    # Same as column_naming in phil_track.py
+    df_dict = {
+        0: "Particle",
+        1: "FirstX",
+        2: "FirstY",
+        3: "First_Frame",
+        4: "Displacement",
+    }
+    recip_fps = 1 / file_fps
+
+    for cell in range(5, df_length):
+        df_dict[cell] = recip_fps
+        recip_fps += 1 / file_fps
+
+    return df_dict
+
+
+def original_thresholding_files(filepath, threshold_value, is_avi, fps):
+    """
+    The original thresholding_files: reads each movie with cv2 (.tif) or pims (.avi), median blurs and thresholds
+    every frame, and saves "Thresh-" + filename in the current directory
+    """
+    from pims import PyAVVideoReader
+
+    kernel_size = 5
+    for i in range(0, len(filepath)):
+        threshold_images = []
+        original_images = []
+        filename = os.path.basename(filepath[i])
+
+        if is_avi == True:
+            original_images = PyAVVideoReader(filepath[i])
+
+            avi_size = original_images.frame_shape
+
+            # Fourcc code for AVI
+            fourcc = cv2.VideoWriter_fourcc(*"XVID")
+            avi_image = cv2.VideoWriter(
+                "Thresh-" + filename, fourcc, fps, (avi_size[1], avi_size[0])
+            )
+
+        else:
+            loaded, original_images = cv2.imreadmulti(
+                mats=original_images,
+                filename=f"{filepath[i]}",
+                flags=cv2.IMREAD_GRAYSCALE,
+            )
+
+        for x in range(0, len(original_images)):
+            # Image processing (blur & thresholding)
+            blur = cv2.medianBlur(original_images[x], kernel_size)
+
+            ret, image = cv2.threshold(
+                blur, threshold_value, 255, cv2.THRESH_BINARY_INV
+            )
+
+            if is_avi:
+                avi_image.write(image)
+
+            else:
+                threshold_images.append(image)
+
+        if is_avi:
+            avi_image.release()
+
+        else:
+            threshold_array = np.array(threshold_images)
+            tif.imwrite("Thresh-" + filename, threshold_array)
+
+
+def original_tracking_data_analysis(grouping_index, settings, is_avi):
+    """
+    The original tracking_data_analysis: tracks every movie of every condition in the grouping index one particle
+    at a time, and saves the condition CSVs (and Full Object Data) and Summary.csv in the current directory
+    Returns any caught exceptions
+    """
+    from pims import PyAVVideoReader
+
+    caught_exceptions = ""
+
+    summary_file = {
+        "Condition": [],
+        "# of Files": [],
+        "Average Speed": [],
+        "Speed SEM": [],
+        "Total # of Objects": [],
+    }
+
+    for proper_name, condition_files in grouping_index.items():
+        # Defining Variables / Clearing Dataframes
+        full_obj_df = pd.DataFrame()
+        final_df = pd.DataFrame()
+
+        for file_num, file_path in condition_files:
+            displacement_df = pd.DataFrame()
+            obj_size_list = []
+
+            if file_path.endswith(".npz"):
+                raise ValueError(
+                    "The original tracking can't read sparse (.npz) thresholded movies"
+                )
+
+            if is_avi == True:
+                frames = PyAVVideoReader(file_path)
+
+                avi_array = []
+                for x in range(0, len(frames)):
+                    avi_array.append(cv2.cvtColor(frames[x], cv2.COLOR_BGR2GRAY))
+                frames = avi_array
+
+            else:
+                frames = tif.imread(file_path)
+
+            # tracking the objects & collecting obj information like position, size, brightness, ect.
+            f = tp.batch(
+                frames[:],
+                settings["object_area"],
+                invert=True,
+                engine="numba",
+                processes="auto",
+            )
+
+            # Linking the objects / tracking their paths
+            try:
+                linked_obj = tp.link_df(
+                    f, settings["search_range"], memory=settings["trk_memory"]
+                )
+            except Exception as e:
+                caught_exceptions += (
+                    f"{proper_name}{file_num} was skipped due to:\n{e}\n"
+                )
+                continue
+
+            linked_obj = linked_obj.sort_values(by=["particle", "frame"])
+
+            # dd_values stands for desired_displacement values
+            dd_values = linked_obj[["particle", "frame", "x", "y"]]
+            total_objs = dd_values["particle"].iloc[-1]
+            reciprocol_fps = 1 / settings["fps"]
+
+            for particle in range(0, total_objs):
+                pythag_df = dd_values[dd_values["particle"] == particle]
+
+                if len(pythag_df) > 1:
+                    first_x = pythag_df["x"].iloc[0]
+                    first_y = pythag_df["y"].iloc[0]
+                    first_frame = pythag_df["frame"].iloc[0]
+                    particle_num = pythag_df["particle"].iloc[0]
+                    last_x = pythag_df["x"].iloc[-1]
+                    last_y = pythag_df["y"].iloc[-1]
+
+                    displacement = (
+                        sqrt(((first_x - last_x) ** 2) + (first_y - last_y) ** 2)
+                        * settings["pixel_size"]
+                    )
+                    output_list = [
+                        particle_num,
+                        first_x,
+                        first_y,
+                        first_frame,
+                        displacement,
+                    ]
+
+                    for frame in range(1, len(pythag_df)):
+                        Xn = pythag_df["x"].iloc[frame - 1]
+                        Yn = pythag_df["y"].iloc[frame - 1]
+                        Frame_n = pythag_df["frame"].iloc[frame - 1]
+
+                        Xn1 = pythag_df["x"].iloc[frame]
+                        Yn1 = pythag_df["y"].iloc[frame]
+                        Frame_n1 = pythag_df["frame"].iloc[frame]
+
+                        frame_diff = Frame_n1 - Frame_n
+
+                        displacement = sqrt(((Xn - Xn1) ** 2) + (Yn - Yn1) ** 2)
+                        displacement = (displacement * settings["pixel_size"]) / (
+                            reciprocol_fps * frame_diff
+                        )
+
+                        output_list.append(displacement)
+
+                    output_list_df = pd.DataFrame(output_list)
+                    displacement_df = pd.concat(
+                        [displacement_df, output_list_df], axis=1
+                    )
+
+            displacement_df = displacement_df.rename(
+                index=original_column_naming(len(displacement_df), settings["fps"])
+            )
+
+            displacement_df = displacement_df.transpose()
+
+            # when avg_speed_lamba is called, it inserts a column, so the speeds are shifted one to the right
+            # this is why the row slicing points increase by 1
+            avg_speed_lambda = lambda row: np.nanmean(row[6:])
+            std_speed_lambda = lambda row: np.nanstd(row[7:])
+            path_length_lambda = lambda row: np.sum(row[8:] * reciprocol_fps)
+
+            displacement_df.insert(
+                0,
+                "File",
+                file_num,
+                allow_duplicates=True,
+            )
+
+            displacement_df.insert(
+                5,
+                "Avg Speed",
+                displacement_df.apply(avg_speed_lambda, axis=1),
+            )
+
+            displacement_df.insert(
+                6,
+                "Speed Std",
+                displacement_df.apply(std_speed_lambda, axis=1),
+            )
+
+            displacement_df.insert(
+                7, "Path Length", displacement_df.apply(path_length_lambda, axis=1)
+            )
+
+            displacement_df = displacement_df.reset_index(drop=True)
+
+            if settings["full_obj_data"] == True:
+                df2 = linked_obj
+                df2.insert(0, "File", file_num, allow_duplicates=True)
+                full_obj_df = pd.concat([full_obj_df, df2])
+
+            # This section is finding the # of pixels that are in each of the object (object size)
+            desired_values = linked_obj[["frame", "particle", "mass"]]
+            total_objs = desired_values["particle"].iloc[-1]
+
+            for object in range(0, int(total_objs)):
+                mass_df = desired_values[desired_values["particle"] == object]
+
+                # If just one data point is available, obj is skipped, since you cant take a std from one data point
+                if len(mass_df) > 1:
+                    avg_mass = (mass_df["mass"].mean()) / 255
+                    mass_std = (mass_df["mass"].std()) / 255
+
+                    size_list = [avg_mass.round(2), mass_std.round(2)]
+                    obj_size_list.append(size_list)
+
+            obj_size_df = pd.DataFrame(
+                obj_size_list, columns=["Avg_Obj_Size", "Std_Obj_Size"]
+            )
+
+            output_df = obj_size_df.join(displacement_df)
+            final_df = pd.concat([final_df, output_df])
+
+        # With the final DF finished, calculations for summary files start
+        file_speeds = np.array(final_df.iloc[:, 8:])
+
+        summary_file["Condition"].append(proper_name)
+        summary_file["# of Files"].append(len(condition_files))
+        summary_file["Average Speed"].append(np.nanmean(file_speeds))
+        summary_file["Speed SEM"].append(np.nanstd(file_speeds) / sqrt(len(final_df)))
+        summary_file["Total # of Objects"].append(len(final_df))
+
+        final_df.to_csv(f"{proper_name}.csv", index=0)
+
+        if settings["full_obj_data"] == True:
+            full_obj_df.to_csv(f"{proper_name}-Full Object Data.csv")
+
+    summary_df = pd.DataFrame.from_dict(summary_file)
+    summary_df.to_csv("Summary.csv", index=0)
+
+    return caught_exceptions
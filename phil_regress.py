@@ -0,0 +1,543 @@
+import glob
+import json
+import os
+import os.path
+import platform
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from time import perf_counter
+
+import cv2
+import numpy as np
+import pandas as pd
+import tifffile as tif
+
+from phil_groups import build_grouping_index
+from phil_shard import find_movies
+
+# Regression checks, for signing off on a faster mode (new engines, or settings like compact_tables, sparse_masks or
+# the lossless avi codecs) before switching production runs over to it
+#
+#   python3 phil_main.py --regress FOLDER --threshold 100 --mode '{"detect_engine": "connected_components"}'
+#
+# The movies in FOLDER (and/or synthetic movies, with --synthetic) are thresholded and tracked by the reference, and
+# again by the current code with each --mode's settings changed on top of the saved settings. The reference is either:
+#   original -> the original implementation (phil_reference.py), so everything added since is checked, including the
+#               changes that are always on (prefetching, memory mapping, the locate pool, the vectorized track loops,
+#               the streamed CSVs). With no --mode, the saved settings themselves are checked against it
+#   saved    -> the current code with the saved settings, which only checks what each mode changes
+# Every run is done in its own fresh process, so the timings and peak memory of one run don't leak into the next, and
+# each mode and its reference are run --repeats times (taking turns going first), since one timing can be off by 20%.
+# Then every CSV the reference saved is compared column by column with the mode's, within the tolerances (the track
+# CSVs are lined up by track rather than particle number, since trackpy's numbering can change between runs):
+#
+#   Regression Summary.csv -> one row per mode: passed or not, # of columns that differ, the median times (and their
+#                             spread), speedup (median, min and max of the paired runs), peak memory and memory
+#                             reduction compared to the reference
+#   Regression Columns.csv -> one row per column of every CSV, with the largest differences found
+#
+# Everything is saved in FOLDER/Regression-(date & time), with each run's output in its own folder.
+
+# The synthetic movies are bright filaments moving on a dark, noisy background, with one condition of slow
+# filaments and one of fast ones
+SYNTHETIC_CONDITIONS = {"SynthSlow": 1.0, "SynthFast": 3.0}
+SYNTHETIC_THRESHOLD = 100
+SYNTHETIC_NAMING_CONVENTION = "{condition}-{file_num}"
+
+
+def make_synthetic_movies(
+    folder, movies_per_condition, num_frames=40, size=256, num_filaments=25, seed=0
+):
+    """
+    Saves movies_per_condition synthetic .tif movies for every condition in SYNTHETIC_CONDITIONS into folder
+    (named SynthSlow-01.tif, ...), and returns their filepaths. The same seed always makes the same movies
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    filepaths = []
+
+    for condition, speed in SYNTHETIC_CONDITIONS.items():
+        for file_num in range(1, movies_per_condition + 1):
+            # Every filament has a starting position, heading and length, and moves along its heading
+            start = rng.uniform(0, size, (num_filaments, 2))
+            heading = rng.uniform(0, 2 * np.pi, num_filaments)
+            half_length = rng.uniform(4, 10, num_filaments)
+            brightness = rng.uniform(180, 230, num_filaments)
+
+            frames = []
+            for frame_num in range(num_frames):
+                # A little wandering in the heading, like real filaments
+                heading += rng.normal(0, 0.05, num_filaments)
+                center = (
+                    start
+                    + speed
+                    * frame_num
+                    * np.column_stack((np.cos(heading), np.sin(heading)))
+                ) % size
+
+                image = np.full((size, size), 40, dtype=np.float32)
+                offset = half_length[:, np.newaxis] * np.column_stack(
+                    (np.cos(heading), np.sin(heading))
+                )
+                for end_1, end_2, value in zip(
+                    center - offset, center + offset, brightness
+                ):
+                    cv2.line(
+                        image,
+                        tuple(int(round(point)) for point in end_1),
+                        tuple(int(round(point)) for point in end_2),
+                        float(value),
+                        3,
+                    )
+
+                image = cv2.GaussianBlur(image, (3, 3), 0)
+                image += rng.normal(0, 8, image.shape)
+                frames.append(np.clip(image, 0, 255).astype(np.uint8))
+
+            filepath = os.path.join(folder, f"{condition}-{file_num:02d}.tif")
+            tif.imwrite(filepath, np.array(frames))
+            filepaths.append(filepath)
+
+    return filepaths
+
+
+def peak_memory():
+    # Peak memory (bytes) of this process plus its largest finished child process (e.g. the locate pool),
+    # or None if it can't be found
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        try:
+            import psutil
+
+            return psutil.Process().memory_info().peak_wset
+        except (ImportError, AttributeError):
+            return None
+
+    # ru_maxrss is in bytes on macOS and kilobytes everywhere else
+    scale = 1 if platform.system() == "Darwin" else 1024
+    return scale * (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+
+
+def run_mode(movie_paths, run_dir, settings, threshold_value, original=False):
+    """
+    Thresholds (if threshold_value isn't None) and tracks the movies into run_dir, the same way a regular run does
+    (or the way the original version of Phil did, see phil_reference.py)
+    Runs in its own process (see run_regression), and returns the times, peak memory and any caught exceptions
+    """
+    import trackpy as tp
+
+    from phil_memory import memory_budget
+    from phil_reference import (
+        original_thresholding_files,
+        original_tracking_data_analysis,
+    )
+    from phil_track import tracking_data_analysis
+
+    tp.quiet()
+    os.makedirs(run_dir)
+    os.chdir(run_dir)
+    is_avi = any(filepath.lower().endswith(".avi") for filepath in movie_paths)
+
+    threshold_start = perf_counter()
+    if threshold_value is not None and original:
+        original_thresholding_files(
+            movie_paths, threshold_value, is_avi, settings["fps"]
+        )
+
+    elif threshold_value is not None:
+        from phil_threshold import thresholding_files
+
+        thresholding_files(
+            movie_paths,
+            threshold_value,
+            None,
+            is_avi,
+            settings["fps"],
+            settings["prefetch_depth"],
+            settings["sparse_masks"],
+            settings["avi_codec"],
+            settings["binning"],
+            memory_budget(settings),
+        )
+
+    # Tracking the thresholded movies (named the same way the thresholding saves them)
+    if threshold_value is not None:
+        thresholded_paths = []
+        for filepath in movie_paths:
+            filename = os.path.basename(filepath)
+            if settings["sparse_masks"] and not original:
+                filename = os.path.splitext(filename)[0] + ".npz"
+            thresholded_paths.append(os.path.join(run_dir, "Thresh-" + filename))
+        movie_paths = thresholded_paths
+
+    track_start = perf_counter()
+    grouping_index, unmatched_files = build_grouping_index(
+        movie_paths, settings["naming_convention"]
+    )
+    if original:
+        caught_exceptions = original_tracking_data_analysis(
+            grouping_index, settings, is_avi
+        )
+    else:
+        caught_exceptions, filter_counts = tracking_data_analysis(
+            grouping_index, None, settings, is_avi, None
+        )
+    track_end = perf_counter()
+
+    for unmatched in unmatched_files:
+        caught_exceptions += f"{os.path.basename(unmatched)} was skipped because it doesn't follow the naming convention\n"
+
+    return {
+        "threshold_sec": track_start - threshold_start,
+        "track_sec": track_end - track_start,
+        "peak_memory": peak_memory(),
+        "errors": caught_exceptions,
+    }
+
+
+def compare_column(reference_values, mode_values, rtol, atol):
+    # Returns (passed, largest absolute difference, largest relative difference) for one column
+    if pd.api.types.is_numeric_dtype(reference_values) and (
+        pd.api.types.is_numeric_dtype(mode_values)
+    ):
+        reference_values = reference_values.to_numpy(dtype=np.float64)
+        mode_values = mode_values.to_numpy(dtype=np.float64)
+
+        # Both being empty (NaN) is a match, like np.isclose's equal_nan
+        passed = bool(
+            np.isclose(
+                mode_values, reference_values, rtol=rtol, atol=atol, equal_nan=True
+            ).all()
+        )
+        both_found = ~(np.isnan(reference_values) | np.isnan(mode_values))
+        if not both_found.any():
+            return passed, 0.0, 0.0
+
+        differences = np.abs(mode_values - reference_values)[both_found]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relative = differences / np.abs(reference_values[both_found])
+        relative = relative[np.isfinite(relative)]
+
+        return (
+            passed,
+            float(differences.max()),
+            float(relative.max()) if len(relative) > 0 else 0.0,
+        )
+
+    # Text columns (e.g. the condition names) have to match exactly
+    passed = bool(
+        (
+            reference_values.astype(str).to_numpy()
+            == mode_values.astype(str).to_numpy()
+        ).all()
+    )
+    return passed, np.nan, np.nan
+
+
+def track_order(reference, mode):
+    """
+    trackpy numbers the new tracks in each frame in an order that can change from one process to the next (even for
+    the same movie and settings), so the rows of the track CSVs (which are in particle order) are put into an order
+    that doesn't depend on the particle numbers before they're compared:
+        condition CSVs -> by file, first frame and first position of each track
+        Full Object Data -> by file and feature (the index trackpy gave each object when it was located)
+    Returns both tables in that order, and the name of their particle column (None for any other CSV)
+    """
+    if "Particle" in reference.columns:
+        particle_column = "Particle"
+        order = ["File", "First_Frame", "FirstX", "FirstY"]
+    elif "particle" in reference.columns:
+        particle_column = "particle"
+        order = ["File", reference.columns[0], "frame"]
+    else:
+        return reference, mode, None
+
+    order = [
+        column
+        for column in order
+        if column in reference.columns and column in mode.columns
+    ]
+    if particle_column not in mode.columns or len(order) == 0:
+        return reference, mode, None
+
+    reference = reference.sort_values(by=order, kind="mergesort").reset_index(drop=True)
+    mode = mode.sort_values(by=order, kind="mergesort").reset_index(drop=True)
+    return reference, mode, particle_column
+
+
+def same_tracks(reference, mode, particle_column):
+    # The particle numbers match if every track of the reference is exactly one track of the mode (and the other
+    # way around), whatever numbers they were given
+    files = reference["File"] if "File" in reference.columns else 0
+    pairs = pd.DataFrame(
+        {
+            "File": files,
+            "Reference": reference[particle_column].to_numpy(),
+            "Mode": mode[particle_column].to_numpy(),
+        }
+    ).drop_duplicates()
+
+    return bool(
+        not pairs.duplicated(subset=["File", "Reference"]).any()
+        and not pairs.duplicated(subset=["File", "Mode"]).any()
+    )
+
+
+def compare_outputs(reference_dir, mode_dir, rtol, atol):
+    """
+    Compares every CSV saved in reference_dir with the one of the same name in mode_dir, column by column
+    Returns a list of rows (one per column, or one per CSV if it's missing or a different length)
+    Extra CSVs or columns the mode saves (e.g. drift trajectories) are left out, since the reference has nothing to
+    compare them to
+    """
+    rows = []
+
+    for reference_path in sorted(glob.glob(os.path.join(reference_dir, "*.csv"))):
+        csv_name = os.path.basename(reference_path)
+        mode_path = os.path.join(mode_dir, csv_name)
+        row = {"File": csv_name, "Column": None, "Max Abs Diff": np.nan}
+
+        if not os.path.exists(mode_path):
+            rows.append(dict(row, Passed=False, Note="missing from the mode's output"))
+            continue
+
+        reference = pd.read_csv(reference_path)
+        mode = pd.read_csv(mode_path)
+        if len(reference) != len(mode):
+            rows.append(
+                dict(
+                    row,
+                    Passed=False,
+                    Note=f"{len(mode)} rows instead of {len(reference)}",
+                )
+            )
+            continue
+
+        reference, mode, particle_column = track_order(reference, mode)
+
+        for column in reference.columns:
+            row = {"File": csv_name, "Column": column}
+
+            if column not in mode.columns:
+                rows.append(
+                    dict(
+                        row,
+                        Passed=False,
+                        Note="missing from the mode's output",
+                    )
+                )
+                continue
+
+            if column == particle_column:
+                rows.append(
+                    dict(
+                        row,
+                        Passed=same_tracks(reference, mode, particle_column),
+                        Note="compared as tracks, not particle numbers",
+                    )
+                )
+                continue
+
+            passed, max_abs, max_rel = compare_column(
+                reference[column], mode[column], rtol, atol
+            )
+            rows.append(
+                dict(
+                    row,
+                    Passed=passed,
+                    Note="",
+                    **{"Max Abs Diff": max_abs, "Max Rel Diff": max_rel},
+                )
+            )
+
+    return rows
+
+
+def run_in_fresh_process(
+    movie_paths, run_dir, settings, threshold_value, original=False
+):
+    # A new process for every run (rather than one pool), so each starts with nothing in memory
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(
+            run_mode, movie_paths, run_dir, settings, threshold_value, original
+        ).result()
+
+
+def run_regression(
+    folder,
+    settings,
+    modes,
+    threshold_value=None,
+    synthetic_movies=0,
+    rtol=1e-6,
+    atol=1e-9,
+    reference="original",
+    repeats=3,
+):
+    """
+    run_regression takes in:
+        folder -> folder of movies, thresholded (Thresh-) movies unless a threshold_value is given (can be empty if
+                  synthetic_movies is more than 0)
+        settings -> dict of the Phil settings (the modes change these)
+        modes -> list of dicts of settings to change from the saved settings, one per mode being checked
+        threshold_value -> if given, the movies in folder are thresholded with it first
+        synthetic_movies -> # of synthetic movies to also check with, per synthetic condition
+        rtol, atol -> how far apart (relative and absolute) two numbers can be and still match, as in np.isclose
+        reference -> "original" (the original implementation) or "saved" (the current code with the saved settings)
+        repeats -> # of times each mode and its reference are run, for the medians and spreads of the timings
+
+    Saves the results in FOLDER/Regression-(date & time) (see the top of the file), and returns that folder and the
+    summary table
+    """
+    if repeats < 1:
+        raise ValueError("Please use at least 1 repeat")
+
+    if reference not in ("original", "saved"):
+        raise ValueError(
+            f"{reference} isn't a reference Phil can use, the options are: original, saved"
+        )
+
+    # Against the original, the saved settings on their own are a mode worth checking
+    if len(modes) == 0 and reference == "original":
+        modes = [{}]
+
+    if len(modes) == 0:
+        raise ValueError(
+            "Please give at least one --mode to check against the reference"
+        )
+
+    # Every run changes into its own folder, so the paths have to be absolute
+    folder = os.path.abspath(folder)
+    abs_time = datetime.now().strftime("%Y-%m-%d_%H.%M.%S")
+    output_dir = os.path.join(folder, f"Regression-{abs_time}")
+    os.makedirs(output_dir)
+
+    # Images aren't compared, so no path images are made
+    settings = dict(settings, paths=False)
+
+    movie_sets = []
+    sample_movies = find_movies(folder)
+    if len(sample_movies) > 0:
+        movie_sets.append(("Sample", sample_movies, threshold_value, {}))
+
+    if synthetic_movies > 0:
+        movie_sets.append(
+            (
+                "Synthetic",
+                make_synthetic_movies(
+                    os.path.join(output_dir, "Synthetic Movies"), synthetic_movies
+                ),
+                SYNTHETIC_THRESHOLD,
+                {"naming_convention": SYNTHETIC_NAMING_CONVENTION},
+            )
+        )
+
+    if len(movie_sets) == 0:
+        raise ValueError(
+            f"No movies were found in {folder}, add some or use --synthetic"
+        )
+
+    summary_rows = []
+    column_rows = []
+    caught_exceptions = ""
+
+    for set_name, movie_paths, set_threshold, set_settings in movie_sets:
+        for mode_num, mode in enumerate(modes, start=1):
+            runs = {"Reference": [], "Mode": []}
+            run_settings = {
+                "Reference": {**settings, **set_settings},
+                "Mode": {**settings, **mode, **set_settings},
+            }
+
+            # Each pair of runs goes in the opposite order of the last, so neither one always gets the warmer disk
+            # cache (or the busier computer)
+            for repeat in range(1, repeats + 1):
+                run_order = ["Reference", "Mode"]
+                if repeat % 2 == 0:
+                    run_order.reverse()
+
+                for run_name in run_order:
+                    runs[run_name].append(
+                        run_in_fresh_process(
+                            movie_paths,
+                            os.path.join(
+                                output_dir,
+                                set_name,
+                                f"Mode {mode_num}",
+                                f"{run_name} Run {repeat}",
+                            ),
+                            run_settings[run_name],
+                            set_threshold,
+                            run_name == "Reference" and reference == "original",
+                        )
+                    )
+
+            # The outputs are the same every repeat, so the first runs are the ones compared
+            caught_exceptions += (
+                runs["Reference"][0]["errors"] + runs["Mode"][0]["errors"]
+            )
+            mode_columns = compare_outputs(
+                os.path.join(
+                    output_dir, set_name, f"Mode {mode_num}", "Reference Run 1"
+                ),
+                os.path.join(output_dir, set_name, f"Mode {mode_num}", "Mode Run 1"),
+                rtol,
+                atol,
+            )
+            for row in mode_columns:
+                column_rows.append(dict({"Movies": set_name, "Mode": mode_num}, **row))
+
+            reference_sec = np.array(
+                [run["threshold_sec"] + run["track_sec"] for run in runs["Reference"]]
+            )
+            mode_sec = np.array(
+                [run["threshold_sec"] + run["track_sec"] for run in runs["Mode"]]
+            )
+            speedups = reference_sec / mode_sec
+
+            reference_memory = np.median(
+                [run["peak_memory"] or np.nan for run in runs["Reference"]]
+            )
+            mode_memory = np.median(
+                [run["peak_memory"] or np.nan for run in runs["Mode"]]
+            )
+
+            summary_rows.append(
+                {
+                    "Movies": set_name,
+                    "Mode": mode_num,
+                    "Reference": reference,
+                    "Settings": json.dumps(mode),
+                    "Passed": all(row["Passed"] for row in mode_columns),
+                    "Columns Checked": len(mode_columns),
+                    "Columns Failed": sum(not row["Passed"] for row in mode_columns),
+                    "Repeats": repeats,
+                    "Reference Time (s)": np.median(reference_sec),
+                    "Reference Time Spread (s)": np.ptp(reference_sec),
+                    "Mode Time (s)": np.median(mode_sec),
+                    "Mode Time Spread (s)": np.ptp(mode_sec),
+                    "Speedup": np.median(speedups),
+                    "Speedup Min": speedups.min(),
+                    "Speedup Max": speedups.max(),
+                    "Reference Peak Memory (MB)": reference_memory / 1024**2,
+                    "Mode Peak Memory (MB)": mode_memory / 1024**2,
+                    "Memory Reduction (%)": 100 * (1 - mode_memory / reference_memory),
+                }
+            )
+
+    summary = pd.DataFrame(summary_rows)
+    summary.to_csv(os.path.join(output_dir, "Regression Summary.csv"), index=0)
+    pd.DataFrame(column_rows).to_csv(
+        os.path.join(output_dir, "Regression Columns.csv"), index=0
+    )
+
+    if caught_exceptions != "":
+        with open(os.path.join(output_dir, "Errors.txt"), "w") as f:
+            f.write(caught_exceptions)
+
+    return output_dir, summary
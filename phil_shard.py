@@ -0,0 +1,289 @@
+import glob
+import json
+import os
+import os.path
+from datetime import datetime
+
+import trackpy as tp
+
+from phil_groups import build_grouping_index
+from phil_index import index_run
+from phil_numba import (
+    NUMBA_CACHE_DIR,
+    enable_kernel_cache,
+    warm_up_kernels,
+    shutdown_locate_pool,
+)
+from phil_output import combine_movie_outputs, summary_row, write_summary
+from phil_track import binned_settings, track_condition
+from phil_memory import memory_budget, plan_tracking
+
+# Sharded runs, for splitting one experiment across several computers (or several processes on one computer)
+#
+#   python3 phil_main.py --shard FOLDER 1/3      (on computer 1)
+#   python3 phil_main.py --shard FOLDER 2/3      (on computer 2)
+#   python3 phil_main.py --shard FOLDER 3/3      (on computer 3)
+#   python3 phil_main.py --merge FOLDER          (once every shard is done)
+#
+# Every shard looks at the same folder, and gets the same list of movies (sorted by condition and file number),
+# so they all agree on which movies are theirs without talking to each other. Each shard saves its movies' results
+# one file per movie in its own "Shard-K-of-N" folder, along with a Shard-Stats.json holding the running totals
+# for the summary (written last, so it also marks the shard as finished).
+#
+# The merge puts the movies back together in order, into the usual condition CSVs and Summary.csv. The rows are
+# copied as text, and the summary statistics are pooled from the running totals, so the merged output is the
+# same as tracking every movie in a single run.
+
+SHARD_STATS_NAME = "Shard-Stats.json"
+
+
+def shard_dir_name(shard_number, shard_count):
+    return f"Shard-{shard_number}-of-{shard_count}"
+
+
+def partition_files(grouping_index, shard_number, shard_count):
+    """
+    Returns the (condition, file number, filepath) of every movie that belongs to shard_number (1 to shard_count)
+    The movies are dealt out in order like cards, so every condition is spread out over all the shards
+    """
+    all_files = [
+        (proper_name, file_num, filepath)
+        for proper_name, condition_files in grouping_index.items()
+        for file_num, filepath in condition_files
+    ]
+
+    return all_files[shard_number - 1 :: shard_count]
+
+
+def find_movies(folder):
+    return sorted(
+        os.path.join(folder, filename)
+        for filename in os.listdir(folder)
+        if os.path.splitext(filename)[1].lower() in (".tif", ".tiff", ".avi", ".npz")
+    )
+
+
+def run_shard(folder, settings, shard_number, shard_count, threshold_value=None):
+    """
+    run_shard takes in:
+        folder -> folder of movies, thresholded (Thresh-) movies unless a threshold_value is given
+        settings -> dict of the Phil settings
+        shard_number, shard_count -> which shard this is (1 to shard_count), and how many there are in total
+        threshold_value -> if given, the folder has the original movies, and this shard thresholds its own movies first
+
+    Saves the shard's results in FOLDER/Shard-K-of-N, and returns any caught exceptions
+    """
+    if not 1 <= shard_number <= shard_count:
+        raise ValueError(f"Shard {shard_number} doesn't exist in {shard_count} shards")
+
+    tp.quiet()
+
+    folder = os.path.abspath(folder)
+    grouping_index, unmatched_files = build_grouping_index(
+        find_movies(folder), settings["naming_convention"]
+    )
+    shard_files = partition_files(grouping_index, shard_number, shard_count)
+    is_avi = any(filepath.endswith(".avi") for _, _, filepath in shard_files)
+
+    shard_dir = os.path.join(folder, shard_dir_name(shard_number, shard_count))
+    os.makedirs(shard_dir, exist_ok=True)
+    os.chdir(shard_dir)
+
+    # Removing the stats from an earlier try of this shard, so it can't be merged until it finishes again
+    if os.path.exists(SHARD_STATS_NAME):
+        os.remove(SHARD_STATS_NAME)
+
+    if threshold_value is not None:
+        from phil_threshold import thresholding_files
+
+        thresholding_files(
+            [filepath for _, _, filepath in shard_files],
+            threshold_value,
+            None,
+            is_avi,
+            settings["fps"],
+            settings["prefetch_depth"],
+            settings["sparse_masks"],
+            settings["avi_codec"],
+            settings["binning"],
+            memory_budget(settings),
+        )
+
+        # Tracking the thresholded movies (named the same way thresholding_files saves them)
+        thresholded_files = []
+        for proper_name, file_num, filepath in shard_files:
+            filename = os.path.basename(filepath)
+            if settings["sparse_masks"]:
+                filename = os.path.splitext(filename)[0] + ".npz"
+
+            thresholded_files.append(
+                (proper_name, file_num, os.path.join(shard_dir, "Thresh-" + filename))
+            )
+        shard_files = thresholded_files
+
+    if settings["paths"]:
+        paths_dir = os.path.join(shard_dir, "Path Images")
+        os.makedirs(paths_dir, exist_ok=True)
+    else:
+        paths_dir = None
+
+    # Binned movies are tracked with the pixel measurements rescaled to the binned pixels, and the shard is
+    # fitted into the memory budget (see phil_memory.py)
+    tracking_settings = plan_tracking(
+        {filepath: [(file_num, filepath)] for _, file_num, filepath in shard_files},
+        is_avi,
+        binned_settings(settings),
+        memory_budget(settings),
+    )
+
+    cache_dir = NUMBA_CACHE_DIR if settings["numba_cache"] else None
+    if cache_dir is not None:
+        enable_kernel_cache(cache_dir)
+    warm_up_kernels(tracking_settings["object_area"])
+
+    caught_exceptions = ""
+    filter_counts = {}
+    file_stats = []
+
+    # Each movie is tracked as a condition of one file, with its own output files (named after the movie)
+    for proper_name, file_num, filepath in shard_files:
+        output_name = os.path.splitext(os.path.basename(filepath))[0]
+
+        speed_stats, movie_exceptions, movie_filter_counts = track_condition(
+            proper_name,
+            [(file_num, filepath)],
+            tracking_settings,
+            is_avi,
+            paths_dir,
+            output_name=output_name,
+        )
+
+        caught_exceptions += movie_exceptions
+        for name, count in movie_filter_counts.items():
+            filter_counts[name] = filter_counts.get(name, 0) + count
+
+        file_stats.append(
+            {
+                "condition": proper_name,
+                "file_num": file_num,
+                "output_name": output_name,
+                "speed_stats": speed_stats,
+            }
+        )
+
+    shutdown_locate_pool()
+
+    # The files that don't follow the naming convention are the same for every shard, so only the first lists them
+    if shard_number == 1:
+        for unmatched in unmatched_files:
+            caught_exceptions += f"{os.path.basename(unmatched)} was skipped because it doesn't follow the naming convention\n"
+
+    with open(SHARD_STATS_NAME, "w") as f:
+        json.dump(
+            {
+                "shard_number": shard_number,
+                "shard_count": shard_count,
+                "threshold_value": threshold_value,
+                "settings": settings,
+                "files": file_stats,
+                "filter_counts": filter_counts,
+                "caught_errors": caught_exceptions,
+            },
+            f,
+            indent=4,
+        )
+
+    return caught_exceptions
+
+
+def merge_shards(folder):
+    """
+    merge_shards takes in the folder the shards were run on, and combines every shard's results into the usual
+    condition CSVs (and Full Object Data) and Summary.csv in that folder, plus a PhilOutput file
+    Returns any exceptions caught by the shards
+    """
+    folder = os.path.abspath(folder)
+
+    shards = []
+    for stats_path in glob.glob(os.path.join(folder, "Shard-*-of-*", SHARD_STATS_NAME)):
+        with open(stats_path) as f:
+            shard = json.load(f)
+        shard["dir"] = os.path.dirname(stats_path)
+        shards.append(shard)
+
+    if len(shards) == 0:
+        raise FileNotFoundError(f"No finished shards were found in {folder}")
+
+    # Making sure every shard of the run has finished (and that they're all from the same split)
+    shard_count = shards[0]["shard_count"]
+    shard_numbers = {
+        shard["shard_number"] for shard in shards if shard["shard_count"] == shard_count
+    }
+    missing = sorted(set(range(1, shard_count + 1)) - shard_numbers)
+
+    if len(missing) > 0 or len(shard_numbers) != len(shards):
+        raise ValueError(
+            f"The shards in {folder} aren't complete (missing shards: {missing}), "
+            "make sure every shard has finished and they were all run with the same # of shards"
+        )
+
+    shards.sort(key=lambda shard: shard["shard_number"])
+    settings = shards[0]["settings"]
+
+    # Gathering every movie by condition, in the same order a single run would have tracked them
+    condition_files = {}
+    caught_exceptions = ""
+    filter_counts = {}
+
+    for shard in shards:
+        caught_exceptions += shard["caught_errors"]
+        for name, count in shard["filter_counts"].items():
+            filter_counts[name] = filter_counts.get(name, 0) + count
+
+        for file_stats in shard["files"]:
+            condition_files.setdefault(file_stats["condition"], []).append(
+                (
+                    file_stats["file_num"],
+                    os.path.join(shard["dir"], file_stats["output_name"]),
+                    file_stats["speed_stats"],
+                )
+            )
+
+    os.chdir(folder)
+
+    summary_rows = [
+        summary_row(
+            proper_name,
+            len(condition_files[proper_name]),
+            combine_movie_outputs(
+                proper_name, condition_files[proper_name], settings["full_obj_data"]
+            ),
+        )
+        for proper_name in sorted(condition_files)
+    ]
+
+    write_summary(summary_rows)
+
+    # Adding the merged run to the results index (if "results_index" is on)
+    caught_exceptions += index_run(
+        folder, settings, shards[0]["threshold_value"], errors=caught_exceptions
+    )
+
+    if caught_exceptions == "":
+        caught_exceptions = "None"
+
+    abs_time = datetime.now().strftime("%Y-%m-%d_%H.%M.%S")
+    with open(f"PhilOutput-{abs_time}.txt", "w") as f:
+        f.write(f"""Merged from {shard_count} shards
+
+Parameters used were:
+{json.dumps(settings, indent = 4)}
+Thresholding Value:
+{shards[0]["threshold_value"]}
+Removed by Filters (objects, and short_tracks in tracks):
+{json.dumps(filter_counts, indent = 4)}
+Errors:
+{caught_exceptions}
+""")
+
+    return caught_exceptions
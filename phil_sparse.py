@@ -0,0 +1,130 @@
+import cv2
+import numpy as np
+
+# Sparse thresholded movies (used when "sparse_masks" is true in the settings)
+#
+# Thresholded frames are only two values, objects (0) and background (255), and the objects only cover a small
+# part of each frame. So rather than saving every pixel, each row of each frame is saved as "runs" of object pixels:
+#
+#   frame 0, row 12: .........XXXX......XX...   ->  (row 12, start 9, length 4), (row 12, start 19, length 2)
+#
+# Every movie is saved as a single Thresh-(name).npz file holding these arrays:
+#   shape          -> (# of frames, height, width) of the movie
+#   frame_offsets  -> where each frame's runs start (frame i's runs are frame_offsets[i] to frame_offsets[i + 1])
+#   rows, starts, lengths -> one entry per run, in frame order
+#
+# For our filament videos this is 10-50x smaller than the full frames, and both encoding and decoding are done
+# for the whole movie at once with numpy (no loops over frames or pixels).
+
+
+def encode_masks(frames):
+    """
+    encode_masks takes in a list (or array) of thresholded frames, and returns the runs as a dictionary of arrays
+    Pixels below 128 are objects, the same as the connected components detection
+    """
+    # Color frames (from .avi files) are converted to grayscale, the same as when Thresh- .avi files are tracked
+    if len(frames) > 0 and frames[0].ndim == 3:
+        frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+
+    frames = np.asarray(frames)
+    if frames.ndim != 3:
+        frames = np.zeros((0, 0, 0), dtype=np.uint8)
+    num_frames, height, width = frames.shape
+
+    # Padding every row with background on both sides, so every run has a start and an end
+    padded = np.zeros((num_frames, height, width + 2), dtype=np.int8)
+    padded[:, :, 1:-1] = frames < 128
+    edges = np.diff(padded, axis=2)
+
+    # Both come out in the same (frame, row, column) order, so the nth start goes with the nth end
+    run_frames, rows, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[2]
+
+    frame_offsets = np.zeros(num_frames + 1, dtype=np.int64)
+    frame_offsets[1:] = np.cumsum(np.bincount(run_frames, minlength=num_frames))
+
+    # uint16 is plenty for any camera we've used, so the runs only take 6 bytes each
+    index_dtype = np.uint16 if max(height, width) < 2**16 else np.uint32
+
+    return {
+        "shape": np.array([num_frames, height, width], dtype=np.int64),
+        "frame_offsets": frame_offsets,
+        "rows": rows.astype(index_dtype),
+        "starts": starts.astype(index_dtype),
+        "lengths": (ends - starts).astype(index_dtype),
+    }
+
+
+def decode_masks(sparse, first_frame=0, last_frame=None):
+    """
+    decode_masks takes in the runs from encode_masks (or read_sparse_movie), and the range of frames wanted
+    Returns the frames as a uint8 array (frames x height x width) with objects as 0 and background as 255,
+    the same as the frames from thresholding_files
+    """
+    num_frames, height, width = (int(size) for size in sparse["shape"])
+    if last_frame is None or last_frame > num_frames:
+        last_frame = num_frames
+
+    frames = np.full(
+        (max(last_frame - first_frame, 0), height, width), 255, dtype=np.uint8
+    )
+
+    first_run = sparse["frame_offsets"][first_frame]
+    last_run = sparse["frame_offsets"][last_frame]
+    runs_per_frame = np.diff(sparse["frame_offsets"][first_frame : last_frame + 1])
+
+    run_frames = np.repeat(np.arange(len(frames), dtype=np.int64), runs_per_frame)
+    rows = sparse["rows"][first_run:last_run].astype(np.int64)
+    starts = sparse["starts"][first_run:last_run].astype(np.int64)
+    lengths = sparse["lengths"][first_run:last_run].astype(np.int64)
+
+    # Position of every run's first pixel in the flattened movie, then every pixel of every run, all at once
+    run_positions = (run_frames * height + rows) * width + starts
+    pixels_before = np.cumsum(lengths) - lengths
+    pixels = np.repeat(run_positions - pixels_before, lengths) + np.arange(
+        lengths.sum()
+    )
+
+    frames.reshape(-1)[pixels] = 0
+    return frames
+
+
+def write_sparse_movie(filename, threshold_images):
+    # np.savez (rather than savez_compressed), since the runs are already small and this keeps reading fast
+    np.savez(filename, **encode_masks(threshold_images))
+
+
+def read_sparse_movie(filename):
+    with np.load(filename) as sparse_file:
+        return {name: sparse_file[name] for name in sparse_file.files}
+
+
+def write_sparse_chunks(filename, chunks):
+    # Same as write_sparse_movie, for a movie thresholded a chunk of frames at a time (see phil_memory.py).
+    # Each chunk is encoded on its own, and the runs are joined up, so only one chunk of frames is in memory
+    encoded_chunks = [encode_masks(chunk) for chunk in chunks]
+    encoded_chunks = [
+        encoded for encoded in encoded_chunks if encoded["shape"][0] > 0
+    ] or [encode_masks([])]
+
+    frame_offsets = [np.zeros(1, dtype=np.int64)]
+    for encoded in encoded_chunks:
+        frame_offsets.append(encoded["frame_offsets"][1:] + frame_offsets[-1][-1])
+
+    sparse = {
+        "shape": np.array(
+            [
+                sum(int(encoded["shape"][0]) for encoded in encoded_chunks),
+                encoded_chunks[0]["shape"][1],
+                encoded_chunks[0]["shape"][2],
+            ],
+            dtype=np.int64,
+        ),
+        "frame_offsets": np.concatenate(frame_offsets),
+    }
+
+    # Every chunk has the same frame size, so they all use the same dtype for the runs
+    for name in ("rows", "starts", "lengths"):
+        sparse[name] = np.concatenate([encoded[name] for encoded in encoded_chunks])
+
+    np.savez(filename, **sparse)
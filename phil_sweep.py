@@ -0,0 +1,221 @@
+import os
+import os.path
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import product
+
+import numpy as np
+import pandas as pd
+import trackpy as tp
+
+from phil_groups import build_grouping_index
+from phil_io import prefetch
+from phil_memory import memory_budget, plan_tracking
+from phil_drift import correct_drift
+from phil_numba import (
+    NUMBA_CACHE_DIR,
+    enable_kernel_cache,
+    warm_up_kernels,
+    prepare_worker,
+    shutdown_locate_pool,
+)
+from phil_output import new_speed_stats, update_speed_stats, summary_row
+from phil_track import (
+    analyzed_tracks,
+    track_table,
+    load_thresholded_movie,
+    locate_movie,
+    filter_features,
+    binned_settings,
+)
+
+# Sweep mode, for tuning the linking settings (search radius, tracking memory) and the minimum track length
+# without rerunning all of Phil for every combination.
+#
+# The objects are located once per movie (which is the slow part), and then every combination is linked and
+# analyzed from those same features, in parallel. The result is one small table with a row for every
+# combination and condition, so the settings can be compared side by side. The middle columns are worked out
+# exactly like Summary.csv (from the same tracks and rows a regular run saves), so they can be compared with it:
+#
+# Search Range | Memory | Min Track Length |  Condition  | # of Files | Average Speed | Speed SEM | Total # of Objects | Mean Track Length
+# ---------------------------------------------------------------------------------------------------------------------------------
+#      25      |   3    |        2         | ActinMyosin |     4      |     3.21      |   0.061   |        412         |       9.8
+#      35      |   3    |        2         | ActinMyosin |     4      |     3.34      |   0.066   |        377         |      10.9
+
+# The located features of every movie, set once in each sweep worker (see prepare_sweep_worker)
+sweep_features = None
+
+
+def prepare_sweep_worker(features, object_area, cache_dir):
+    # Initializer for the sweep workers, the features are sent once to each worker rather than with every combination
+    global sweep_features
+
+    prepare_worker(object_area, cache_dir)
+    sweep_features = features
+
+
+def link_combination(
+    search_range,
+    memory,
+    min_track_length,
+    pixel_size,
+    fps,
+    binning=1,
+    drift_correction=None,
+):
+    # Links and analyzes every movie with one combination of the sweep settings (runs in the sweep workers)
+    # The search range is in the camera's pixels, and pixel_size in the binned pixels (see binned_settings)
+    rows = []
+    caught_exceptions = ""
+
+    # track_table only needs the pixel size and fps from the settings
+    movie_settings = {"pixel_size": pixel_size, "fps": fps}
+
+    for proper_name, movie_features in sweep_features.items():
+        speed_stats = new_speed_stats()
+        track_lengths = []
+
+        for file_num, f in movie_features:
+            try:
+                linked_obj = tp.link_df(f, search_range / binning, memory=memory)
+            except Exception as e:
+                caught_exceptions += f"{proper_name}{file_num} (search range {search_range}, memory {memory}) was skipped due to:\n{e}\n"
+                continue
+
+            # Same drift correction as a regular run (see phil_drift.py)
+            if drift_correction is not None and len(linked_obj) > 0:
+                correct_drift(
+                    linked_obj, drift_correction, linked_obj["frame"].max() + 1
+                )
+
+            if len(linked_obj) == 0:
+                continue
+
+            # The same tracks and rows a regular run saves, so the numbers are the same as its Summary.csv
+            linked_obj = linked_obj.sort_values(by=["particle", "frame"])
+            tracks = analyzed_tracks(linked_obj, min_track_length)[0]
+            update_speed_stats(
+                speed_stats, track_table(tracks, file_num, movie_settings)
+            )
+            track_lengths.append(tracks.groupby("particle").size())
+
+        if len(track_lengths) > 0:
+            track_lengths = pd.concat(track_lengths)
+        else:
+            track_lengths = pd.Series([], dtype=np.float64)
+
+        rows.append(
+            {
+                "Search Range": search_range,
+                "Memory": memory,
+                "Min Track Length": min_track_length,
+                **summary_row(proper_name, len(movie_features), speed_stats),
+                "Mean Track Length": track_lengths.mean(),
+            }
+        )
+
+    return rows, caught_exceptions
+
+
+def run_sweep(
+    folder, settings, search_ranges, memories, min_track_lengths, workers="auto"
+):
+    """
+    run_sweep takes in:
+        folder -> folder of thresholded (Thresh-) movies, e.g. the "-Analyzed Files" folder from an earlier run
+        settings -> dict of the Phil settings (everything other than the swept settings comes from here)
+        search_ranges, memories, min_track_lengths -> lists of values to try, every combination is run
+        workers -> number of processes linking combinations at once ("auto" uses every CPU)
+
+    Saves the comparison table as Sweep-(date & time).csv in the folder, and returns its path and any caught exceptions
+    """
+    tp.quiet()
+
+    # Only the movies are looked at, since an analyzed folder also has the output files from its run
+    filepaths = [
+        os.path.join(folder, filename)
+        for filename in os.listdir(folder)
+        if os.path.splitext(filename)[1].lower() in (".tif", ".tiff", ".avi", ".npz")
+    ]
+    grouping_index, unmatched_files = build_grouping_index(
+        filepaths, settings["naming_convention"]
+    )
+    is_avi = any(filepath.endswith(".avi") for filepath in filepaths)
+
+    # Binned movies are located with the pixel measurements rescaled to the binned pixels (the swept search
+    # ranges are rescaled when linking, so the table still shows them in the camera's pixels), and the movies
+    # are located within the memory budget (see phil_memory.py)
+    settings = plan_tracking(
+        grouping_index, is_avi, binned_settings(settings), memory_budget(settings)
+    )
+
+    cache_dir = NUMBA_CACHE_DIR if settings["numba_cache"] else None
+    if cache_dir is not None:
+        enable_kernel_cache(cache_dir)
+    warm_up_kernels(settings["object_area"])
+
+    # Locating the objects once per movie (with the same feature filters as a regular run). Only the columns
+    # needed for linking (and the mass, for the object sizes) are kept, which keeps the features small enough to
+    # send to every worker
+    features = {}
+    for proper_name, condition_files in grouping_index.items():
+        movies = prefetch(
+            condition_files,
+            lambda condition_file: load_thresholded_movie(
+                condition_file[1], is_avi, settings
+            ),
+            settings["prefetch_depth"],
+        )
+
+        features[proper_name] = [
+            (
+                file_num,
+                filter_features(
+                    locate_movie(file_path, movie.result(), is_avi, settings)[0],
+                    settings,
+                )[0][["x", "y", "frame", "mass"]],
+            )
+            for (file_num, file_path), movie in movies
+        ]
+
+    shutdown_locate_pool()
+
+    combinations = list(product(search_ranges, memories, min_track_lengths))
+    if workers == "auto":
+        workers = os.cpu_count()
+    workers = max(1, min(workers, len(combinations)))
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=prepare_sweep_worker,
+        initargs=(features, settings["object_area"], cache_dir),
+    ) as pool:
+        futures = [
+            pool.submit(
+                link_combination,
+                search_range,
+                memory,
+                min_track_length,
+                settings["pixel_size"],
+                settings["fps"],
+                settings["binning"],
+                settings["drift_correction"],
+            )
+            for search_range, memory, min_track_length in combinations
+        ]
+
+        sweep_rows = []
+        caught_exceptions = ""
+        for future in futures:
+            rows, combination_exceptions = future.result()
+            sweep_rows += rows
+            caught_exceptions += combination_exceptions
+
+    for unmatched in unmatched_files:
+        caught_exceptions += f"{os.path.basename(unmatched)} was skipped because it doesn't follow the naming convention\n"
+
+    abs_time = datetime.now().strftime("%Y-%m-%d_%H.%M.%S")
+    sweep_path = os.path.join(folder, f"Sweep-{abs_time}.csv")
+    pd.DataFrame(sweep_rows).to_csv(sweep_path, index=0)
+
+    return sweep_path, caught_exceptions
@@ -3,7 +3,6 @@ import random
 from tkinter import ttk
 
 
-from tkinter.messagebox import showinfo
 from tkinter import messagebox
 import os
 import os.path
@@ -11,8 +10,21 @@ import sys
 import tkinter as tk
 import cv2
 import tifffile as tif
-from numpy import array
-from pims import PyAVVideoReader
+from numpy import array, uint8
+
+from phil_io import (
+    prefetch,
+    read_raw_movie,
+    read_first_frame,
+    read_raw_chunks,
+    start_writer,
+    submit_write,
+    finish_writer,
+    write_thresholded_avi,
+)
+from phil_progress import report
+from phil_sparse import write_sparse_movie, write_sparse_chunks
+from phil_memory import plan_thresholding, read_movie_header
 
 
 # this generates the sample size for showing the user images to
@@ -57,7 +69,7 @@ def sample_generation(filepaths):
 # Always at least 1 video, and capped at 5 if n > 200 (n is number of selected files)
 
 
-def threshold_value_testing(filepaths_list, screen_dimensions):
+def threshold_value_testing(filepaths_list, screen_dimensions, binning=1):
     # close() is not super neccesary, but its easier to bundle these two commands together this way...
     # sorry Tim Peters
     def close():
@@ -128,16 +140,11 @@ def threshold_value_testing(filepaths_list, screen_dimensions):
         checking_images = []
         current_num = i + 1
 
-        # This reader function from PIMS is utilized instead of the opencv imread
-        if is_avi == True:
-            checking_images = PyAVVideoReader(filepaths_list[rand_file_num[i]])
-
-        else:
-            loaded, checking_images = cv2.imreadmulti(
-                mats=checking_images,
-                filename=filepaths_list[rand_file_num[i]],
-                flags=cv2.IMREAD_GRAYSCALE,
-            )
+        # Only the first frame is shown, so just that frame is read (memory mapped for .tif files when possible),
+        # and it's binned the same way the movies will be when they're thresholded
+        checking_images = [
+            read_first_frame(filepaths_list[rand_file_num[i]], is_avi, binning)
+        ]
 
         # Here 100 is just a default starting point for the thresholding value
         threshold_value = tk.IntVar(thresh_check_frame, 100)
@@ -183,14 +190,93 @@ def threshold_value_testing(filepaths_list, screen_dimensions):
     return threshold_value, is_avi
 
 
-def thresholding_files(filepath, threshold_value, progress, root, is_avi, fps):
+def threshold_frame(frame, threshold_value):
+    # Image processing (blur & thresholding)
+    kernel_size = 5
+    blur = cv2.medianBlur(frame, kernel_size)
+
+    ret, image = cv2.threshold(blur, threshold_value, 255, cv2.THRESH_BINARY_INV)
+    return image
+
+
+def threshold_movie_in_chunks(
+    movie_path,
+    threshold_value,
+    is_avi,
+    fps,
+    sparse_masks,
+    avi_codec,
+    binning,
+    chunk_frames,
+):
+    """
+    Thresholds and saves a movie too big to hold in memory, chunk_frames frames at a time (see phil_memory.py)
+    The saved file is the same as thresholding the whole movie at once. Returns the # of frames thresholded
+    """
+    filename = os.path.basename(movie_path)
+    num_frames = 0
+
+    def thresholded_chunks():
+        nonlocal num_frames
+        for chunk in read_raw_chunks(movie_path, is_avi, chunk_frames, binning):
+            num_frames += len(chunk)
+            yield [threshold_frame(frame, threshold_value) for frame in chunk]
+
+    if sparse_masks:
+        write_sparse_chunks(
+            "Thresh-" + os.path.splitext(filename)[0] + ".npz", thresholded_chunks()
+        )
+
+    elif is_avi:
+        write_thresholded_avi(
+            "Thresh-" + filename,
+            (image for chunk in thresholded_chunks() for image in chunk),
+            fps,
+            avi_codec,
+        )
+
+    # The .tif is written a frame at a time, which needs the size of the movie up front
+    else:
+        header = read_movie_header(movie_path, is_avi)
+        tif.imwrite(
+            "Thresh-" + filename,
+            (image for chunk in thresholded_chunks() for image in chunk),
+            shape=(
+                header["frames"],
+                header["height"] // binning,
+                header["width"] // binning,
+            ),
+            dtype=uint8,
+        )
+
+    return num_frames
+
+
+def thresholding_files(
+    filepath,
+    threshold_value,
+    progress_queue,
+    is_avi,
+    fps,
+    prefetch_depth=2,
+    sparse_masks=False,
+    avi_codec="XVID",
+    binning=1,
+    memory_budget=None,
+):
     """
     Thresholding_files takes in:
         [List] containing the input filepaths (filepath)
         Int containing the threshold value calculated from threshold_value_testing (threshold_value)
-        progress & root are tk variables for the progress bar
+        progress_queue is where progress messages are sent for the progress bar window (see phil_progress.py),
+        this runs in a background thread, so it can't touch the tk window itself (None if there is no window)
         Is_avi indicates if the files are .avi (is_avi = True), or if they are .tif (is_avi = False)
         Fps is the frame rate of the video
+        Prefetch_depth is how many movies are read ahead (and saved behind) in background threads
+        Sparse_masks saves the thresholded movies as runs of object pixels (.npz, see phil_sparse.py) instead of .tif/.avi
+        Avi_codec is the codec the thresholded .avi files are saved with (XVID, or the lossless FFV1 or GRAY, see phil_io.py)
+        Binning averages every binning x binning block of pixels into one as the movies are read (1 is no binning)
+        Memory_budget is the most memory (in bytes) the thresholding should use, or None for no limit (see phil_memory.py)
 
                 Workflow
     ---------------------------------
@@ -198,87 +284,124 @@ def thresholding_files(filepath, threshold_value, progress, root, is_avi, fps):
 
         a. assert that it is a file
         b. check if the file is .tif or .avi
-        c. read file using cv2 or pims respectively
+        c. read file using cv2 or PyAV respectively (.tif files are already read ahead by the prefetch thread)
+           (.avi files, and movies too big for the memory budget, are read, thresholded and saved a chunk of frames
+           at a time instead)
 
         d. for (loop) every frame of each file:
             *Median blur frame
             *Threshold frame
 
-        e. save thresholded movie as "Thresh" + original filename
-        f. increase progress bar by 1
+        e. save thresholded movie as "Thresh" + original filename (in the writer thread, as .npz for sparse masks)
+        f. send the # of files/frames done to the progress bar
         g. repeat
 
     return
 
     """
     try:
-        kernel_size = 5
-        for i in range(0, len(filepath)):
+        # Fitting the thresholding into the memory budget (see phil_memory.py): movies too big to hold in memory
+        # are streamed, and fewer movies are read ahead if needed
+        prefetch_depth, streamed = plan_thresholding(
+            filepath, is_avi, prefetch_depth, binning, memory_budget
+        )
+
+        # .avi files are always streamed a frame at a time (like the original pims -> VideoWriter loop), since
+        # decoding a whole .avi into memory takes several times the size of the file (and more for each one
+        # read ahead). FFmpeg still decodes ahead in its own threads
+        if is_avi:
+            streamed = {path: 1 for path in filepath}
+
+        # The next movies are read in a background thread while the current one is thresholded, and the
+        # thresholded movies are saved in another thread (see phil_io.py)
+        writer = start_writer(prefetch_depth)
+        movies = prefetch(
+            filepath,
+            lambda path: (
+                None if path in streamed else read_raw_movie(path, is_avi, binning)
+            ),
+            prefetch_depth,
+        )
+
+        for i, (movie_path, movie) in enumerate(movies):
             # incase someone selects non-files
-            assert os.path.isfile(filepath[i])
+            assert os.path.isfile(movie_path)
             try:
                 threshold_images = []
-                original_images = []
-                filename = os.path.basename(filepath[i])
-
-                if is_avi == True:
-                    original_images = PyAVVideoReader(filepath[i])
-
-                    avi_size = original_images.frame_shape
-
-                    # Fourcc code for AVI
-                    fourcc = cv2.VideoWriter_fourcc(*"XVID")
-                    avi_image = cv2.VideoWriter(
-                        "Thresh-" + filename, fourcc, fps, (avi_size[1], avi_size[0])
+                filename = os.path.basename(movie_path)
+                report(progress_queue, stage=f"Thresholding {filename}")
+
+                if movie_path in streamed:
+                    num_frames = threshold_movie_in_chunks(
+                        movie_path,
+                        threshold_value,
+                        is_avi,
+                        fps,
+                        sparse_masks,
+                        avi_codec,
+                        binning,
+                        streamed[movie_path],
                     )
+                    report(progress_queue, files=1, frames=num_frames)
+                    continue
 
-                else:
-                    loaded, original_images = cv2.imreadmulti(
-                        mats=original_images,
-                        filename=f"{filepath[i]}",
-                        flags=cv2.IMREAD_GRAYSCALE,
-                    )
+                original_images = movie.result()
 
                 for x in range(0, len(original_images)):
-                    # Image processing (blur & thresholding)
-                    blur = cv2.medianBlur(original_images[x], kernel_size)
-
-                    ret, image = cv2.threshold(
-                        blur, threshold_value, 255, cv2.THRESH_BINARY_INV
+                    threshold_images.append(
+                        threshold_frame(original_images[x], threshold_value)
                     )
 
-                    if is_avi:
-                        avi_image.write(image)
-
-                    else:
-                        threshold_images.append(image)
+                if sparse_masks:
+                    submit_write(
+                        writer,
+                        write_sparse_movie,
+                        "Thresh-" + os.path.splitext(filename)[0] + ".npz",
+                        threshold_images,
+                    )
 
-                # the file name is specified in line 193ish, saving memory here (I hope)
-                if is_avi:
-                    avi_image.release()
+                elif is_avi:
+                    submit_write(
+                        writer,
+                        write_thresholded_avi,
+                        "Thresh-" + filename,
+                        threshold_images,
+                        fps,
+                        avi_codec,
+                    )
 
                 else:
                     threshold_array = array(threshold_images)
-                    tif.imwrite("Thresh-" + filename, threshold_array)
+                    submit_write(
+                        writer, tif.imwrite, "Thresh-" + filename, threshold_array
+                    )
 
-                progress.set(i + 1)
-                root.update()
+                report(progress_queue, files=1, frames=len(original_images))
 
             except AssertionError:
-                showinfo(
-                    title="Assertion Error",
-                    message=f"Sorry, there was an error with: {filename[i]}\nPhil couldn't determine if it is a file or not.\nPlease try again.",
+                report(
+                    progress_queue,
+                    message=(
+                        "Assertion Error",
+                        f"Sorry, there was an error with: {filename[i]}\nPhil couldn't determine if it is a file or not.\nPlease try again.",
+                    ),
                 )
 
     # There were a few times I got a random NameError, so added this as failsafe
     # Still unsure of cause
     except NameError:
-        showinfo(
-            title="Error",
-            message=f"Phil encountered a NameError. Try rerunning the program, and ensure all files selected are .tif or .avi image sequences",
+        report(
+            progress_queue,
+            message=(
+                "Error",
+                f"Phil encountered a NameError. Try rerunning the program, and ensure all files selected are .tif or .avi image sequences",
+            ),
         )
         sys.exit()
 
+    # Making sure every thresholded movie is saved before tracking starts
+    finish_writer(writer)
+
     # putting this here to make a figure for review
     # return original_images[0]
     return
@@ -6,8 +6,48 @@ import os.path
 import cv2
 
 import pandas as pd
-import tifffile as tif
-from pims import PyAVVideoReader
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from multiprocessing import Manager
+import queue
+from math import ceil
+from collections import Counter
+
+from phil_output import (
+    start_condition_output,
+    append_condition_rows,
+    append_full_obj_rows,
+    finish_condition_output,
+    new_speed_stats,
+    update_speed_stats,
+    summary_row,
+    write_summary,
+)
+from phil_io import (
+    prefetch,
+    read_thresholded_movie,
+    read_thresholded_chunks,
+    frame_chunk,
+    load_frame_chunk,
+    start_writer,
+    submit_write,
+    finish_writer,
+)
+from phil_progress import report
+from phil_memory import memory_budget, plan_tracking
+from phil_drift import correct_drift, write_condition_drift
+from phil_analytics import (
+    start_condition_analytics,
+    add_movie_analytics,
+    write_condition_analytics,
+)
+from phil_numba import (
+    NUMBA_CACHE_DIR,
+    enable_kernel_cache,
+    warm_up_kernels,
+    prepare_worker,
+    get_locate_pool,
+    shutdown_locate_pool,
+)
 
 
 # This function creates a dictionary containing row names for the output DF, which will then be transposed into column names.
@@ -34,29 +74,479 @@ def column_naming(df_length, file_fps):
     return df_dict
 
 
+def locate_frame_components(frame, frame_num):
+    """
+    locate_frame_components takes in:
+        A single thresholded frame (dark objects on a white background, the same as the Thresh- files)
+        The frame number, which is saved in the "frame" column so trackpy can link the objects later
+
+    Returns a DataFrame with one row per object (connected group of object pixels):
+
+      y  |  x  | mass | area | bbox_x | bbox_y | bbox_w | bbox_h | orientation | ecc | frame
+    --------------------------------------------------------------------------------------
+    Centroid of the object, mass is the area * 255 (the same thing trackpy measures on a binary image),
+    the bounding box, the orientation of the long axis in degrees and the eccentricity (0 is a circle, 1 is a line)
+    """
+    # The thresholded images have objects at 0 and the background at 255 (THRESH_BINARY_INV),
+    # so the objects need to be flipped to be the "foreground" for connectedComponents
+    object_mask = (frame < 128).astype(np.uint8)
+
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(
+        object_mask, connectivity=8
+    )
+
+    # Label 0 is always the background
+    stats = stats[1:]
+    centroids = centroids[1:]
+    area = stats[:, cv2.CC_STAT_AREA].astype(np.float64)
+
+    # Second order moments for every object at once (no looping over objects), by summing
+    # the pixel positions of every labeled pixel into its label's bin
+    pixel_y, pixel_x = np.nonzero(labels)
+    pixel_labels = labels[pixel_y, pixel_x] - 1
+    pixel_x = pixel_x - centroids[pixel_labels, 0]
+    pixel_y = pixel_y - centroids[pixel_labels, 1]
+
+    mu20 = np.bincount(pixel_labels, pixel_x * pixel_x, num_labels - 1) / area
+    mu02 = np.bincount(pixel_labels, pixel_y * pixel_y, num_labels - 1) / area
+    mu11 = np.bincount(pixel_labels, pixel_x * pixel_y, num_labels - 1) / area
+
+    # Eigenvalues of the covariance matrix give the long (major) and short (minor) axes
+    common = np.sqrt(((mu20 - mu02) / 2) ** 2 + mu11**2)
+    major = (mu20 + mu02) / 2 + common
+    minor = (mu20 + mu02) / 2 - common
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ecc = np.where(major > 0, np.sqrt(1 - minor / major), 0)
+
+    orientation = np.degrees(0.5 * np.arctan2(2 * mu11, mu20 - mu02))
+
+    return pd.DataFrame(
+        {
+            "y": centroids[:, 1],
+            "x": centroids[:, 0],
+            "mass": area * 255,
+            "area": area,
+            "bbox_x": stats[:, cv2.CC_STAT_LEFT],
+            "bbox_y": stats[:, cv2.CC_STAT_TOP],
+            "bbox_w": stats[:, cv2.CC_STAT_WIDTH],
+            "bbox_h": stats[:, cv2.CC_STAT_HEIGHT],
+            "orientation": orientation,
+            "ecc": ecc,
+            "frame": frame_num,
+        }
+    )
+
+
+def connected_component_batch(frames, processes="auto"):
+    """
+    A faster alternative to tp.batch for thresholded (binary) videos.
+    Since the thresholded frames are already just objects and background, there isn't any need for
+    trackpy's gaussian refinement, so every object is found with cv2.connectedComponentsWithStats.
+    The frames are split between threads (opencv lets go of the GIL, so threads work fine here and
+    the frames don't need to be copied to other processes), and the output works with tp.link_df.
+    """
+    if processes == "auto":
+        processes = os.cpu_count()
+
+    with ThreadPoolExecutor(max_workers=processes) as pool:
+        frame_dfs = list(
+            pool.map(locate_frame_components, frames, range(0, len(frames)))
+        )
+
+    return pd.concat(frame_dfs, ignore_index=True)
+
+
+def binned_settings(settings):
+    """
+    Returns the settings to track binned movies with (see bin_frames in phil_io.py), with everything measured in
+    pixels converted to the binned pixels, so the settings are always entered for the camera's own pixels and
+    speeds still come out in µm/s. Without binning, the settings are returned as they are.
+    """
+    binning = settings["binning"]
+    if binning == 1:
+        return settings
+
+    settings = dict(settings)
+    settings["pixel_size"] = settings["pixel_size"] * binning
+    settings["search_range"] = settings["search_range"] / binning
+
+    # TrackPy needs an odd whole number for the object size
+    object_area = max(3, round(settings["object_area"] / binning))
+    settings["object_area"] = object_area + 1 if object_area % 2 == 0 else object_area
+
+    # The size filters are lengths, and the mass filters go with the area of the objects
+    for setting, scale in (
+        ("min_size", binning),
+        ("max_size", binning),
+        ("min_mass", binning**2),
+        ("max_mass", binning**2),
+    ):
+        if settings[setting] is not None:
+            settings[setting] = settings[setting] / scale
+
+    return settings
+
+
+def locate_objects(frames, settings, processes="auto"):
+    # Picks the detection engine chosen in the settings ("trackpy" is the original way Phil found objects)
+    if settings["detect_engine"] == "connected_components":
+        return connected_component_batch(frames, processes)
+
+    # tracking the objects & collecting obj information like position, size, brightness, ect.
+    if processes == 1:
+        return tp.batch(
+            frames[:],
+            settings["object_area"],
+            invert=True,
+            engine="numba",
+            processes=1,
+        )
+
+    # Otherwise the frames are split into chunks for the shared locate pool (see phil_numba.py), which
+    # stays open for the whole run, rather than tp.batch starting (and compiling in) a new pool every movie
+    if processes == "auto":
+        processes = os.cpu_count()
+
+    pool = get_locate_pool(processes, settings)
+    chunk_size = max(1, ceil(len(frames) / (processes * 4)))
+
+    # Keeping the copies sent to the pool inside the memory budget (see plan_tracking in phil_memory.py)
+    if settings.get("locate_chunk_frames") is not None:
+        chunk_size = min(chunk_size, settings["locate_chunk_frames"])
+
+    futures = [
+        pool.submit(
+            locate_frame_chunk,
+            frame_chunk(frames, first_frame, first_frame + chunk_size),
+            first_frame,
+            settings["object_area"],
+        )
+        for first_frame in range(0, len(frames), chunk_size)
+    ]
+    chunk_dfs = [future.result() for future in futures]
+
+    # Same as tp.batch, frames without any objects are left out
+    found_dfs = [chunk_df for chunk_df in chunk_dfs if len(chunk_df) > 0]
+    if len(found_dfs) == 0:
+        return chunk_dfs[0]
+
+    return pd.concat(found_dfs, ignore_index=True)
+
+
+def load_thresholded_movie(filepath, is_avi, settings):
+    # Reads a thresholded movie for tracking, unless it's too big for the memory budget (None, see locate_movie)
+    if filepath in settings.get("stream_frames", {}):
+        return None
+
+    return read_thresholded_movie(filepath, is_avi)
+
+
+def locate_movie(filepath, frames, is_avi, settings, processes="auto"):
+    """
+    Finds the objects in a thresholded movie (frames, from load_thresholded_movie)
+    Movies too big for the memory budget are read and located a chunk of frames at a time, so only the
+    objects found are kept (see plan_tracking in phil_memory.py)
+    Returns the located objects, the # of frames, and the first frame (for the path images)
+    """
+    stream_frames = settings.get("stream_frames", {})
+    if filepath not in stream_frames:
+        f = locate_objects(frames, settings, processes)
+        return f, len(frames), np.array(frames[0])
+
+    chunk_dfs = []
+    num_frames = 0
+    first_image = None
+
+    for chunk in read_thresholded_chunks(filepath, is_avi, stream_frames[filepath]):
+        if first_image is None:
+            first_image = np.array(chunk[0])
+
+        chunk_df = locate_objects(chunk, settings, processes)
+        chunk_df["frame"] += num_frames
+        chunk_dfs.append(chunk_df)
+        num_frames += len(chunk)
+
+    # Same as tp.batch, frames without any objects are left out
+    found_dfs = [chunk_df for chunk_df in chunk_dfs if len(chunk_df) > 0]
+    if len(found_dfs) == 0:
+        return chunk_dfs[0], num_frames, first_image
+
+    return pd.concat(found_dfs, ignore_index=True), num_frames, first_image
+
+
+# The pre-link filters, as (setting name, feature column, whether the setting is a minimum or a maximum)
+# A setting of None (null in Phil-Settings.json) turns that filter off, which is the default for all of them
+FEATURE_FILTERS = [
+    ("min_mass", "mass", "min"),
+    ("max_mass", "mass", "max"),
+    ("min_size", "size", "min"),
+    ("max_size", "size", "max"),
+    ("max_ecc", "ecc", "max"),
+    ("min_signal", "signal", "min"),
+]
+
+
+def filter_features(f, settings):
+    """
+    Removes located objects that are outside the feature filters in the settings (debris, tiny bits of noise,
+    clumps of filaments...), before they're linked, so the linking has fewer objects to work through
+    Returns the kept objects, and a dictionary of how many objects each filter removed
+    """
+    keep = np.ones(len(f), dtype=bool)
+    removed = {}
+
+    for setting, column, kind in FEATURE_FILTERS:
+        # Filters on columns the detection engine doesn't make (e.g. "size" for connected components) are skipped
+        if settings[setting] is None or column not in f.columns:
+            continue
+
+        if kind == "min":
+            passed = f[column].to_numpy() >= settings[setting]
+        else:
+            passed = f[column].to_numpy() <= settings[setting]
+
+        removed[setting] = int(np.count_nonzero(keep & ~passed))
+        keep &= passed
+
+    if len(removed) == 0:
+        return f, removed
+
+    return f[keep], removed
+
+
+# The only feature columns used by the analysis (everything else is only saved with the full object data)
+ANALYSIS_COLUMNS = ["y", "x", "mass", "frame"]
+
+
+def compact_features(f, settings):
+    """
+    Shrinks the located objects before linking, which roughly halves (or better) the memory used by the
+    feature and track tables, and makes the sorting and grouping faster:
+        * only the columns the analysis uses are kept, unless the full object data is being saved
+        * with "compact_tables" in the settings, positions and masses are stored as float32 and frames as int32
+          (this changes the last few digits of the outputs, so it's off by default)
+    """
+    if not settings["full_obj_data"]:
+        f = f[ANALYSIS_COLUMNS]
+
+    if settings["compact_tables"]:
+        f = f.astype(
+            {
+                column: np.float32 if f[column].dtype.kind == "f" else np.int32
+                for column in f.columns
+                if f[column].dtype.kind in "fi"
+            }
+        )
+
+    return f
+
+
+def filter_short_tracks(linked_obj, min_track_length):
+    # Same idea as trackpy's filter_stubs, removes tracks found in fewer than min_track_length frames
+    # Tracks of a single frame have no speed, so they're always removed (like before)
+    min_track_length = max(min_track_length, 2)
+
+    track_lengths = linked_obj.groupby("particle")["frame"].transform("size")
+    keep = (track_lengths >= min_track_length).to_numpy()
+
+    tracks_removed = linked_obj.loc[~keep, "particle"].nunique()
+    return linked_obj[keep], tracks_removed
+
+
+def analyzed_tracks(linked_obj, min_track_length):
+    """
+    Returns the tracks of a linked movie (sorted by particle and frame) that are analyzed and saved, and the # of
+    short tracks removed (see filter_short_tracks)
+    The analysis has always stopped before the last particle #, which is found before any tracks are removed,
+    so the same particles are analyzed as before
+    """
+    total_objs = linked_obj["particle"].iloc[-1]
+
+    tracks, tracks_removed = filter_short_tracks(linked_obj, min_track_length)
+    return tracks[tracks["particle"] < total_objs], tracks_removed
+
+
+def track_table(tracks, file_num, settings):
+    """
+    Returns the condition CSV rows for one movie's tracks (from analyzed_tracks): the size, first position,
+    speeds and displacement of every track, and its speed in every frame (see the examples below)
+    Summary.csv is worked out from these rows too (see update_speed_stats in phil_output.py)
+    """
+    displacement_df = pd.DataFrame()
+    obj_size_list = []
+
+    # This next section is getting the speed and positional data about the objects
+    # The data is formatted as follows (example data):
+    #
+    # 1st X | 1st Y | First Frame | Displacement |{reciprocal_fps} * 1 | {reciprocal_fps} * 2 | {reciprocal_fps} * 3 | ect..
+    # ---------------------------------------------------------------------------------------------------------
+    #  150  |  150  |      0      |     18.6     |These sections are the instantaneous speed of the object at each frame
+    #  200  |  200  |      0      |     8.2      |  1.2 (Microns/sec)  |          2.3         |            0.5       |
+    #  168  |  15   |      2      |     1.55     |         0.3         |          0.8         |            1.2       |
+
+    # dd_values stands for desired_displacement values
+    dd_values = tracks[["particle", "frame", "x", "y"]]
+    reciprocol_fps = 1 / settings["fps"]
+
+    # The workflow for this loop is to take the data for each (kept) particle as a new dataframe, then
+    # find the initial object coordinates & first frame (so you can go back and locate the object).
+    #
+    # Then for each frame, the object positions and frame numbers are used to find the change in distance
+    # from frame to frame. This is converted to an instantaneous velocity by multiplying by
+    # the pixel size and dividing by the reciprocol fps, and this number is appended to the list.
+
+    for particle, pythag_df in dd_values.groupby("particle"):
+        first_x = pythag_df["x"].iloc[0]
+        first_y = pythag_df["y"].iloc[0]
+        first_frame = pythag_df["frame"].iloc[0]
+        particle_num = pythag_df["particle"].iloc[0]
+        last_x = pythag_df["x"].iloc[-1]
+        last_y = pythag_df["y"].iloc[-1]
+
+        # In plain english, this is pythagorean theorem, (a^2 + b^2) = c^2,
+        # where a and b are the x and y distances travelled between frame n and frame n+1
+
+        displacement = (
+            sqrt(((first_x - last_x) ** 2) + (first_y - last_y) ** 2)
+            * settings["pixel_size"]
+        )
+        output_list = [
+            particle_num,
+            first_x,
+            first_y,
+            first_frame,
+            displacement,
+        ]
+
+        for frame in range(1, len(pythag_df)):
+            Xn = pythag_df["x"].iloc[frame - 1]
+            Yn = pythag_df["y"].iloc[frame - 1]
+            Frame_n = pythag_df["frame"].iloc[frame - 1]
+
+            Xn1 = pythag_df["x"].iloc[frame]
+            Yn1 = pythag_df["y"].iloc[frame]
+            Frame_n1 = pythag_df["frame"].iloc[frame]
+
+            frame_diff = Frame_n1 - Frame_n
+
+            displacement = sqrt(((Xn - Xn1) ** 2) + (Yn - Yn1) ** 2)
+            displacement = (displacement * settings["pixel_size"]) / (
+                reciprocol_fps * frame_diff
+            )
+
+            output_list.append(displacement)
+
+        output_list_df = pd.DataFrame(output_list)
+        displacement_df = pd.concat([displacement_df, output_list_df], axis=1)
+
+    # By using the dictionary retuned in column_naming() this line renames the rows of the data frame
+    # which is then transposed and set as the column names
+    displacement_df = displacement_df.rename(
+        index=column_naming(len(displacement_df), settings["fps"])
+    )
+
+    displacement_df = displacement_df.transpose()
+
+    # when avg_speed_lamba is called, it inserts a column, so the speeds are shifted one to the right
+    # this is why the row slicing points increase by 1
+    avg_speed_lambda = lambda row: np.nanmean(row[6:])
+    std_speed_lambda = lambda row: np.nanstd(row[7:])
+    path_length_lambda = lambda row: np.sum(row[8:] * reciprocol_fps)
+
+    displacement_df.insert(
+        0,
+        "File",
+        file_num,
+        allow_duplicates=True,
+    )
+
+    displacement_df.insert(
+        5,
+        "Avg Speed",
+        displacement_df.apply(avg_speed_lambda, axis=1),
+    )
+
+    displacement_df.insert(
+        6,
+        "Speed Std",
+        displacement_df.apply(std_speed_lambda, axis=1),
+    )
+
+    displacement_df.insert(
+        7, "Path Length", displacement_df.apply(path_length_lambda, axis=1)
+    )
+
+    displacement_df = displacement_df.reset_index(drop=True)
+
+    # This section is finding the # of pixels that are in each of the object (object size)
+    # (single frame objects were already removed, since you cant take a std from one data point)
+    desired_values = tracks[["frame", "particle", "mass"]]
+
+    # This is how the obj_size DataFrame is formatted for the size of objects and file information
+    # Average Obj Size | Std of Obj Size | File | Particle |
+    # ----------------------------------------------------------
+    #       14.86      |       7.38      |   1  |     0    |
+    #       33.33      |       9.24      |   1  |     1    |
+    #       55.06      |       5.18      |   1  |     2    |
+    #       ect...     |       ect...    |ect...|   ect... |
+
+    # Loop to calculate mean and std for the particle size * brightness,
+    # which is converted into pixels by particle size/255
+    for object, mass_df in desired_values.groupby("particle"):
+        avg_mass = (mass_df["mass"].mean()) / 255
+        mass_std = (mass_df["mass"].std()) / 255
+
+        # Adding the mean and stdev of the object size to list
+        size_list = [avg_mass.round(2), mass_std.round(2)]
+        obj_size_list.append(size_list)
+
+    obj_size_df = pd.DataFrame(obj_size_list, columns=["Avg_Obj_Size", "Std_Obj_Size"])
+
+    # This is joining the two dataframes together, for the final/ output DataFrame
+    output_df = obj_size_df.join(displacement_df)
+
+    # What's happening in the .join() line:
+    # Average Obj Size | Std of Obj Size |  +  | File | Particle | 1st X | 1st Y | First Frame |  Avg Speed   | Speed Std | Displacement |{reciprocal_fps} * 1 | {reciprocal_fps} * 2 | {reciprocal_fps} * 3 |
+    # -----------------------------------|  +  |-----------------------------------------------------------------------------------------------------------------------------------------------------------------
+    #       14.86      |       7.38      |  +  |   1  |     0    |  150  |  150  |      0      |      2.5     |   3.342   |     18.6     |These sections are the instantaneous speed of the object at each frame
+    #       33.33      |       9.24      |  +  |   1  |     1    |  200  |  200  |      0      |      6.1     |   0.069   |     8.2      |  1.2 (Microns/sec)  |          2.3         |            0.5       |
+    #       55.06      |       5.18      |  +  |   1  |     2    |  168  |  15   |      2      |      0.5     |   0.420   |     1.55     |         0.3         |          0.8         |            1.2       |
+    #       ect...     |       ect...    |  +  |ect...|   ect... | ect...| ect...|    ect...   |     ect...   |   ect...  |    ect...    |       ect...        |         ect...       |           ect...     |
+
+    return output_df
+
+
+def locate_frame_chunk(frames_chunk, first_frame, object_area):
+    # Runs in the locate pool workers, the frame numbers are shifted so they count from the start of the movie
+    frames_chunk = load_frame_chunk(frames_chunk)
+    f = tp.batch(frames_chunk, object_area, invert=True, engine="numba", processes=1)
+    f["frame"] += first_frame
+    return f
+
+
 # Apologies if this is overdocumentation
 """
 tracking_data_analysis
 Inputs:
-split_list -> nested lists containing the filepaths for preprocessed .tif image sequences
-progress -> int used for progress bar window
-root -> tk root of progress bar window
+grouping_index -> dictionary of condition -> list of (file number, filepath) for preprocessed .tif/.avi image sequences
+                  (see build_grouping_index in phil_groups.py)
+progress_queue -> queue for progress messages to the progress bar window (see phil_progress.py), or None
 settings -> dict containing the user defined parameters, such as search radius and tracking memory
-name_indices -> tuple containing the negative indices of the file number, to keep track of which video the analyzed data came from
 
             Workflow
 --------------------------------
-1. for (loop) number of conditions
+1. for (loop) conditions in the grouping index (track_condition, several at once if group_workers > 1)
 
-    a. create/clear dataframes which will contain all the positional data
+    a. start the condition output files
 
     b. for (loop) file in condition
-        * increase progress bar by 1 (since it starts at 0)
-        * separate filename and filenumber
+        * send the current movie to the progress bar
         * read .avi/.tif files (is_avi = True/False respectively) 
 
-        * trackpy batch track and link objects
-        * sort datapoints by particle and frame
+        * locate objects (trackpy batch or connected components)
+        * remove objects outside the feature filters, then link them
+        * sort datapoints by particle and frame, and remove tracks shorter than min_track_length
         * separate out unwanted data (only frame, x, y, and particle #)
 
         * for (loop) objects in tracked file
@@ -77,17 +567,37 @@ name_indices -> tuple containing the negative indices of the file number, to kee
             - calculate avg and std of object size
 
         * join object size and condition file together
-        * add to output dataframe with all the other data in that condition
-    
-    c. save .CSV file with data from all files in the condition 
+        * append the rows to the condition file on disk (and keep running totals for the summary)
+        * send the # of files/frames done to the progress bar
+
+    c. finish the .CSV file with data from all files in the condition 
     
 
 """
 
 
-def tracking_data_analysis(
-    split_list, progress, root, settings, name_indices, is_avi, path_img_dir
+def track_condition(
+    proper_name,
+    condition_files,
+    settings,
+    is_avi,
+    path_img_dir,
+    progress_queue=None,
+    processes="auto",
+    output_name=None,
 ):
+    """
+    track_condition tracks, analyzes and saves every movie of one condition (one group of the grouping index)
+    Inputs:
+    proper_name -> name of the condition, used for the output file names
+    condition_files -> list of (file number, filepath) for the condition's thresholded movies
+    progress_queue -> optional queue that progress messages are sent to (for the progress bar)
+    processes -> number of processes used to locate objects ("auto" uses all of them)
+    output_name -> name (or path) for the output files, if it should be something other than proper_name
+
+    Returns the running totals for the condition's Summary.csv row (see new_speed_stats), a string of any
+    caught exceptions, and a Counter of how many objects/tracks the filters removed
+    """
     # Forcing matplotlib to use "Agg" instead of Tk for the path creation
     # Otherwise this raises a RuntimeError
     if settings["paths"]:
@@ -101,6 +611,7 @@ def tracking_data_analysis(
         # import matplotlib.pyplot as plt
 
     caught_exceptions = ""
+    filter_counts = Counter()
 
     # This is for changing the superimposed image
     """
@@ -109,270 +620,234 @@ def tracking_data_analysis(
     )
     """
 
-    # To make the analysis easier, this file will give a quick glimpse, ie. condition A is faster than condition B
-    summary_file = {
-        "Condition": [],
-        "# of Files": [],
-        "Average Speed": [],
-        "Speed SEM": [],
-        "Total # of Objects": [],
-    }
-
-    # Tracking the objects & saving to csv file (does i .tif/avi videos at a time, specified by sheet_size)
-    for j in range(0, len(split_list)):
-        # Defining Variables / Clearing Dataframes
-        full_obj_df = pd.DataFrame()
-        final_df = pd.DataFrame()
+    # Each movie's rows are written to the condition files as soon as the movie is done (see phil_output.py)
+    condition_output = start_condition_output(
+        output_name or proper_name, settings["full_obj_data"]
+    )
+    speed_stats = new_speed_stats()
+
+    # The optional motility analytics are added up a movie at a time too (see phil_analytics.py)
+    if settings["analytics"]:
+        analytics = start_condition_analytics()
+
+    # Each movie's drift trajectory, when drift correction is on (see phil_drift.py)
+    movie_drifts = {}
+
+    # The next movies are read in a background thread while this one is tracked, and the rows are
+    # saved in another thread (see phil_io.py)
+    writer = start_writer(settings["prefetch_depth"])
+    movies = prefetch(
+        condition_files,
+        lambda condition_file: load_thresholded_movie(
+            condition_file[1], is_avi, settings
+        ),
+        settings["prefetch_depth"],
+    )
 
-        for i in range(0, len(split_list[j])):
-            displacement_df = pd.DataFrame()
+    for (file_num, file_path), movie in movies:
+        # Specifing which movie the data came from (the file number comes from the grouping index)
+        filename = os.path.basename(file_path)
+        report(progress_queue, stage=f"Tracking {filename}")
+
+        # .avi frames are converted to grayscale while reading (read_thresholded_movie)
+        frames = movie.result()
+
+        # Finding the objects in every frame (trackpy or connected components, see locate_objects)
+        f, num_frames, first_image = locate_movie(
+            file_path, frames, is_avi, settings, processes
+        )
+        # Only the first frame is kept after locating (a copy of it), so the movie can leave memory
+        del frames
+
+        # Removing objects outside the feature filters (off by default), so they're never linked
+        f, objects_removed = filter_features(f, settings)
+        filter_counts.update(objects_removed)
+        f = compact_features(f, settings)
+
+        # Linking the objects / tracking their paths
+        try:
+            linked_obj = tp.link_df(
+                f, settings["search_range"], memory=settings["trk_memory"]
+            )
+        except Exception as e:
+            caught_exceptions += f"{proper_name}{file_num} was skipped due to:\n{e}\n"
+            report(progress_queue, files=1, frames=num_frames)
+            continue
+
+        # Sorting in place, so the unsorted and sorted tables aren't both in memory
+        linked_obj.sort_values(by=["particle", "frame"], inplace=True)
+        if settings["compact_tables"]:
+            linked_obj["particle"] = linked_obj["particle"].astype(np.int32)
+
+        # Removing the stage drift (off by default) from the positions, before they're used for anything
+        if settings["drift_correction"] is not None:
+            movie_drifts[file_num] = correct_drift(
+                linked_obj, settings["drift_correction"], num_frames
+            )
 
-            progress.set(progress.get() + 1)
-            root.update()
+        # Removing the short tracks all at once, so the loops in track_table only go through the tracks that are kept
+        tracks, tracks_removed = analyzed_tracks(
+            linked_obj, settings["min_track_length"]
+        )
+        filter_counts["short_tracks"] += tracks_removed
+
+        if settings["analytics"]:
+            add_movie_analytics(analytics, file_num, tracks, settings)
+
+        if settings["paths"] == True:
+            # Creating Path images for files!
+            fig, ax = subplots()
+            paths_fig = tp.plot_traj(linked_obj, ax=ax, superimpose=first_image)
+            # This line below is how kwargs are passed to plt.plot, so you can change the line thicknesses
+            # plot_style={"linewidth": 0.50, "color": "red"})
+
+            # Saving to Path folder
+            path_name = os.path.join(
+                path_img_dir, f"{os.path.splitext(filename)[0]}.png"
+            )
 
-            # Specifing which movie the data came from
-            filename = os.path.basename(split_list[j][i])
-            file_num = int(filename[name_indices[0] : name_indices[1]])
+            # Options/ ways to save the figures without the axes
+            # plt.axis("off")
+            # savefig(path_name, bbox_inches="tight", pad_inches=0, dpi=150)
 
-            obj_size_list = []
+            savefig(path_name, dpi=150)
 
-            if is_avi == True:
-                frames = PyAVVideoReader(split_list[j][i])
+            # Make sure to empty memory after saving plots
+            close()
 
-                avi_array = []
-                for x in range(0, len(frames)):
-                    avi_array.append(cv2.cvtColor(frames[x], cv2.COLOR_BGR2GRAY))
-                frames = avi_array
+        # Full object data option where all variables are saved (object x and y for each frame & object, lots of data!)
+        if settings["full_obj_data"] == True:
+            df2 = linked_obj
+            df2.insert(0, "File", file_num, allow_duplicates=True)
+            submit_write(writer, append_full_obj_rows, condition_output, df2)
 
-            else:
-                frames = tif.imread(split_list[j][i])
+        # The speed, position and size of every kept track, as the rows of the condition CSV
+        output_df = track_table(tracks, file_num, settings)
 
-            # tracking the objects & collecting obj information like position, size, brightness, ect.
-            f = tp.batch(
-                frames[:],
-                settings["object_area"],
-                invert=True,
-                engine="numba",
-                processes="auto",
-            )
+        submit_write(writer, append_condition_rows, condition_output, output_df)
+        update_speed_stats(speed_stats, output_df)
 
-            # Linking the objects / tracking their paths
-            try:
-                linked_obj = tp.link_df(
-                    f, settings["search_range"], memory=settings["trk_memory"]
-                )
-            except Exception as e:
-                caught_exceptions += f"{filename[7 : name_indices[0]]}{file_num} was skipped due to:\n{e}\n"
-                continue
-
-            linked_obj = linked_obj.sort_values(by=["particle", "frame"])
-
-            if settings["paths"] == True:
-                # Creating Path images for files!
-                fig, ax = subplots()
-                paths_fig = tp.plot_traj(linked_obj, ax=ax, superimpose=frames[0])
-                # This line below is how kwargs are passed to plt.plot, so you can change the line thicknesses
-                # plot_style={"linewidth": 0.50, "color": "red"})
-
-                # Saving to Path folder
-                path_name = os.path.join(
-                    path_img_dir, f"{filename[:name_indices[1]]}.png"
-                )
-
-                # Options/ ways to save the figures without the axes
-                # plt.axis("off")
-                # savefig(path_name, bbox_inches="tight", pad_inches=0, dpi=150)
-
-                savefig(path_name, dpi=150)
-
-                # Make sure to empty memory after saving plots
-                close()
-
-            # This next section is getting the speed and positional data about the objects
-            # The data is formatted as follows (example data):
-            #
-            # 1st X | 1st Y | First Frame | Displacement |{reciprocal_fps} * 1 | {reciprocal_fps} * 2 | {reciprocal_fps} * 3 | ect..
-            # ---------------------------------------------------------------------------------------------------------
-            #  150  |  150  |      0      |     18.6     |These sections are the instantaneous speed of the object at each frame
-            #  200  |  200  |      0      |     8.2      |  1.2 (Microns/sec)  |          2.3         |            0.5       |
-            #  168  |  15   |      2      |     1.55     |         0.3         |          0.8         |            1.2       |
-
-            # dd_values stands for desired_displacement values
-            dd_values = linked_obj[["particle", "frame", "x", "y"]]
-            total_objs = dd_values["particle"].iloc[-1]
-            reciprocol_fps = 1 / settings["fps"]
-
-            # The workflow for this loop is to separate the data for each particle into a new dataframe, then
-            # find the initial object coordinates & first frame (so you can go back and locate the object).
-            #
-            # Then for each frame, the object positions and frame numbers are used to find the change in distance
-            # from frame to frame. This is converted to an instantaneous velocity by multiplying by
-            # the pixel size and dividing by the reciprocol fps, and this number is appended to the list.
-
-            for particle in range(0, total_objs):
-                pythag_df = dd_values[dd_values["particle"] == particle]
-
-                if len(pythag_df) > 1:
-                    first_x = pythag_df["x"].iloc[0]
-                    first_y = pythag_df["y"].iloc[0]
-                    first_frame = pythag_df["frame"].iloc[0]
-                    particle_num = pythag_df["particle"].iloc[0]
-                    last_x = pythag_df["x"].iloc[-1]
-                    last_y = pythag_df["y"].iloc[-1]
-
-                    # In plain english, this is pythagorean theorem, (a^2 + b^2) = c^2,
-                    # where a and b are the x and y distances travelled between frame n and frame n+1
-
-                    displacement = (
-                        sqrt(((first_x - last_x) ** 2) + (first_y - last_y) ** 2)
-                        * settings["pixel_size"]
-                    )
-                    output_list = [
-                        particle_num,
-                        first_x,
-                        first_y,
-                        first_frame,
-                        displacement,
-                    ]
-
-                    for frame in range(1, len(pythag_df)):
-                        Xn = pythag_df["x"].iloc[frame - 1]
-                        Yn = pythag_df["y"].iloc[frame - 1]
-                        Frame_n = pythag_df["frame"].iloc[frame - 1]
-
-                        Xn1 = pythag_df["x"].iloc[frame]
-                        Yn1 = pythag_df["y"].iloc[frame]
-                        Frame_n1 = pythag_df["frame"].iloc[frame]
-
-                        frame_diff = Frame_n1 - Frame_n
-
-                        displacement = sqrt(((Xn - Xn1) ** 2) + (Yn - Yn1) ** 2)
-                        displacement = (displacement * settings["pixel_size"]) / (
-                            reciprocol_fps * frame_diff
-                        )
-
-                        output_list.append(displacement)
-
-                    output_list_df = pd.DataFrame(output_list)
-                    displacement_df = pd.concat(
-                        [displacement_df, output_list_df], axis=1
-                    )
-
-                # This removes particles only detected for a single frame
-                else:
-                    pass
-
-            # By using the dictionary retuned in column_naming() this line renames the rows of the data frame
-            # which is then transposed and set as the column names
-            displacement_df = displacement_df.rename(
-                index=column_naming(len(displacement_df), settings["fps"])
-            )
+        report(progress_queue, files=1, frames=num_frames)
 
-            displacement_df = displacement_df.transpose()
+    # With all the movies written, the header is added and the condition file is finished
+    finish_writer(writer)
+    finish_condition_output(condition_output)
 
-            # when avg_speed_lamba is called, it inserts a column, so the speeds are shifted one to the right
-            # this is why the row slicing points increase by 1
-            avg_speed_lambda = lambda row: np.nanmean(row[6:])
-            std_speed_lambda = lambda row: np.nanstd(row[7:])
-            path_length_lambda = lambda row: np.sum(row[8:] * reciprocol_fps)
+    if settings["analytics"]:
+        write_condition_analytics(output_name or proper_name, analytics, settings)
 
-            displacement_df.insert(
-                0,
-                "File",
-                file_num,
-                allow_duplicates=True,
-            )
+    if settings["drift_correction"] is not None:
+        write_condition_drift(output_name or proper_name, movie_drifts)
 
-            displacement_df.insert(
-                5,
-                "Avg Speed",
-                displacement_df.apply(avg_speed_lambda, axis=1),
-            )
+    # The summary statistics come from the running totals kept for each movie
+    return speed_stats, caught_exceptions, filter_counts
 
-            displacement_df.insert(
-                6,
-                "Speed Std",
-                displacement_df.apply(std_speed_lambda, axis=1),
-            )
 
-            displacement_df.insert(
-                7, "Path Length", displacement_df.apply(path_length_lambda, axis=1)
-            )
+def track_condition_worker(
+    proper_name, condition_files, settings, is_avi, path_img_dir, worker_queue
+):
+    # Used when conditions are tracked in parallel. Each worker process locates objects with a single process
+    # (otherwise every worker would start its own pool)
+    return track_condition(
+        proper_name,
+        condition_files,
+        settings,
+        is_avi,
+        path_img_dir,
+        worker_queue,
+        processes=1,
+    )
 
-            displacement_df = displacement_df.reset_index(drop=True)
-
-            # Full object data option where all variables are saved (object x and y for each frame & object, lots of data!)
-            if settings["full_obj_data"] == True:
-                df2 = linked_obj
-                df2.insert(0, "File", file_num, allow_duplicates=True)
-                full_obj_df = pd.concat([full_obj_df, df2])
-
-            # This section is finding the # of pixels that are in each of the object (object size)
-            desired_values = linked_obj[["frame", "particle", "mass"]]
-            total_objs = desired_values["particle"].iloc[-1]
-
-            # This is how the obj_size DataFrame is formatted for the size of objects and file information
-            # Average Obj Size | Std of Obj Size | File | Particle |
-            # ----------------------------------------------------------
-            #       14.86      |       7.38      |   1  |     0    |
-            #       33.33      |       9.24      |   1  |     1    |
-            #       55.06      |       5.18      |   1  |     2    |
-            #       ect...     |       ect...    |ect...|   ect... |
-
-            # Loop to calculate mean and std for the particle size * brightness,
-            # which is converted into pixels by particle size/255
-            for object in range(0, int(total_objs)):
-                mass_df = desired_values[desired_values["particle"] == object]
-
-                # If just one data point is available, obj is skipped, since you cant take a std from one data point
-                if len(mass_df) > 1:
-                    avg_mass = (mass_df["mass"].mean()) / 255
-                    mass_std = (mass_df["mass"].std()) / 255
-
-                    # Adding the mean and stdev of the object size to list
-                    size_list = [avg_mass.round(2), mass_std.round(2)]
-                    obj_size_list.append(size_list)
-
-                else:
-                    pass
-
-            obj_size_df = pd.DataFrame(
-                obj_size_list, columns=["Avg_Obj_Size", "Std_Obj_Size"]
-            )
 
-            # This is joining the two dataframes together, for the final/ output DataFrame
-            output_df = obj_size_df.join(displacement_df)
+def forward_progress(worker_queue, progress_queue):
+    # Passes the messages from the worker processes on to the progress bar window
+    while True:
+        try:
+            message = worker_queue.get_nowait()
+        except queue.Empty:
+            return
+        report(progress_queue, **message)
 
-            # What's happening in the .join() line:
-            # Average Obj Size | Std of Obj Size |  +  | File | Particle | 1st X | 1st Y | First Frame |  Avg Speed   | Speed Std | Displacement |{reciprocal_fps} * 1 | {reciprocal_fps} * 2 | {reciprocal_fps} * 3 |
-            # -----------------------------------|  +  |-----------------------------------------------------------------------------------------------------------------------------------------------------------------
-            #       14.86      |       7.38      |  +  |   1  |     0    |  150  |  150  |      0      |      2.5     |   3.342   |     18.6     |These sections are the instantaneous speed of the object at each frame
-            #       33.33      |       9.24      |  +  |   1  |     1    |  200  |  200  |      0      |      6.1     |   0.069   |     8.2      |  1.2 (Microns/sec)  |          2.3         |            0.5       |
-            #       55.06      |       5.18      |  +  |   1  |     2    |  168  |  15   |      2      |      0.5     |   0.420   |     1.55     |         0.3         |          0.8         |            1.2       |
-            #       ect...     |       ect...    |  +  |ect...|   ect... | ect...| ect...|    ect...   |     ect...   |   ect...  |    ect...    |       ect...        |         ect...       |           ect...     |
 
-            final_df = pd.concat([final_df, output_df])
+def tracking_data_analysis(
+    grouping_index, progress_queue, settings, is_avi, path_img_dir
+):
+    caught_exceptions = ""
+    filter_counts = Counter()
+    results = {}
 
-        # Put in calculations for average speeds (for files as well as conditions, maybe summary file) #todo
-        filename = os.path.basename(split_list[j][0])
-        proper_name = filename[7 : name_indices[0]]
+    # Binned movies are tracked with the pixel measurements rescaled to the binned pixels, and the run is
+    # fitted into the memory budget (see phil_memory.py)
+    settings = plan_tracking(
+        grouping_index, is_avi, binned_settings(settings), memory_budget(settings)
+    )
 
-        # With the final DF finished, calculations for summary files start
-        file_speeds = np.array(final_df.iloc[:, 8:])
+    # Getting trackpy's numba kernels ready (loaded from the disk cache after the first run, see phil_numba.py)
+    cache_dir = NUMBA_CACHE_DIR if settings["numba_cache"] else None
+    if cache_dir is not None:
+        enable_kernel_cache(cache_dir)
+    warm_up_kernels(settings["object_area"])
+
+    # Tracking the objects & saving to csv file, one condition (group of the grouping index) at a time,
+    # or several conditions at once if "group_workers" is more than 1 in the settings
+    if settings["group_workers"] > 1 and len(grouping_index) > 1:
+        # The worker processes can't use the progress bar's queue, so they send their messages through a
+        # queue that can be shared between processes, and they're passed along here
+        with Manager() as manager, ProcessPoolExecutor(
+            max_workers=settings["group_workers"],
+            initializer=prepare_worker,
+            initargs=(settings["object_area"], cache_dir),
+        ) as pool:
+            worker_queue = manager.Queue()
+            futures = {
+                pool.submit(
+                    track_condition_worker,
+                    proper_name,
+                    condition_files,
+                    settings,
+                    is_avi,
+                    path_img_dir,
+                    worker_queue,
+                ): proper_name
+                for proper_name, condition_files in grouping_index.items()
+            }
+
+            pending = set(futures)
+            while len(pending) > 0:
+                done, pending = wait(pending, timeout=0.2)
+                forward_progress(worker_queue, progress_queue)
+
+                for future in done:
+                    results[futures[future]] = future.result()
+
+            forward_progress(worker_queue, progress_queue)
+
+    else:
+        for proper_name, condition_files in grouping_index.items():
+            results[proper_name] = track_condition(
+                proper_name,
+                condition_files,
+                settings,
+                is_avi,
+                path_img_dir,
+                progress_queue,
+            )
 
-        summary_file["Condition"].append(proper_name)
-        summary_file["# of Files"].append(i + 1)
-        summary_file["Average Speed"].append(np.nanmean(file_speeds))
-        summary_file["Speed SEM"].append(np.nanstd(file_speeds) / sqrt(len(final_df)))
-        summary_file["Total # of Objects"].append(len(final_df))
+        shutdown_locate_pool()
 
-        final_df.to_csv(f"{proper_name}.csv", index=0)
+    # Keeping the summary in the same (sorted) order as the grouping index, no matter which condition finished first
+    summary_rows = []
+    for proper_name in grouping_index:
+        speed_stats, condition_exceptions, condition_filter_counts = results[
+            proper_name
+        ]
+        caught_exceptions += condition_exceptions
+        filter_counts.update(condition_filter_counts)
 
-        # Full object data option
-        if settings["full_obj_data"] == True:
-            full_obj_df.to_csv(f"{proper_name}-Full Object Data.csv")
+        summary_rows.append(
+            summary_row(proper_name, len(grouping_index[proper_name]), speed_stats)
+        )
 
-    summary_df = pd.DataFrame.from_dict(summary_file)
-    summary_df.to_csv("Summary.csv", index=0)
+    write_summary(summary_rows)
 
-    return caught_exceptions
+    return caught_exceptions, dict(filter_counts)
@@ -0,0 +1,267 @@
+import json
+import os
+import os.path
+import time
+from datetime import datetime
+
+import trackpy as tp
+
+from phil_groups import naming_pattern, parse_filename
+from phil_index import index_run
+from phil_numba import (
+    NUMBA_CACHE_DIR,
+    enable_kernel_cache,
+    warm_up_kernels,
+    shutdown_locate_pool,
+)
+from phil_output import (
+    start_live_condition_output,
+    append_live_condition_csv,
+    append_full_obj_csv,
+    new_speed_stats,
+    pool_speed_stats,
+    summary_row,
+    write_summary,
+)
+from phil_threshold import thresholding_files
+from phil_track import binned_settings, track_condition
+from phil_memory import memory_budget, plan_tracking
+
+# Watch mode, for analyzing movies while the microscope is still recording them
+#
+#   python3 phil_main.py --watch FOLDER --threshold 100
+#
+# Every few seconds the folder is checked for new .tif/.avi movies. A movie counts as finished once its size
+# and modified time stop changing between two checks, and then it's thresholded (with the threshold chosen
+# when the session starts) and tracked on its own. After every movie, its rows are added to its condition's
+# files (the same way the shards are merged, see phil_shard.py) and Summary.csv is rewritten from the running
+# totals, so everything is always up to date without re-reading the movies already done. The condition CSVs
+# are only rewritten when a movie needs a wider header than the ones before it (see append_live_condition_csv).
+# The rows are in the order the movies were tracked.
+
+
+def find_finished_movies(folder, last_seen):
+    """
+    Returns the movies in folder that haven't changed since the last check
+    last_seen is a dictionary of filepath -> (size, modified time) from the last check, which gets updated
+    """
+    finished = []
+
+    for filename in sorted(os.listdir(folder)):
+        filepath = os.path.join(folder, filename)
+        if os.path.splitext(filename)[1].lower() not in (".tif", ".tiff", ".avi"):
+            continue
+
+        try:
+            file_info = os.stat(filepath)
+        except FileNotFoundError:
+            continue
+
+        current = (file_info.st_size, file_info.st_mtime)
+        if file_info.st_size > 0 and last_seen.get(filepath) == current:
+            finished.append(filepath)
+
+        last_seen[filepath] = current
+
+    return finished
+
+
+def process_movie(
+    filepath, proper_name, file_num, settings, threshold_value, paths_dir
+):
+    # Thresholds (into the output folder, the current directory) and tracks one movie, with its results saved
+    # in the Movies folder. Returns what track_condition returns, and the movie's output path
+    filename = os.path.basename(filepath)
+    is_avi = filename.lower().endswith(".avi")
+
+    # No prefetching, since there's only one movie to read
+    thresholding_files(
+        [filepath],
+        threshold_value,
+        None,
+        is_avi,
+        settings["fps"],
+        0,
+        settings["sparse_masks"],
+        settings["avi_codec"],
+        settings["binning"],
+        memory_budget(settings),
+    )
+
+    if settings["sparse_masks"]:
+        filename = os.path.splitext(filename)[0] + ".npz"
+    thresh_path = os.path.abspath("Thresh-" + filename)
+    output_path = os.path.abspath(
+        os.path.join("Movies", os.path.splitext("Thresh-" + filename)[0])
+    )
+
+    # Binned movies are tracked with the pixel measurements rescaled to the binned pixels, within the memory
+    # budget (see phil_memory.py)
+    tracking_settings = plan_tracking(
+        {proper_name: [(file_num, thresh_path)]},
+        is_avi,
+        binned_settings(settings),
+        memory_budget(settings),
+    )
+
+    speed_stats, movie_exceptions, movie_filter_counts = track_condition(
+        proper_name,
+        [(file_num, thresh_path)],
+        tracking_settings,
+        is_avi,
+        paths_dir,
+        output_name=output_path,
+    )
+
+    return speed_stats, movie_exceptions, movie_filter_counts, output_path
+
+
+def watch_folder(folder, settings, threshold_value, poll_interval=5, idle_timeout=None):
+    """
+    watch_folder takes in:
+        folder -> folder the microscope saves movies into
+        settings -> dict of the Phil settings
+        threshold_value -> threshold used for every movie in the session
+        poll_interval -> seconds between checks of the folder
+        idle_timeout -> stop after this many seconds without a new movie (None keeps watching until Ctrl+C)
+
+    Saves everything into FOLDER/Watch-(date & time), and returns the output folder
+    """
+    tp.quiet()
+
+    folder = os.path.abspath(folder)
+    pattern = naming_pattern(settings["naming_convention"])
+
+    abs_time = datetime.now().strftime("%Y-%m-%d_%H.%M.%S")
+    output_dir = os.path.join(folder, f"Watch-{abs_time}")
+    os.makedirs(os.path.join(output_dir, "Movies"))
+    os.chdir(output_dir)
+
+    if settings["paths"]:
+        paths_dir = os.path.join(output_dir, "Path Images")
+        os.mkdir(paths_dir)
+    else:
+        paths_dir = None
+
+    cache_dir = NUMBA_CACHE_DIR if settings["numba_cache"] else None
+    if cache_dir is not None:
+        enable_kernel_cache(cache_dir)
+    warm_up_kernels(binned_settings(settings)["object_area"])
+
+    last_seen = {}
+    done = set()
+    condition_outputs = {}
+    condition_files = {}
+    condition_stats = {}
+    caught_exceptions = ""
+    filter_counts = {}
+    last_new_movie = time.monotonic()
+
+    print(f"Watching {folder} for new movies (Ctrl+C to stop)")
+
+    try:
+        while True:
+            for filepath in find_finished_movies(folder, last_seen):
+                if filepath in done:
+                    continue
+                done.add(filepath)
+                last_new_movie = time.monotonic()
+
+                filename = os.path.basename(filepath)
+                parsed = parse_filename(filename, pattern)
+                if parsed is None:
+                    caught_exceptions += f"{filename} was skipped because it doesn't follow the naming convention\n"
+                    continue
+
+                proper_name, file_num = parsed
+
+                # One bad movie shouldn't end the whole session, so any error is saved for the output file
+                try:
+                    speed_stats, movie_exceptions, movie_filter_counts, output_path = (
+                        process_movie(
+                            filepath,
+                            proper_name,
+                            file_num,
+                            settings,
+                            threshold_value,
+                            paths_dir,
+                        )
+                    )
+                except Exception as e:
+                    caught_exceptions += f"{filename} was skipped due to:\n{e}\n"
+                    continue
+
+                caught_exceptions += movie_exceptions
+                for name, count in movie_filter_counts.items():
+                    filter_counts[name] = filter_counts.get(name, 0) + count
+
+                # Adding the new movie's rows to its condition, and rewriting just the summary
+                if proper_name not in condition_outputs:
+                    condition_outputs[proper_name] = start_live_condition_output(
+                        proper_name, settings["full_obj_data"]
+                    )
+                    condition_files[proper_name] = 0
+                    condition_stats[proper_name] = new_speed_stats()
+
+                append_live_condition_csv(
+                    condition_outputs[proper_name], f"{output_path}.csv"
+                )
+                full_obj_path = f"{output_path}-Full Object Data.csv"
+                if os.path.exists(full_obj_path):
+                    append_full_obj_csv(condition_outputs[proper_name], full_obj_path)
+
+                condition_files[proper_name] += 1
+                pool_speed_stats(condition_stats[proper_name], speed_stats)
+
+                write_summary(
+                    [
+                        summary_row(
+                            name,
+                            condition_files[name],
+                            condition_stats[name],
+                        )
+                        for name in sorted(condition_stats)
+                    ]
+                )
+
+                print(
+                    f"{datetime.now().strftime('%H:%M:%S')}  Tracked {os.path.basename(filepath)} "
+                    f"({proper_name}: {condition_files[proper_name]} files)"
+                )
+
+            if (
+                idle_timeout is not None
+                and time.monotonic() - last_new_movie > idle_timeout
+            ):
+                break
+
+            time.sleep(poll_interval)
+
+    except KeyboardInterrupt:
+        pass
+
+    shutdown_locate_pool()
+
+    # Only sessions that tracked something are added to the results index
+    if len(condition_stats) > 0:
+        caught_exceptions += index_run(
+            output_dir, settings, threshold_value, errors=caught_exceptions
+        )
+
+    if caught_exceptions == "":
+        caught_exceptions = "None"
+
+    with open(f"PhilOutput-{abs_time}.txt", "w") as f:
+        f.write(f"""Watch session of {folder}
+
+Parameters used were:
+{json.dumps(settings, indent = 4)}
+Thresholding Value:
+{threshold_value}
+Removed by Filters (objects, and short_tracks in tracks):
+{json.dumps(filter_counts, indent = 4)}
+Errors:
+{caught_exceptions}
+""")
+
+    return output_dir